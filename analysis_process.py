@@ -0,0 +1,154 @@
+import multiprocessing
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+
+from color_stats import TiledColorStatistics
+
+def _analysis_loop(connection, tile_size):
+    """
+    The main loop of the analysis process. Attaches to the shared raster named in each request, re-histograms
+    the requested tiles straight from shared memory and sends back only the pitch probabilities and the scale.
+
+    Parameters:
+        connection (multiprocessing.connection.Connection): The pipe end to receive requests and send results on.
+        tile_size (int): The side length of a tile in pixels.
+    """
+    statistics = TiledColorStatistics(tile_size)
+    shm = None
+    image = None
+    try:
+        while True:
+            request = connection.recv()
+            if request is None:
+                break
+            (name, height, width), indices = request
+            if shm is None or shm.name != name:
+                # The raster was reallocated (resized), drop the views of the old block before closing it
+                image = None
+                if shm is not None:
+                    shm.close()
+                shm = shared_memory.SharedMemory(name=name)
+                image = np.ndarray((height, width, 3), dtype=np.uint8, buffer=shm.buf)
+            tiles = {(row, col): image[row * tile_size:(row + 1) * tile_size, col * tile_size:(col + 1) * tile_size]
+                     for row, col in indices}
+            try:
+                result = statistics.update((height, width), tiles)
+            except Exception as e:
+                result = e
+            tiles = None
+            connection.send(result)
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        image = None
+        if shm is not None:
+            shm.close()
+
+class AnalysisProcess:
+    """
+    Runs the color analysis in a separate process, so the NumPy and OpenCV work and its Python glue do not compete
+    with the Tk event loop for the GIL. Frames are not sent to the process, it reads the dirty tiles directly from the
+    shared memory raster of a CanvasRaster created with shared=True, and only the small result comes back.
+    A process that died or stopped answering is replaced by restart().
+
+    Attributes:
+        process (multiprocessing.Process): The analysis process.
+        connection (multiprocessing.connection.Connection): The pipe end used to talk to the process.
+        timeout (float): The time in seconds to wait for the result of an update.
+        closed (bool): Whether close() was called.
+    """
+    def __init__(self, tile_size, timeout=10.0):
+        """
+        Starts the analysis process.
+
+        Parameters:
+            tile_size (int): The side length of a tile in pixels, must match the raster.
+            timeout (float): The time in seconds to wait for the result of an update.
+        """
+        self.tile_size = tile_size
+        self.timeout = timeout
+        self.closed = False
+        self.lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        # Spawn instead of fork, forking a process that runs Tk and threads is unsafe
+        context = multiprocessing.get_context('spawn')
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_analysis_loop, args=(child_connection, self.tile_size),
+                                       name="analysis-process", daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def _stop(self, timeout):
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+        if self.process.is_alive():
+            # A stopped process only handles SIGTERM once it continues
+            self.process.kill()
+            self.process.join()
+
+    def update(self, layout, indices):
+        """
+        Has the process re-histogram the given tiles and returns the updated statistics.
+
+        Parameters:
+            layout (tuple): The shared memory name, height and width of the raster.
+            indices (set): The (row, column) indices of the dirty tiles.
+
+        Returns:
+            tuple: A tuple containing a list of pitch probabilities and the determined musical scale ('min' or 'maj').
+
+        Raises:
+            EOFError, OSError: If the process died, or TimeoutError if it did not answer in time. It must be
+                               restarted before the next update.
+            Exception: Whatever the analysis raised in the process, which keeps running.
+        """
+        with self.lock:
+            self.connection.send((layout, indices))
+            if not self.connection.poll(self.timeout):
+                raise TimeoutError(f"The analysis process did not answer within {self.timeout}s")
+            result = self.connection.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def restart(self):
+        """
+        Replaces the process by a fresh one, after it died or stopped answering. The new process starts without
+        statistics, so every tile must be sent again. Does nothing once the process was closed.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.process.terminate()
+            self._stop(1)
+            self.connection.close()
+            self._start()
+
+    def close(self, timeout=1):
+        """
+        Stops the analysis process. An update waiting for a hung process does not block the shutdown, the process
+        is terminated instead.
+
+        Parameters:
+            timeout (float): The time in seconds to wait for the process to exit before terminating it.
+        """
+        self.closed = True
+        if self.lock.acquire(timeout=timeout):
+            try:
+                self.connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            finally:
+                self.lock.release()
+        self._stop(timeout)
+        # An update stuck on the process returns once it is gone, then the pipe can be closed
+        if self.lock.acquire(timeout=timeout):
+            try:
+                self.connection.close()
+            finally:
+                self.lock.release()
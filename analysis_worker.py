@@ -0,0 +1,133 @@
+import threading
+import time
+
+class LatestWinsWorker:
+    """
+    A single long-lived worker thread fed through a single-slot mailbox.
+    Submitting a frame while another one is still waiting replaces the waiting frame (or merges the two if a
+    merge function is given), so the amount of pending work stays bounded no matter how slow the analysis is.
+
+    Attributes:
+        process (callable): The function called with each frame on the worker thread.
+        merge (callable): Optional function combining the waiting frame with a newer one.
+        submitted (int): The number of frames submitted.
+        processed (int): The number of frames processed.
+        dropped (int): The number of frames that were not processed on their own because a newer frame replaced
+                       them or was merged with them, so processed + dropped never exceeds submitted.
+        coalesced (int): The number of the dropped frames whose content was merged into a newer one.
+        last_latency (float): The duration of the last run in seconds.
+        max_latency (float): The longest run in seconds.
+        total_latency (float): The sum of all run durations in seconds.
+    """
+    def __init__(self, process, merge=None, name="analysis-worker"):
+        """
+        Initializes the mailbox and starts the worker thread.
+
+        Parameters:
+            process (callable): The function called with each frame on the worker thread.
+            merge (callable): Optional function taking the waiting frame and a newer one and returning the frame
+                              to keep. Without it, the newer frame replaces the waiting one.
+            name (str): The name of the worker thread.
+        """
+        self.process = process
+        self.merge = merge
+        self.condition = threading.Condition()
+        self.frame = None
+        self.has_frame = False
+        self.running = True
+        self.submitted = 0
+        self.processed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame):
+        """
+        Puts a frame into the mailbox, replacing or merging with any frame that has not been processed yet.
+
+        Parameters:
+            frame: The frame to process.
+        """
+        with self.condition:
+            self.submitted += 1
+            if self.has_frame:
+                if self.merge is not None:
+                    frame = self.merge(self.frame, frame)
+                    self.coalesced += 1
+                self.dropped += 1
+            self.frame = frame
+            self.has_frame = True
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.has_frame:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                frame = self.frame
+                self.frame = None
+                self.has_frame = False
+
+            start = time.perf_counter()
+            try:
+                self.process(frame)
+            except Exception as e:
+                print(f"Error in {self.thread.name}: {e}")
+            latency = time.perf_counter() - start
+
+            with self.condition:
+                self.processed += 1
+                self.last_latency = latency
+                self.max_latency = max(self.max_latency, latency)
+                self.total_latency += latency
+
+    def stop(self, timeout=None):
+        """
+        Stops the worker thread, discarding any frame that is still waiting.
+
+        Parameters:
+            timeout (float): The maximum time in seconds to wait for the current run to finish.
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout)
+
+    def stats(self):
+        """
+        Returns the counters and latencies of the worker.
+
+        Returns:
+            dict: The submitted, processed, dropped and coalesced frame counts and the last, mean and maximum
+                  run latency in milliseconds.
+        """
+        with self.condition:
+            mean_latency = self.total_latency / self.processed if self.processed else 0.0
+            return {
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "last_latency_ms": self.last_latency * 1000,
+                "mean_latency_ms": mean_latency * 1000,
+                "max_latency_ms": self.max_latency * 1000,
+            }
+
+    def format_stats(self):
+        """
+        Formats the worker statistics as a single line for logging.
+
+        Returns:
+            str: The formatted statistics.
+        """
+        stats = self.stats()
+        return (f"{self.thread.name}: processed={stats['processed']}/{stats['submitted']} "
+                f"dropped={stats['dropped']} coalesced={stats['coalesced']} "
+                f"latency last={stats['last_latency_ms']:.1f}ms mean={stats['mean_latency_ms']:.1f}ms "
+                f"max={stats['max_latency_ms']:.1f}ms")
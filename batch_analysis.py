@@ -0,0 +1,217 @@
+import argparse
+import glob
+import importlib.util
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import cv2
+
+from color_stats import get_color_statistics, SampledColorStatistics
+from stroke_features import calculate_duration
+from utils import PITCH_CLASSES
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp'}
+
+_sampler = None
+
+def iter_image_paths(inputs):
+    """
+    Expands directories (recursively) and glob patterns into image file paths.
+
+    Parameters:
+        inputs (list): Directories, glob patterns or file paths.
+
+    Returns:
+        generator: The image paths, in sorted order per input, without duplicates.
+    """
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            paths = (os.path.join(root, name) for root, _, names in os.walk(item) for name in names)
+        else:
+            paths = glob.iglob(item, recursive=True)
+        for path in sorted(paths):
+            if os.path.isfile(path) and os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS and path not in seen:
+                seen.add(path)
+                yield path
+
+def load_completed(jsonl_path):
+    """
+    Reads the paths that already have a result in a JSONL output file.
+    A truncated last line left by an interrupted run is ignored and its image analyzed again, and so are the
+    images that failed, so a resumed run retries them.
+
+    Parameters:
+        jsonl_path (str): The JSONL file.
+
+    Returns:
+        set: The completed image paths.
+    """
+    completed = set()
+    if not os.path.exists(jsonl_path):
+        return completed
+    with open(jsonl_path, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+                if "error" not in record:
+                    completed.add(record["path"])
+            except (ValueError, KeyError, TypeError):
+                continue
+    return completed
+
+def _init_worker(target_latency, max_error):
+    global _sampler
+    # Parallelism comes from the process pool, keep OpenCV from oversubscribing the cores
+    cv2.setNumThreads(1)
+    if target_latency is not None:
+        _sampler = SampledColorStatistics(target_latency=target_latency, max_error=max_error)
+
+def analyze_image(path, speed_measure=0):
+    """
+    Analyzes one image file the way the drawing app analyzes its canvas.
+
+    Parameters:
+        path (str): The image file.
+        speed_measure (float): The drawing speed to derive the note duration from.
+
+    Returns:
+        dict: The path, image size, pitch probabilities, scale, key, duration and, in sampled mode, the stride and
+              error estimate. The pitch probabilities and the key are None if the image has no colored pixels.
+              Contains an 'error' entry instead if the image could not be analyzed.
+    """
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        return {"path": path, "error": "unreadable image"}
+    try:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        result = {"path": path, "width": image.shape[1], "height": image.shape[0]}
+        # An image without colored pixels divides 0 by 0, it is detected below
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if _sampler is not None:
+                pitch_probabilities, scale, error_estimate = _sampler.analyze(image)
+                result["stride"] = _sampler.stride
+                result["error_estimate"] = error_estimate
+            else:
+                pitch_probabilities, scale = get_color_statistics(image)
+        pitch_probabilities = [float(p) for p in pitch_probabilities]
+        if not sum(pitch_probabilities) > 0:
+            # Nothing colored (e.g. an all-black image), so there is no pitch distribution and no key
+            pitch_probabilities = None
+        result.update({
+            "pitch_probabilities": pitch_probabilities,
+            "scale": scale,
+            "key": PITCH_CLASSES[int(np.argmax(pitch_probabilities))] if pitch_probabilities else None,
+            "duration": calculate_duration(speed_measure),
+        })
+        return result
+    except Exception as e:
+        return {"path": path, "error": str(e)}
+
+def _analyze_task(task):
+    return analyze_image(*task)
+
+def check_parquet_engine():
+    """
+    Checks that pandas can write Parquet, before any image is analyzed.
+
+    Raises:
+        ImportError: If neither pyarrow nor fastparquet is installed.
+    """
+    if not any(importlib.util.find_spec(engine) for engine in ("pyarrow", "fastparquet")):
+        raise ImportError("Writing Parquet requires pyarrow or fastparquet, install one or write a .jsonl output")
+
+def write_parquet(jsonl_path, parquet_path):
+    """
+    Converts the JSONL results into a Parquet file, one column per pitch probability.
+    Rows of an existing Parquet file from an earlier run are kept, unless a retried image has a newer result.
+
+    Parameters:
+        jsonl_path (str): The JSONL results.
+        parquet_path (str): The Parquet file to write.
+    """
+    import pandas as pd
+    df = pd.read_json(jsonl_path, lines=True) if os.path.getsize(jsonl_path) else pd.DataFrame()
+    if "pitch_probabilities" in df:
+        pitch_probabilities = df.pop("pitch_probabilities").apply(lambda p: p if isinstance(p, list) else [None] * len(PITCH_CLASSES))
+        probabilities = pd.DataFrame(pitch_probabilities.tolist(), columns=[f"p_{pitch}" for pitch in PITCH_CLASSES], index=df.index)
+        df = pd.concat([df, probabilities], axis=1)
+    if os.path.exists(parquet_path):
+        df = pd.concat([pd.read_parquet(parquet_path), df], ignore_index=True)
+    if "path" in df:
+        df = df.drop_duplicates("path", keep="last")
+    df.to_parquet(parquet_path, index=False)
+
+def run(inputs, output, workers=None, speed_measure=0, target_latency=None, max_error=0.01, chunksize=16):
+    """
+    Analyzes all images on a process pool and appends the results to the output as they complete.
+
+    Parameters:
+        inputs (list): Directories, glob patterns or file paths.
+        output (str): The output file, '.parquet' writes Parquet through an intermediate '.partial.jsonl' file.
+        workers (int): The number of processes, all cores by default.
+        speed_measure (float): The drawing speed to derive the note duration from.
+        target_latency (float): Enables strided analysis with this per-image latency target.
+        max_error (float): The accuracy bound of the strided analysis.
+        chunksize (int): The number of images handed to a worker at once.
+
+    Returns:
+        tuple: The number of images analyzed in this run and the number skipped as already completed.
+
+    Raises:
+        ImportError: If the output is Parquet and no Parquet engine is installed.
+    """
+    parquet = output.endswith('.parquet')
+    if parquet:
+        check_parquet_engine()
+    jsonl_path = output + '.partial.jsonl' if parquet else output
+    completed = load_completed(jsonl_path)
+    if parquet and os.path.exists(output):
+        import pandas as pd
+        done = pd.read_parquet(output)
+        if "error" in done:
+            done = done[done["error"].isna()]
+        completed |= set(done["path"])
+    tasks = [(path, speed_measure) for path in iter_image_paths(inputs) if path not in completed]
+
+    analyzed = 0
+    with open(jsonl_path, 'a+b') as file:
+        # Terminate a line truncated by an interrupted run, so the next result starts on a line of its own
+        if file.tell() > 0:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b'\n':
+                file.write(b'\n')
+    with open(jsonl_path, 'a') as file, Pool(workers, initializer=_init_worker, initargs=(target_latency, max_error)) as pool:
+        for result in pool.imap_unordered(_analyze_task, tasks, chunksize=chunksize):
+            file.write(json.dumps(result) + '\n')
+            file.flush()
+            analyzed += 1
+            if analyzed % 1000 == 0:
+                print(f"BATCH: {analyzed}/{len(tasks)} images analyzed")
+
+    if parquet:
+        write_parquet(jsonl_path, output)
+        os.remove(jsonl_path)
+    return analyzed, len(completed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-compute ChromaTone musical parameters for image archives.")
+    parser.add_argument("inputs", nargs="+", help="directories, glob patterns or image files")
+    parser.add_argument("-o", "--output", required=True, help="output .jsonl or .parquet file, resumed if it exists")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("--speed", type=float, default=0, help="drawing speed used to derive the note duration")
+    parser.add_argument("--target-latency", type=float, default=None,
+                        help="analyze a strided view chosen to meet this per-image latency in seconds")
+    parser.add_argument("--max-error", type=float, default=0.01, help="accuracy bound of the strided analysis")
+    args = parser.parse_args()
+
+    try:
+        analyzed, skipped = run(args.inputs, args.output, args.workers, args.speed, args.target_latency, args.max_error)
+    except ImportError as e:
+        parser.error(str(e))
+    print(f"BATCH: analyzed {analyzed} images, skipped {skipped} already completed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+import cv2
+
+TILE_SIZE = 128
+
+def hex_to_rgb(color):
+    """
+    Converts a Tk hexadecimal color string to an RGB tuple.
+
+    Parameters:
+        color (str): The color in '#RRGGBB' format.
+
+    Returns:
+        tuple: The (red, green, blue) components as integers.
+    """
+    color = color.lstrip('#')
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+class CanvasRaster:
+    """
+    An in-memory RGB mirror of the drawing canvas.
+    Every stroke drawn on the Tk canvas is replayed here with the equivalent OpenCV primitive,
+    so the analysis can read the canvas content straight from memory without a screen capture or a display.
+
+    The raster is divided into square tiles, and every drawing operation marks the tiles it touches as dirty
+    so the analysis only has to revisit the parts of the canvas that changed.
+
+    A shared raster lives in a multiprocessing.shared_memory block, so an analysis process can read it without copying.
+    A resize moves the raster to a new block. A block that was handed out by collect_dirty_tile_indices() is retired
+    instead of released, because requests naming it may still be on their way to the reader, and is only released by
+    release_retired() once the reader is done with it. A block no request named is released right away, so resizing
+    the window continuously does not pile up blocks.
+
+    Attributes:
+        image (numpy.ndarray): The RGB raster of shape (height, width, 3), black when empty.
+        shm (SharedMemory): The shared memory block backing the image, None unless the raster is shared.
+        retired (list): The shared memory blocks replaced by resizes and not released yet, oldest first.
+        requested (set): The names of the shared memory blocks handed out by collect_dirty_tile_indices().
+        lock (threading.Lock): Guards the raster against concurrent drawing and reading.
+        tile_size (int): The side length of a tile in pixels.
+        dirty_tiles (set): The (row, column) indices of the tiles changed since they were last collected.
+        version (int): A counter incremented by every change to the raster, usable as a cheap change signature.
+    """
+    def __init__(self, width, height, tile_size=TILE_SIZE, shared=False):
+        """
+        Initializes an empty (black) raster with every tile marked dirty.
+
+        Parameters:
+            width (int): The width of the canvas in pixels.
+            height (int): The height of the canvas in pixels.
+            tile_size (int): The side length of a tile in pixels.
+            shared (bool): Whether to back the raster with shared memory.
+        """
+        self.lock = threading.Lock()
+        self.tile_size = tile_size
+        self.shared = shared
+        self.shm = None
+        self.retired = []
+        self.requested = set()
+        self.image, self.shm = self._allocate(width, height)
+        self.dirty_tiles = set()
+        self.version = 0
+        self._mark_all_dirty()
+
+    @property
+    def width(self):
+        return self.image.shape[1]
+
+    @property
+    def height(self):
+        return self.image.shape[0]
+
+    def _allocate(self, width, height):
+        """
+        Allocates a black image, in a new shared memory block if the raster is shared.
+
+        Returns:
+            tuple: The image and its shared memory block (None if not shared).
+        """
+        if not self.shared:
+            return np.zeros((height, width, 3), dtype=np.uint8), None
+        shm = shared_memory.SharedMemory(create=True, size=max(1, height * width * 3))
+        image = np.ndarray((height, width, 3), dtype=np.uint8, buffer=shm.buf)
+        image[:] = 0
+        return image, shm
+
+    def _release(self, shm):
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    @property
+    def layout(self):
+        """
+        The shared memory name, height and width of the raster, everything needed to attach to it from another process.
+        """
+        return self.shm.name, self.height, self.width
+
+    def resize(self, width, height):
+        """
+        Resizes the raster to the new canvas size, keeping the content of the overlapping area.
+
+        Parameters:
+            width (int): The new width in pixels.
+            height (int): The new height in pixels.
+        """
+        with self.lock:
+            if (height, width) == self.image.shape[:2]:
+                return
+            image, shm = self._allocate(width, height)
+            h = min(height, self.height)
+            w = min(width, self.width)
+            image[:h, :w] = self.image[:h, :w]
+            old_shm = self.shm
+            self.image, self.shm = image, shm
+            if old_shm is not None:
+                if old_shm.name in self.requested:
+                    self.retired.append(old_shm)
+                else:
+                    self._release(old_shm)
+            self.version += 1
+            self._mark_all_dirty()
+
+    def release_retired(self, layout):
+        """
+        Releases the retired shared memory blocks older than a layout once a reader has processed a request for it.
+        Requests are processed in order, so no request naming an older block can follow.
+
+        Parameters:
+            layout (tuple): The layout of the request the reader answered, as returned by collect_dirty_tile_indices.
+        """
+        with self.lock:
+            names = [shm.name for shm in self.retired]
+            if self.shm is not None and layout[0] == self.shm.name:
+                keep = len(names)
+            elif layout[0] in names:
+                keep = names.index(layout[0])
+            else:
+                keep = 0
+            released, self.retired = self.retired[:keep], self.retired[keep:]
+            self.requested.difference_update(shm.name for shm in released)
+        for shm in released:
+            self._release(shm)
+
+    def restore_dirty_tiles(self, layout, indices=None):
+        """
+        Marks tiles dirty again after a reader failed to process them, so the next collection includes them.
+
+        Parameters:
+            layout (tuple): The layout or shape the tiles were collected for. If the raster was resized since,
+                            every tile is dirty already and nothing is done.
+            indices (set): The (row, column) indices of the tiles, all tiles if None, e.g. for a reader that
+                           lost its statistics.
+        """
+        with self.lock:
+            if tuple(layout[-2:]) != self.image.shape[:2]:
+                return
+            if indices is None:
+                self._mark_all_dirty()
+            else:
+                self.dirty_tiles |= indices
+
+    def _mark_all_dirty(self):
+        rows = -(-self.height // self.tile_size)
+        cols = -(-self.width // self.tile_size)
+        self.dirty_tiles = {(row, col) for row in range(rows) for col in range(cols)}
+
+    def _mark_dirty(self, x0, y0, x1, y1):
+        """
+        Marks every tile overlapping the bounding box (x0, y0)-(x1, y1) as dirty and bumps the version.
+        Must be called with the lock held.
+        """
+        x0, x1 = max(0, int(x0)), min(self.width - 1, int(x1))
+        y0, y1 = max(0, int(y0)), min(self.height - 1, int(y1))
+        self.version += 1
+        if x0 > x1 or y0 > y1:
+            return
+        for row in range(y0 // self.tile_size, y1 // self.tile_size + 1):
+            for col in range(x0 // self.tile_size, x1 // self.tile_size + 1):
+                self.dirty_tiles.add((row, col))
+
+    def draw_line(self, x0, y0, x1, y1, color, size):
+        """
+        Draws a line segment with round caps, mirroring Canvas.create_line.
+
+        Parameters:
+            x0, y0 (int): The start point of the segment.
+            x1, y1 (int): The end point of the segment.
+            color (str): The color in '#RRGGBB' format.
+            size (float): The width of the line.
+        """
+        thickness = max(1, round(size))
+        with self.lock:
+            cv2.line(self.image, (int(x0), int(y0)), (int(x1), int(y1)), hex_to_rgb(color), thickness)
+            margin = thickness // 2 + 1
+            self._mark_dirty(min(x0, x1) - margin, min(y0, y1) - margin, max(x0, x1) + margin, max(y0, y1) + margin)
+
+    def draw_oval(self, x, y, size, color):
+        """
+        Draws a filled circle centered on (x, y), mirroring Canvas.create_oval.
+
+        Parameters:
+            x, y (int): The center of the circle.
+            size (float): The radius of the circle.
+            color (str): The color in '#RRGGBB' format.
+        """
+        radius = max(1, round(size))
+        with self.lock:
+            cv2.circle(self.image, (int(x), int(y)), radius, hex_to_rgb(color), -1)
+            self._mark_dirty(x - radius - 1, y - radius - 1, x + radius + 1, y + radius + 1)
+
+    def draw_square(self, x, y, size, color):
+        """
+        Draws a filled square centered on (x, y), mirroring Canvas.create_rectangle.
+
+        Parameters:
+            x, y (int): The center of the square.
+            size (float): Half the side length of the square.
+            color (str): The color in '#RRGGBB' format.
+        """
+        size = round(size)
+        with self.lock:
+            cv2.rectangle(self.image, (int(x) - size, int(y) - size), (int(x) + size, int(y) + size), hex_to_rgb(color), -1)
+            self._mark_dirty(x - size - 1, y - size - 1, x + size + 1, y + size + 1)
+
+    def snapshot(self):
+        """
+        Returns a consistent copy of the raster that can be analyzed while drawing continues.
+
+        Returns:
+            numpy.ndarray: A copy of the RGB raster.
+        """
+        with self.lock:
+            return self.image.copy()
+
+    def collect_dirty_tiles(self):
+        """
+        Copies the content of every dirty tile and marks all tiles clean again.
+
+        Returns:
+            tuple: The (height, width) of the raster and a dictionary mapping (row, column) tile indices
+                   to copies of the tile content.
+        """
+        with self.lock:
+            tiles = {}
+            for row, col in self.dirty_tiles:
+                y, x = row * self.tile_size, col * self.tile_size
+                tiles[(row, col)] = self.image[y:y + self.tile_size, x:x + self.tile_size].copy()
+            self.dirty_tiles = set()
+            return self.image.shape[:2], tiles
+
+    def collect_dirty_tile_indices(self):
+        """
+        Returns the dirty tiles of a shared raster without copying them and marks all tiles clean again.
+        Tiles drawn to after this call are marked dirty again, so a reader that races with drawing
+        only ever sees content that is re-read on the next collection.
+
+        Returns:
+            tuple: The layout of the raster and the set of (row, column) indices of the dirty tiles.
+        """
+        with self.lock:
+            indices = self.dirty_tiles
+            self.dirty_tiles = set()
+            self.requested.add(self.shm.name)
+            return self.layout, indices
+
+    def close(self):
+        """
+        Releases the shared memory blocks of a shared raster, including the retired ones.
+        """
+        with self.lock:
+            blocks = self.retired + [self.shm]
+            self.image = np.zeros((0, 0, 3), dtype=np.uint8)
+            self.shm = None
+            self.retired = []
+            self.requested = set()
+            for shm in blocks:
+                self._release(shm)
+
+def merge_tile_frames(older, newer):
+    """
+    Merges two collections of dirty tiles so that no change is lost when an older one was never analyzed.
+
+    Parameters:
+        older (tuple): The (shape, tiles) or (layout, indices) collected first.
+        newer (tuple): The (shape, tiles) or (layout, indices) collected afterwards.
+
+    Returns:
+        tuple: The merged collection, newer tile contents take precedence.
+    """
+    older_shape, older_tiles = older
+    newer_shape, newer_tiles = newer
+    if older_shape != newer_shape:
+        # A resize marks every tile dirty, so the newer collection is complete on its own
+        return newer
+    if isinstance(newer_tiles, set):
+        return newer_shape, older_tiles | newer_tiles
+    return newer_shape, {**older_tiles, **newer_tiles}
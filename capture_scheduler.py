@@ -0,0 +1,124 @@
+import threading
+import time
+
+class AdaptiveCaptureScheduler:
+    """
+    Chooses when to capture and analyze the canvas based on drawing activity.
+    While the user is drawing, captures run at the minimum delay. Once drawing stops, the delay doubles after
+    every capture that finds nothing changed, up to the maximum delay. Captures whose change signature equals the
+    last one that was sent, or the one still being sent, are skipped entirely, so an idle canvas costs neither
+    analysis nor network traffic. A signature only counts as sent once confirm() is called, so a capture whose
+    analysis or send failed is retried, backing off like an unchanged capture.
+
+    Attributes:
+        min_delay (int): The capture delay in milliseconds while drawing.
+        max_delay (int): The capture delay in milliseconds the idle back-off stops at.
+        active_window (float): The time in seconds after the last paint event during which drawing counts as active.
+        backoff (float): The factor the delay grows by after every unchanged capture.
+        delay (int): The current capture delay in milliseconds.
+        last_activity (float): The monotonic time of the last paint event.
+        last_signature: The change signature of the last capture that was analyzed and sent.
+        pending_signature: The change signature of the capture being analyzed and sent, None if there is none.
+        skipped (int): The number of captures skipped because nothing changed.
+        last_immediate (float): The monotonic time of the last capture brought forward by request_immediate().
+    """
+    def __init__(self, min_delay=200, max_delay=4000, active_window=0.5, backoff=2.0):
+        """
+        Initializes the scheduler in the idle state.
+
+        Parameters:
+            min_delay (int): The capture delay in milliseconds while drawing.
+            max_delay (int): The capture delay in milliseconds the idle back-off stops at.
+            active_window (float): The time in seconds after the last paint event during which drawing counts as active.
+            backoff (float): The factor the delay grows by after every unchanged capture.
+        """
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.active_window = active_window
+        self.backoff = backoff
+        self.delay = min_delay
+        self.last_activity = None
+        self.last_signature = None
+        self.pending_signature = None
+        self.skipped = 0
+        self.last_immediate = None
+        # confirm() and fail() are called from the analysis worker thread
+        self.lock = threading.Lock()
+
+    def is_active(self):
+        """
+        Returns whether a paint event happened within the active window.
+        """
+        return self.last_activity is not None and time.monotonic() - self.last_activity < self.active_window
+
+    def notify_activity(self):
+        """
+        Records a paint event.
+
+        Returns:
+            bool: True if drawing just resumed after an idle period and the pending capture should be brought forward.
+        """
+        resumed = not self.is_active() and self.delay > self.min_delay
+        self.last_activity = time.monotonic()
+        if resumed:
+            self.delay = self.min_delay
+        return resumed
+
+    def request_immediate(self):
+        """
+        Asks to capture right away, e.g. because the trend changed. Granted at most once per minimum delay,
+        so a stroke wobbling around a trend boundary does not cause a burst of captures. A refused request is
+        picked up by the next regular capture, which is at most the minimum delay away while drawing.
+
+        Returns:
+            bool: True if the capture should be brought forward.
+        """
+        now = time.monotonic()
+        if self.last_immediate is not None and now - self.last_immediate < self.min_delay / 1000:
+            return False
+        self.last_immediate = now
+        return True
+
+    def should_capture(self, signature):
+        """
+        Decides whether a capture is needed and updates the delay until the next one.
+
+        Parameters:
+            signature: A cheap, hashable summary of everything the analysis depends on.
+
+        Returns:
+            bool: True if the signature differs from the last sent capture and from the one being sent.
+                  The caller must report the outcome with confirm() or fail().
+        """
+        with self.lock:
+            changed = signature != self.last_signature and signature != self.pending_signature
+            if changed:
+                self.pending_signature = signature
+            else:
+                self.skipped += 1
+
+            if self.is_active():
+                self.delay = self.min_delay
+            elif not changed:
+                self.delay = min(self.max_delay, int(self.delay * self.backoff))
+            return changed
+
+    def confirm(self, signature):
+        """
+        Records that the capture with the given signature was analyzed and sent.
+        """
+        with self.lock:
+            self.last_signature = signature
+            if self.pending_signature == signature:
+                self.pending_signature = None
+
+    def fail(self, signature):
+        """
+        Records that the capture with the given signature could not be analyzed or sent, so the next capture
+        retries it. The delay backs off, so a missing generator is not retried at the full capture rate.
+        """
+        with self.lock:
+            if self.pending_signature == signature:
+                self.pending_signature = None
+            if not self.is_active():
+                self.delay = min(self.max_delay, int(self.delay * self.backoff))
@@ -0,0 +1,299 @@
+import math
+import threading
+import time
+import numpy as np
+import cv2
+
+from utils import color_ranges, color_notes, PITCH_CLASSES
+
+def build_hue_lut(color_ranges):
+    """
+    Compiles the hue ranges into a lookup table that maps every 8-bit hue value to a color index.
+
+    Parameters:
+        color_ranges (dict): A dictionary defining the hue ranges for each color.
+
+    Returns:
+        tuple: The lookup table (numpy.ndarray of 256 uint8 entries) and the list of color names it indexes.
+               Index len(color_ranges) is reserved for white, hue values outside every range map to len(color_ranges) + 1.
+    """
+    colors = list(color_ranges)
+    lut = np.full(256, len(colors) + 1, dtype=np.uint8)
+    for index, ranges in enumerate(color_ranges.values()):
+        if isinstance(ranges, tuple):
+            ranges = [ranges]
+        for lower_bound, upper_bound in ranges:
+            lut[lower_bound:upper_bound + 1] = index
+    return lut, colors
+
+HUE_LUT, LUT_COLORS = build_hue_lut(color_ranges)
+
+# Histogram bins: one per hue color, then white, then everything that is not counted (black or unmatched)
+COLOR_BINS = LUT_COLORS + ['white']
+WHITE_INDEX = len(LUT_COLORS)
+IGNORED_INDEX = WHITE_INDEX + 1
+N_BINS = IGNORED_INDEX + 1
+
+def color_histogram(hsv_image):
+    """
+    Classifies every pixel of an HSV image into a color bin in a single vectorized pass.
+    Black pixels (value < 25) are ignored and white pixels (value > 204, saturation < 25) go to the white bin,
+    all other pixels are binned by hue through the precompiled lookup table.
+
+    Parameters:
+        hsv_image (numpy.ndarray): The image in OpenCV HSV format (uint8).
+
+    Returns:
+        tuple: The per-bin pixel counts (numpy.ndarray of length N_BINS) and the sum of the value channel.
+    """
+    hue_channel, saturation_channel, value_channel = cv2.split(hsv_image)
+    bins = cv2.LUT(hue_channel, HUE_LUT)
+    bins[(value_channel > 204) & (saturation_channel < 25)] = WHITE_INDEX
+    bins[value_channel < 25] = IGNORED_INDEX
+    counts = np.bincount(bins.ravel(), minlength=N_BINS)
+    return counts, float(np.sum(value_channel, dtype=np.uint64))
+
+def histogram_to_color_counts(counts):
+    """
+    Converts a bin count array into a dictionary of color counts.
+
+    Parameters:
+        counts (numpy.ndarray): The per-bin pixel counts as returned by color_histogram.
+
+    Returns:
+        dict: A dictionary with color names as keys and their respective counts as values.
+    """
+    return {color: counts[index] for index, color in enumerate(COLOR_BINS)}
+
+def scale_from_brightness(average_brightness):
+    """
+    Determines the musical scale from the average brightness of the canvas.
+
+    Parameters:
+        average_brightness (float): The mean of the value channel.
+
+    Returns:
+        str: 'min' for dark canvases, 'maj' otherwise.
+    """
+    return 'min' if average_brightness < 127 else 'maj'
+
+def calculate_pitch_probabilities(color_counts, color_notes=color_notes):
+    """
+    Calculates the probabilities of each pitch class based on color counts.
+
+    Parameters:
+        color_counts (dict): A dictionary with color names as keys and their respective counts as values.
+        color_notes (dict): A dictionary mapping color names to musical notes.
+
+    Returns:
+        list: A list of probabilities for each pitch class.
+    """
+    temp_total = sum(color_counts.values())
+    pitch_probabilities = [color_counts[color_notes[pitch]] / temp_total for pitch in PITCH_CLASSES]
+    return pitch_probabilities
+
+def get_color_statistics(image, stride=1):
+    """
+    Analyzes an image to determine pitch probabilities and musical scale based on color distribution.
+
+    Parameters:
+        image (numpy.ndarray): The RGB image to analyze.
+        stride (int): Only every stride-th pixel in each direction is analyzed. 1 analyzes the full resolution.
+
+    Returns:
+        tuple: A tuple containing a list of pitch probabilities and the determined musical scale ('min' or 'maj').
+    """
+    if stride > 1:
+        image = np.ascontiguousarray(image[::stride, ::stride])
+    hsv_image = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+    counts, value_sum = color_histogram(hsv_image)
+    average_brightness = value_sum / (hsv_image.shape[0] * hsv_image.shape[1])
+
+    color_counts = histogram_to_color_counts(counts)
+    pitch_probabilities = calculate_pitch_probabilities(color_counts, color_notes)
+
+    return pitch_probabilities, scale_from_brightness(average_brightness)
+
+def estimate_sampling_error(pitch_probabilities, sampled_count, stride, z=1.96):
+    """
+    Estimates how far the pitch probabilities of a strided analysis may be from the full resolution result.
+    Treats the sampled colored pixels as a sample without replacement of all colored pixels, so the estimate
+    is the confidence half-width of the largest pitch probability error. Strokes much thinner than the stride
+    can be missed entirely, which the estimate does not account for.
+
+    Parameters:
+        pitch_probabilities (list): The pitch probabilities of the strided analysis.
+        sampled_count (int): The number of colored (non-black) pixels that were sampled.
+        stride (int): The stride the image was sampled with.
+        z (float): The z-score of the confidence level, 1.96 for 95%.
+
+    Returns:
+        float: The estimated maximum absolute error of a pitch probability, 0 at full resolution.
+    """
+    if stride <= 1:
+        return 0.0
+    if sampled_count == 0:
+        return 1.0
+    population = sampled_count * stride * stride
+    finite_population_correction = math.sqrt((population - sampled_count) / max(1, population - 1))
+    worst_variance = max(p * (1 - p) for p in pitch_probabilities)
+    return z * math.sqrt(worst_variance / sampled_count) * finite_population_correction
+
+def measure_sampling_error(image, stride):
+    """
+    Measures the actual error of a strided analysis by comparing it with the full resolution analysis.
+
+    Parameters:
+        image (numpy.ndarray): The RGB image to analyze.
+        stride (int): The stride to evaluate.
+
+    Returns:
+        float: The maximum absolute difference between the strided and the full resolution pitch probabilities.
+    """
+    full, _ = get_color_statistics(image)
+    sampled, _ = get_color_statistics(image, stride)
+    return max(abs(a - b) for a, b in zip(full, sampled))
+
+class SampledColorStatistics:
+    """
+    Analyzes frames on a strided view whose stride is chosen automatically from the frame size and a target latency.
+    The analysis throughput is measured on every run, and the stride is the smallest one expected to meet the
+    target latency. The stride is capped so that the estimated pitch probability error stays below max_error,
+    which takes precedence over the latency target.
+
+    Attributes:
+        target_latency (float): The analysis time in seconds to aim for.
+        max_error (float): The maximum estimated absolute error of a pitch probability that is accepted.
+        pixels_per_second (float): The measured analysis throughput, smoothed over runs.
+        colored_fraction (float): The fraction of non-black pixels in the last frame, used to bound the stride.
+        stride (int): The stride used for the last frame.
+        error_estimate (float): The estimated error of the last frame against full resolution.
+    """
+    def __init__(self, target_latency=0.02, max_error=0.01, pixels_per_second=100e6):
+        """
+        Initializes the sampler.
+
+        Parameters:
+            target_latency (float): The analysis time in seconds to aim for.
+            max_error (float): The maximum estimated absolute error of a pitch probability that is accepted.
+            pixels_per_second (float): The initial throughput guess, replaced by measurements after the first run.
+        """
+        self.target_latency = target_latency
+        self.max_error = max_error
+        self.pixels_per_second = pixels_per_second
+        self.colored_fraction = 1.0
+        self.stride = 1
+        self.error_estimate = 0.0
+
+    def choose_stride(self, shape):
+        """
+        Chooses the stride for a frame of the given shape.
+
+        Parameters:
+            shape (tuple): The (height, width) of the frame.
+
+        Returns:
+            int: The stride, at least 1.
+        """
+        pixels = shape[0] * shape[1]
+        latency_stride = math.sqrt(pixels / (self.target_latency * self.pixels_per_second))
+        # Worst case (p = 0.5) sample size for which the 95% error of a proportion stays below max_error
+        required_samples = (1.96 ** 2) * 0.25 / (self.max_error ** 2)
+        error_stride = math.sqrt(pixels * self.colored_fraction / required_samples)
+        return max(1, min(math.ceil(latency_stride), math.floor(error_stride)))
+
+    def analyze(self, image):
+        """
+        Analyzes a frame with an automatically chosen stride.
+
+        Parameters:
+            image (numpy.ndarray): The RGB image to analyze.
+
+        Returns:
+            tuple: The list of pitch probabilities, the musical scale ('min' or 'maj') and the error estimate.
+        """
+        self.stride = self.choose_stride(image.shape[:2])
+        start = time.perf_counter()
+        sampled = np.ascontiguousarray(image[::self.stride, ::self.stride])
+        hsv_image = cv2.cvtColor(sampled, cv2.COLOR_RGB2HSV)
+        counts, value_sum = color_histogram(hsv_image)
+        elapsed = time.perf_counter() - start
+
+        sampled_pixels = hsv_image.shape[0] * hsv_image.shape[1]
+        if elapsed > 0:
+            self.pixels_per_second = 0.5 * self.pixels_per_second + 0.5 * sampled_pixels / elapsed
+        colored_count = int(sampled_pixels - counts[IGNORED_INDEX])
+        self.colored_fraction = max(colored_count / sampled_pixels, 1 / sampled_pixels)
+
+        pitch_probabilities = calculate_pitch_probabilities(histogram_to_color_counts(counts), color_notes)
+        self.error_estimate = estimate_sampling_error(pitch_probabilities, colored_count, self.stride)
+        return pitch_probabilities, scale_from_brightness(value_sum / sampled_pixels), self.error_estimate
+
+class TiledColorStatistics:
+    """
+    Keeps the color histogram of a CanvasRaster per tile, so that only the tiles changed since the last
+    analysis have to be re-histogrammed. The per-tile counts are merged into running totals from which the
+    pitch probabilities and the brightness used for the scale decision are derived.
+
+    Attributes:
+        tile_size (int): The side length of a tile in pixels, must match the raster.
+        shape (tuple): The (height, width) of the analyzed raster.
+        tile_counts (numpy.ndarray): The per-tile bin counts of shape (rows, columns, N_BINS).
+        tile_value_sums (numpy.ndarray): The per-tile sums of the value channel of shape (rows, columns).
+        counts (numpy.ndarray): The bin counts over the whole raster.
+        value_sum (float): The sum of the value channel over the whole raster.
+    """
+    def __init__(self, tile_size):
+        """
+        Initializes empty statistics, the first update must contain every tile of the raster.
+
+        Parameters:
+            tile_size (int): The side length of a tile in pixels.
+        """
+        self.tile_size = tile_size
+        self.shape = None
+        self.lock = threading.Lock()
+
+    def _reset(self, shape):
+        rows = -(-shape[0] // self.tile_size)
+        cols = -(-shape[1] // self.tile_size)
+        self.shape = shape
+        self.tile_counts = np.zeros((rows, cols, N_BINS), dtype=np.int64)
+        self.tile_value_sums = np.zeros((rows, cols))
+        self.counts = np.zeros(N_BINS, dtype=np.int64)
+        self.value_sum = 0.0
+
+    def update(self, shape, tiles):
+        """
+        Re-histograms the given tiles and merges them into the totals.
+
+        Parameters:
+            shape (tuple): The (height, width) of the raster the tiles come from.
+            tiles (dict): A dictionary mapping (row, column) tile indices to RGB tile contents,
+                          as returned by CanvasRaster.collect_dirty_tiles.
+
+        Returns:
+            tuple: A tuple containing a list of pitch probabilities and the determined musical scale ('min' or 'maj').
+        """
+        with self.lock:
+            if shape != self.shape:
+                self._reset(shape)
+            for (row, col), tile in tiles.items():
+                counts, value_sum = color_histogram(cv2.cvtColor(tile, cv2.COLOR_RGB2HSV))
+                self.counts += counts - self.tile_counts[row, col]
+                self.value_sum += value_sum - self.tile_value_sums[row, col]
+                self.tile_counts[row, col] = counts
+                self.tile_value_sums[row, col] = value_sum
+            return self.statistics()
+
+    def statistics(self):
+        """
+        Derives the pitch probabilities and the scale from the current totals.
+
+        Returns:
+            tuple: A tuple containing a list of pitch probabilities and the determined musical scale ('min' or 'maj').
+        """
+        average_brightness = self.value_sum / (self.shape[0] * self.shape[1])
+        color_counts = histogram_to_color_counts(self.counts)
+        pitch_probabilities = calculate_pitch_probabilities(color_counts, color_notes)
+        return pitch_probabilities, scale_from_brightness(average_brightness)
@@ -1,136 +1,273 @@
+import os
 import socket
-import json
 import asyncio
+import signal
 import numpy as np
-import mido
-import time
 from mido import Message
+from midi_output import LivePortBackend, MidiFileBackend, NullBackend
+from midi_scheduler import MidiScheduler
+from midi_timing import TimingMonitor
 from motifs_gen import MotifGen
+from motif_pipeline import MotifPipeline
+from protocol import read_frame, decode_message, start_server, transport_address, HEARTBEAT_TIMEOUT
 
-global_close = False
+# Silence before every note of a motif, in seconds
+NOTE_GAP = 0.1
+# How often the MIDI timing statistics are printed in seconds, and an optional CSV file the timing trace is written to on exit
+MIDI_REPORT_INTERVAL = float(os.environ.get('CHROMATONE_MIDI_REPORT_INTERVAL', 30))
+MIDI_TRACE_PATH = os.environ.get('CHROMATONE_MIDI_TRACE')
+# 'live' plays on the IAC ports, 'file' records the session into CHROMATONE_MIDI_FILE, 'null' discards the output
+MIDI_BACKEND = os.environ.get('CHROMATONE_MIDI_BACKEND', 'live')
+MIDI_FILE_PATH = os.environ.get('CHROMATONE_MIDI_FILE', 'chromatone_session.mid')
 
 class PizzaComm:
-    def __init__(self, port_name_harp, port_name_drone):
-        # Initialize MIDI output ports for harp and drone
-        self.output_port_name_harp = port_name_harp
-        self.output_port_name_drone = port_name_drone
-        self.outport_harp = mido.open_output(self.output_port_name_harp)
-        self.outport_drone = mido.open_output(self.output_port_name_drone)
-
-    async def send_midi_note(self, note, velocity, duration):
-        # Send a note on message for harp
-        msg = Message('note_on', note=note, velocity=velocity)
-        self.outport_harp.send(msg)
-        time.sleep(duration)
-        # Send a note off message for harp
-        msg = Message('note_off', note=note, velocity=velocity)
-        self.outport_harp.send(msg)
-
-    async def send_midi_note_on(self, note, velocity):
-        # Send a note on message for drone
-        msg = Message('note_on', note=note, velocity=velocity)
-        self.outport_drone.send(msg)
-
-    async def send_midi_note_off(self, note, velocity):
-        # Send a note off message for drone
-        msg = Message('note_off', note=note, velocity=velocity)
-        self.outport_drone.send(msg)
+    def __init__(self, backend):
+        # The backend provides the harp and drone output ports and the scheduler that plays them
+        self.backend = backend
+        self.outport_harp = backend.harp
+        self.outport_drone = backend.drone
+        self.scheduler = backend.scheduler
+
+    def send_midi_note(self, note, velocity, start, duration, channel=0):
+        # Schedule a harp note starting at the given scheduler time
+        self.scheduler.schedule_note(self.outport_harp, note, velocity, start, duration, channel)
+
+    def send_midi_note_on(self, note, velocity, when, channel=0):
+        # Schedule a note on message for drone
+        msg = Message('note_on', note=note, velocity=velocity, channel=channel)
+        self.scheduler.schedule(when, self.outport_drone, msg)
+
+    def send_midi_note_off(self, note, velocity, when, channel=0):
+        # Schedule a note off message for drone
+        msg = Message('note_off', note=note, velocity=velocity, channel=channel)
+        self.scheduler.schedule(when, self.outport_drone, msg)
+
+    def close(self):
+        self.backend.close()
+
+class Session:
+    def __init__(self, session_id, channel, with_markov, writer, motif_gen=None):
+        # Every connected canvas gets its own generator and MIDI channel. The server builds the generator off the
+        # event loop and passes it in.
+        self.session_id = session_id
+        self.channel = channel
+        self.writer = writer
+        self.motif_gen = motif_gen if motif_gen is not None else MotifGen(with_markov=with_markov)
+        # Motifs are generated ahead so phrases follow each other without a gap
+        self.motifs = MotifPipeline(self.motif_gen)
+        self.closed = asyncio.Event()
+        self.notes_task = None
 
 class TCPComm:
-    def __init__(self, ip, port):
-        # Initialize a TCP socket
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.bind((ip, port))
-        self.sock.listen()
-        self.sock.setblocking(False)
-
-    async def check_for_incoming_data(self, motif_gen):
-        global global_close
-        loop = asyncio.get_running_loop()
-        while not global_close:
-            try:
-                # Accept a new connection
-                conn, _ = await loop.sock_accept(self.sock)
-                data_buffer = b""
-                with conn:
-                    conn.setblocking(False)
-                    while True:
-                        try:
-                            # Receive data in chunks
-                            data = await loop.sock_recv(conn, 1024)
-                            if not data:
-                                break
-                            data_buffer += data
-                        except BlockingIOError:
-                            await asyncio.sleep(0.1)
-                    if data_buffer:
-                        # Decode and process the received JSON data
-                        received_data = json.loads(data_buffer.decode('utf-8'))
-                        close = received_data.get("close")
-                        if close:
-                            conn.close()
-                            global_close = True
-                            pass
-                        else:
-                            probabilities = received_data.get("pitch_probabilities")
-                            trend = received_data.get("trend")
-                            scale = received_data.get("scale")
-                            duration = received_data.get("duration")
-                            active_color_flag = received_data.get("active_color_flag")
-                            if active_color_flag:
-                                key = received_data.get("key")
-                                motif_gen.set_key(key)
-                            motif_gen.set_active_color_flag(active_color_flag)
-                            motif_gen.set_probabilities(probabilities)
-                            motif_gen.set_trend(trend)
-                            motif_gen.set_scale(scale)
-                            motif_gen.set_duration(duration)
-                            print("CONNECT: Received data")
-            except socket.error as e:
-                print('CONNETC: Error:', e)
-            await asyncio.sleep(0.1)
-
-async def send_notes(pizza_comm, motif_gen):
-    global global_close
+    def __init__(self, transport, address, pizza_comm, with_markov=True, shutdown_on_last_close=True):
+        # One server for any number of drawing stations, over TCP or a Unix domain socket. With shutdown_on_last_close
+        # the generator exits once the last station has sent its close message, which is what launch_app.sh relies on.
+        self.transport = transport
+        self.address = address
+        self.pizza_comm = pizza_comm
+        self.with_markov = with_markov
+        self.shutdown_on_last_close = shutdown_on_last_close
+        self.sessions = {}
+        # Every session plays on a channel of its own, handed out by the voice manager that tracks its notes
+        self.voices = pizza_comm.scheduler.voices
+        self.next_session_id = 0
+        self.shutdown_event = asyncio.Event()
+        self.server = None
+
+    async def start(self):
+        self.server = await start_server(self.handle_client, self.transport, self.address)
+        print(f"CONNECT: Listening on {self.transport} {self.address}")
+
+    async def handle_client(self, reader, writer):
+        channel = self.voices.acquire_channel()
+        if channel is None:
+            print("CONNECT: No free MIDI channel, rejecting client")
+            writer.close()
+            return
+        sock = writer.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        try:
+            # Building a generator can load its data, which must not hold up the notes of the other sessions
+            motif_gen = await asyncio.to_thread(MotifGen, with_markov=self.with_markov)
+        except Exception as e:
+            print(f"CONNECT: Could not create a generator, rejecting client: {e}")
+            self.voices.release_channel(channel)
+            writer.close()
+            return
+
+        session = Session(self.next_session_id, channel, self.with_markov, writer, motif_gen)
+        self.next_session_id += 1
+        self.sessions[session.session_id] = session
+        session.notes_task = asyncio.create_task(send_notes(self.pizza_comm, session))
+        print(f"CONNECT: Session {session.session_id} opened on channel {session.channel}")
+
+        closed_by_client = False
+        try:
+            while not session.closed.is_set():
+                # The client sends heartbeats while idle, silence means it is gone
+                payload = await asyncio.wait_for(read_frame(reader), HEARTBEAT_TIMEOUT)
+                if handle_message(decode_message(payload), session.motif_gen):
+                    closed_by_client = True
+                    break
+                session.motifs.refresh()
+        except asyncio.TimeoutError:
+            print(f"CONNECT: Session {session.session_id} timed out")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            print(f"CONNECT: Session {session.session_id} disconnected")
+        except ValueError as e:
+            print(f"CONNECT: Session {session.session_id} sent an invalid message: {e}")
+        finally:
+            await self.close_session(session)
+            writer.close()
+
+        if closed_by_client and self.shutdown_on_last_close and not self.sessions:
+            self.shutdown_event.set()
+
+    async def close_session(self, session):
+        # Let the current motif finish, then make sure none of the session's notes is left sounding and free the channel
+        session.closed.set()
+        try:
+            await session.notes_task
+        except Exception as e:
+            print(f"CONNECT: Session {session.session_id} note output failed: {e}")
+        self.pizza_comm.scheduler.all_notes_off(session.channel)
+        self.sessions.pop(session.session_id, None)
+        self.voices.release_channel(session.channel)
+        print(f"CONNECT: Session {session.session_id} closed")
+
+    async def serve_until_shutdown(self):
+        await self.shutdown_event.wait()
+        self.server.close()
+        # Closing the connections ends every session, which waits for its current motif to finish
+        sessions = list(self.sessions.values())
+        for session in sessions:
+            session.closed.set()
+            session.writer.close()
+        await asyncio.gather(*(session.notes_task for session in sessions), return_exceptions=True)
+        await self.server.wait_closed()
+        if self.transport == 'unix' and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def shutdown(self):
+        self.shutdown_event.set()
+
+def handle_message(received_data, motif_gen):
+    # Applies an update to the session's generator, returns True if the client is closing
+    if received_data.get("heartbeat") or "control" in received_data:
+        # Nothing to apply, control messages of newer clients are ignored
+        return False
+    close = received_data.get("close")
+    if close:
+        return True
+    probabilities = received_data.get("pitch_probabilities")
+    trend = received_data.get("trend")
+    scale = received_data.get("scale")
+    duration = received_data.get("duration")
+    active_color_flag = received_data.get("active_color_flag")
+    if active_color_flag:
+        key = received_data.get("key")
+        motif_gen.set_key(key)
+    motif_gen.set_active_color_flag(active_color_flag)
+    motif_gen.set_probabilities(probabilities)
+    motif_gen.set_trend(trend)
+    motif_gen.set_scale(scale)
+    motif_gen.set_duration(duration)
+    print("CONNECT: Received data")
+    return False
+
+async def send_notes(pizza_comm, session):
+    # Motifs are laid out on an absolute timeline: every note starts NOTE_GAP after the previous note ended,
+    # measured from the planned times rather than from when this coroutine happens to wake up, so timing errors
+    # do not accumulate. Notes are handed to the scheduler `lookahead` seconds before they are due, which keeps
+    # duration changes responsive while the event loop stays free.
+    motif_gen = session.motif_gen
+    scheduler = pizza_comm.scheduler
     def duration_changed(duration):
         return motif_gen.get_duration() != duration
-    
+
     # def trend_changed(trend):
     #     return motif_gen.get_trend() != trend
 
-    while not global_close:
-        print("CONNECT: Choosing motif")
-        notes, duration, trend, key = motif_gen.choose_motif()
-        print("CONNECT: Key: ", key)
-        if notes is not None and duration is not None:
-            await pizza_comm.send_midi_note_on(key, 100)
-            for note in notes:
-                print(note)
-                await asyncio.sleep(0.1)
-                vel = np.random.randint(60, 100)
-                await pizza_comm.send_midi_note(note, vel, duration)
-                if duration_changed(duration):
-                    duration = motif_gen.get_duration()
-            await pizza_comm.send_midi_note_off(key, 70)
-        else:
-            print("CONNECT: no notes, waiting")
-            await asyncio.sleep(1)
+    next_start = scheduler.now()
+    session.motifs.start()
+    try:
+        while not session.closed.is_set():
+            print("CONNECT: Choosing motif")
+            try:
+                motif = await session.motifs.get()
+            except Exception as e:
+                # A failed generation must not end the session's output, wait like for an empty motif and try again
+                print(f"CONNECT: Session {session.session_id} could not generate a motif: {e}")
+                session.motifs.refresh()
+                motif = None
+            notes, duration, trend, key = motif if motif is not None else (None, None, None, None)
+            # The pipeline only hands out motifs generated for the current parameters
+            scale = motif_gen.scale
+            print("CONNECT: Key: ", key)
+            if notes is not None and duration is not None:
+                # The motif was generated ahead, play it with the current duration
+                duration = motif_gen.get_duration()
+                # Continue the timeline, unless choosing the motif took so long that it is already in the past
+                t = max(next_start, scheduler.now())
+                pizza_comm.send_midi_note_on(key, 100, t, session.channel)
+                for note in notes:
+                    print(note)
+                    t += NOTE_GAP
+                    vel = np.random.randint(60, 100)
+                    pizza_comm.send_midi_note(note, vel, t, duration, session.channel)
+                    t += duration
+                    await scheduler.wait_until(t - scheduler.lookahead)
+                    if duration_changed(duration):
+                        duration = motif_gen.get_duration()
+                pizza_comm.send_midi_note_off(key, 70, t, session.channel)
+                next_start = t
+                if motif_gen.with_markov and motif_gen.learn_played:
+                    # The model is locked while it learns, the pipeline keeps generating from it on its own thread
+                    await asyncio.to_thread(motif_gen.learn, notes, trend, scale, key)
+            else:
+                print("CONNECT: no notes, waiting")
+                # Waits on the scheduler's clock, so a virtual clock moves on through the silence
+                await scheduler.wait_idle(session.closed, 1)
+                next_start = scheduler.now()
+    finally:
+        await session.motifs.close()
+    # Return once the last scheduled note has ended, so the channel is not reused while it still sounds
+    await scheduler.wait_until(next_start)
+
+def create_backend(name, scheduler):
+    # The generator always runs in real time, the file backend records what would have been played
+    if name == 'live':
+        return LivePortBackend('IAC pizza', 'IAC drone', scheduler)
+    if name == 'file':
+        return MidiFileBackend(MIDI_FILE_PATH, scheduler=scheduler)
+    if name == 'null':
+        return NullBackend(scheduler)
+    raise ValueError(f"Unknown MIDI backend {name!r}, expected 'live', 'file' or 'null'")
 
 async def main():
-    global global_close
     # Initialize communication objects
-    pizza_comm = PizzaComm('IAC pizza', 'IAC drone')
-    tcp_comm = TCPComm('localhost', 12346)
-    motif_gen = MotifGen(with_markov=True)
-    # Start tasks for checking incoming data and sending notes
-    await asyncio.gather(
-        tcp_comm.check_for_incoming_data(motif_gen),
-        send_notes(pizza_comm, motif_gen),
-    )
-
-    pizza_comm.outport_harp.close()
-    pizza_comm.outport_drone.close()
-    tcp_comm.sock.close()
+    monitor = TimingMonitor()
+    scheduler = MidiScheduler(monitor=monitor, report_interval=MIDI_REPORT_INTERVAL)
+    pizza_comm = PizzaComm(create_backend(MIDI_BACKEND, scheduler))
+    tcp_comm = TCPComm(*transport_address(), pizza_comm)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, tcp_comm.shutdown)
+        except NotImplementedError:
+            pass
+    try:
+        await tcp_comm.start()
+        await tcp_comm.serve_until_shutdown()
+    finally:
+        # Closing the backend turns off every note still sounding, also when the generator fails
+        pizza_comm.close()
+    print(monitor.format_stats())
+    if MIDI_TRACE_PATH:
+        monitor.export_trace(MIDI_TRACE_PATH)
+        print("CONNECT: MIDI timing trace written to", MIDI_TRACE_PATH)
 
 if __name__ == "__main__":
     # Run the main event loop
@@ -1,103 +1,16 @@
 from tkinter import Canvas, Frame, Tk, ttk, Button, font, HORIZONTAL, TRUE, ROUND, RAISED, SUNKEN
 from functools import partial
 from tkinter.colorchooser import askcolor 
-from PIL import ImageGrab
-import numpy as np
-import cv2
-import threading
-import socket
-import json
 import time
 import math
-import colorutils
 
 from utils import UP, DOWN, VARYING, CONSTANT, OFF, color_ranges, color_notes, notes_colors, PITCH_CLASSES, print_trend
+from analysis_worker import LatestWinsWorker
+from capture_scheduler import AdaptiveCaptureScheduler
+from stroke_features import StrokeFeatureEstimator, calculate_duration
+from protocol import PersistentClient, encode_message, transport_address
 
-def sum_color_counts(color_counts):
-    """
-    Calculates the total count of all colors.
-    
-    Parameters:
-        color_counts (dict): A dictionary where keys are color names and values are counts of those colors.
-    
-    Returns:
-        int: The total count of all colors.
-    """
-    total_count = np.sum(list(color_counts.values()))
-    return total_count
-
-def calculate_color_mask(hue_channel, color_ranges, black_mask, white_mask):
-    """
-    Calculates the mask for each color in the image based on hue values, excluding black and white areas.
-    
-    Parameters:
-        hue_channel (numpy.ndarray): The hue channel of the image.
-        color_ranges (dict): A dictionary defining the hue ranges for each color.
-        black_mask (numpy.ndarray): A mask indicating black areas in the image.
-        white_mask (numpy.ndarray): A mask indicating white areas in the image.
-    
-    Returns:
-        dict: A dictionary with color names as keys and their respective counts as values.
-    """
-    color_counts = {color: 0 for color in color_ranges}
-    color_counts['white'] = np.sum(white_mask)
-
-    for color, ranges in color_ranges.items():
-        if isinstance(ranges, tuple):
-            ranges = [ranges]
-        if color == 'red':
-            red1 = np.logical_and(hue_channel >= 0, hue_channel <= 10)
-            red2 = np.logical_and(hue_channel >= 166, hue_channel <= 180)
-            color_mask = np.logical_or(red1, red2)
-        else:
-            color_mask = np.zeros_like(hue_channel, dtype=bool)
-            for lower_bound, upper_bound in ranges:
-                color_mask |= np.logical_and(hue_channel >= lower_bound, hue_channel <= upper_bound)
-
-        color_mask = np.logical_and(color_mask, np.logical_not(black_mask))
-        color_mask = np.logical_and(color_mask, np.logical_not(white_mask))
-        color_counts[color] += np.sum(color_mask)
-
-    return color_counts
-
-def calculate_pitch_probabilities(color_counts, color_notes):
-    """
-    Calculates the probabilities of each pitch class based on color counts.
-    
-    Parameters:
-        color_counts (dict): A dictionary with color names as keys and their respective counts as values.
-        color_notes (dict): A dictionary mapping color names to musical notes.
-    
-    Returns:
-        list: A list of probabilities for each pitch class.
-    """
-    temp_total = sum(color_counts.values())
-    pitch_probabilities = [color_counts[color_notes[pitch]] / temp_total for pitch in PITCH_CLASSES]
-    return pitch_probabilities
-
-def get_color_statistics(image):
-    """
-    Analyzes an image to determine pitch probabilities and musical scale based on color distribution.
-    
-    Parameters:
-        image (numpy.ndarray): The image to analyze.
-    
-    Returns:
-        tuple: A tuple containing a list of pitch probabilities and the determined musical scale ('min' or 'maj').
-    """
-    image = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
-    hue_channel, saturation_channel, value_channel = cv2.split(image)
-    average_brightness = np.mean(value_channel)
-
-    scale = 'min' if average_brightness < 127 else 'maj'
-
-    black_mask = value_channel < 25
-    white_mask = np.logical_and(value_channel > 204, saturation_channel < 25)
-
-    color_counts = calculate_color_mask(hue_channel, color_ranges, black_mask, white_mask)
-    pitch_probabilities = calculate_pitch_probabilities(color_counts, color_notes)
-
-    return pitch_probabilities, scale
+connection = None
 
 def determine_color(hue, saturation, value):
     """
@@ -138,6 +51,7 @@ def active_color_probabilities(active_color):
     Returns:
         dict or None: A dictionary with note probabilities if the color is recognized, otherwise None.
     """
+    import colorutils
     hsv_color = colorutils.hex_to_hsv(active_color)
     hue = hsv_color[0] / 2
     saturation = hsv_color[1] * 255
@@ -146,12 +60,12 @@ def active_color_probabilities(active_color):
     color_str = determine_color(hue, saturation, value)
     return notes_colors[color_str] if color_str else None
 
-def analyse_send_data(image, trend, speed_measure, active_color_flag, active_color):
+def send_analysis(color_statistics, trend, speed_measure, active_color_flag, active_color):
     """
-    Analyzes an image and sends the data over a network socket.
+    Sends already computed color statistics along with the drawing parameters over a network socket.
     
     Parameters:
-        image (numpy.ndarray): The image to analyze.
+        color_statistics (tuple): The pitch probabilities and scale, as returned by AnalysisProcess.update.
         trend (str): The current trend in drawing movement.
         speed_measure (int): The speed of the drawing action.
         active_color_flag (bool): Flag indicating if an active color is used.
@@ -160,7 +74,7 @@ def analyse_send_data(image, trend, speed_measure, active_color_flag, active_col
     key = active_color_probabilities(active_color) if active_color_flag else None
     active_color_flag = bool(key)
 
-    pitch_probabilities, scale = get_color_statistics(image)
+    pitch_probabilities, scale = color_statistics
 
     duration = calculate_duration(speed_measure)
 
@@ -176,32 +90,7 @@ def analyse_send_data(image, trend, speed_measure, active_color_flag, active_col
         "key": key,
     }
 
-    send_data(json.dumps(data_to_send))
-
-def calculate_duration(speed_measure):
-    """
-    Determines the duration of a note based on the speed of drawing.
-    
-    Parameters:
-        speed_measure: The speed of the drawing action, calculated as distance over time.
-    
-    Returns:
-        A float representing the duration of the note, with faster speeds resulting in shorter durations.
-    """
-    if speed_measure > 7000:
-        return 0.05
-    elif speed_measure > 5000:
-        return 0.07
-    elif speed_measure > 3000:
-        return 0.1
-    elif speed_measure > 1000:
-        return 0.15
-    elif speed_measure > 500:
-        return 0.25
-    elif speed_measure > 100:
-        return 0.3
-    else:
-        return 0.35
+    send_data(data_to_send)
 
 def print_analysis_results(pitch_probabilities, trend, scale, duration):
     """
@@ -234,7 +123,7 @@ def send_close_signal():
         "close": True
     }
     try:
-        send_data(json.dumps(data_to_send))
+        send_data(data_to_send)
         return True
     except NameError:
         print("Error: send_data function is not defined.")
@@ -244,14 +133,28 @@ def send_close_signal():
 
 def send_data(data):
     """
-    Sends the serialized analysis data over a network socket to a predefined address and port.
+    Encodes a message in the compact binary wire format (or JSON, see protocol.WIRE_FORMAT) and sends it as one frame
+    over the persistent connection to the generator.
+    The connection uses the configured transport (TCP or a Unix domain socket, see protocol.TRANSPORT),
+    is opened on first use, kept alive with heartbeats and re-established automatically. The last analysis result
+    is sent again after every reconnect, so a restarted generator picks up the drawing without waiting for a change.
     
     Parameters:
-        data: The serialized (JSON) string containing the analysis results to be sent.
+        data: The message dictionary, either the analysis results or the close signal.
     """
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.connect(('localhost', 12346))
-        s.sendall(data.encode('utf-8'))
+    global connection
+    if connection is None:
+        connection = PersistentClient(*transport_address())
+    connection.send(encode_message(data), replay=not data.get("close"))
+
+def close_connection():
+    """
+    Closes the persistent connection to the generator, if it was opened.
+    """
+    global connection
+    if connection is not None:
+        connection.close()
+        connection = None
 
 
 class DrawingApp:
@@ -269,16 +172,29 @@ class DrawingApp:
         brush_thickness_label (ttk.Label): Label for the brush thickness scale.
         brush_thickness (ttk.Scale): Scale to select the thickness of the brush.
         canvas (Canvas): The main drawing canvas.
+        raster (CanvasRaster): The shared memory RGB mirror of the canvas used for analysis.
+        current_stroke (int): The canvas item of the line stroke being drawn, extended as a single polyline.
+        stroke_item_count (int): The number of stroke items on the canvas since the last bake.
+        bake_item_limit (int): The number of stroke items above which finished strokes are baked into the background.
+        max_stroke_points (int): The number of points after which a polyline stroke is continued in a new item.
+        background_item (int): The canvas image item holding the baked strokes.
+        background_photo (ImageTk.PhotoImage): The image shown by background_item.
+        rebake_job (str): The identifier of the pending callback rebuilding the background after a resize.
+        analysis_process (AnalysisProcess): The process keeping the per-tile color histograms of the raster.
         color (str): The current active color for drawing.
         active_color_flag (bool): Flag to indicate if the active color is selected.
         last_pos (tuple): The last recorded position of the mouse cursor.
-        directions (list): A list to track the direction of drawing movements.
-        speeds (list): A list to track the speed of drawing movements.
+        stroke_features (StrokeFeatureEstimator): Sliding-window estimate of the drawing direction and speed.
         speed_measure (int): A measure of the current drawing speed.
         trend (str): The current trend in drawing direction or speed.
         eraser_active (bool): Flag to indicate if the eraser mode is active.
-        direction_speed_analysis_limit (int): The limit for analyzing direction and speed data.
+        direction_speed_analysis_limit (int): The number of motion events the direction and speed estimate covers.
         capture_delay (int): The delay in milliseconds for capturing canvas content.
+        capture_scheduler (AdaptiveCaptureScheduler): Adapts capture_delay to drawing activity and skips unchanged captures.
+        capture_job (str): The identifier of the pending capture callback.
+        analysis_worker (LatestWinsWorker): The worker thread analyzing the captured canvas content.
+        stats_interval (float): The minimum time in seconds between two prints of the analysis worker statistics.
+        last_stats_time (float): The time the analysis worker statistics were last printed.
     """
     def __init__(self, root):
         """
@@ -292,7 +208,6 @@ class DrawingApp:
         self.setup_ui_components()
         self.bind_canvas_events()
         self.initialize_other_attributes()
-        self.capture_canvas_content()
 
     def initialize_basic_attributes(self, root):
         """
@@ -384,19 +299,25 @@ class DrawingApp:
         """
         Sets up the main drawing canvas, taking up the majority of the application window.
         The canvas background is set to black, and its size is dynamically adjusted based on the screen size.
+        The raster mirroring the canvas is created by start_analysis once the window is shown.
         """
         screen_width = self.root.winfo_screenwidth()
         screen_height = self.root.winfo_screenheight()
-        self.canvas = Canvas(self.root, bg='black', width=screen_width, height=screen_height - self.color_frame.winfo_reqheight())
+        canvas_height = screen_height - self.color_frame.winfo_reqheight()
+        self.canvas = Canvas(self.root, bg='black', width=screen_width, height=canvas_height)
         self.canvas.pack(padx=10, pady=5)
+        self.raster = None
+        self.analysis_process = None
 
     def bind_canvas_events(self):
         """
         Binds mouse events to the canvas to handle drawing actions.
         '<B1-Motion>' is bound to the painting action, and '<ButtonRelease-1>' is bound to resetting the last position.
+        '<Configure>' keeps the raster the same size as the visible canvas.
         """
         self.canvas.bind('<B1-Motion>', self.paint)
         self.canvas.bind('<ButtonRelease-1>', self.reset_last_pos)
+        self.canvas.bind('<Configure>', self.resize_raster)
 
     def initialize_other_attributes(self):
         """
@@ -406,19 +327,55 @@ class DrawingApp:
         self.color = '#FFFFFF'
         self.active_color_flag = False
         self.last_pos = None 
-        self.directions = []
-        self.speeds = []
         self.speed_measure = 0
         self.trend = CONSTANT
         self.eraser_active = False
         self.direction_speed_analysis_limit = 100
-        self.capture_delay = 2000  
+        self.stroke_features = StrokeFeatureEstimator(self.direction_speed_analysis_limit, initial_trend=self.trend)
+        self.capture_scheduler = AdaptiveCaptureScheduler()
+        self.capture_delay = self.capture_scheduler.delay
+        self.capture_job = None
+        self.analysis_worker = None
+        self.stats_interval = 30.0
+        self.last_stats_time = time.monotonic()
+        self.current_stroke = None
+        self.current_stroke_style = None
+        self.current_stroke_coords = []
+        self.stroke_item_count = 0
+        self.bake_item_limit = 2000
+        self.max_stroke_points = 500
+        self.background_item = None
+        self.background_photo = None
+        self.rebake_job = None
+
+    def start_analysis(self):
+        """
+        Creates the raster mirroring the canvas in shared memory, the analysis process reading it and the analysis
+        worker, and starts capturing. Called once the window is shown, so loading NumPy and OpenCV and spawning
+        the analysis process do not delay the first frame.
+        """
+        from canvas_raster import CanvasRaster, merge_tile_frames
+        from analysis_process import AnalysisProcess
+        width = self.canvas.winfo_width() if self.canvas.winfo_width() > 1 else self.canvas.winfo_reqwidth()
+        height = self.canvas.winfo_height() if self.canvas.winfo_height() > 1 else self.canvas.winfo_reqheight()
+        self.raster = CanvasRaster(width, height, shared=True)
+        self.analysis_process = AnalysisProcess(self.raster.tile_size)
+        # Frames are (tiles, change signature) pairs, a merged frame carries the signature of the newer capture
+        self.analysis_worker = LatestWinsWorker(
+            self.analyze, merge=lambda older, newer: (merge_tile_frames(older[0], newer[0]), newer[1]))
+        self.capture_canvas_content()
 
     def on_close(self):
         """
         Handles application closure: performs cleanup and closes the window.
         """
+        if self.analysis_worker is not None:
+            self.analysis_worker.stop(timeout=1)
+            print(self.analysis_worker.format_stats())
+            self.analysis_process.close()
+            self.raster.close()
         send_close_signal()
+        close_connection()
         print("Closing application...")
         self.root.destroy()
 
@@ -430,23 +387,6 @@ class DrawingApp:
         if color_code:
             self.color = color_code
 
-    def analyze_trend(self):
-        up_count = self.directions.count(UP)
-        down_count = self.directions.count(DOWN)
-        constant_count = self.directions.count(CONSTANT)
-        dir_len = len(self.directions)
-
-        if abs(up_count - down_count) < 10 and constant_count < 10:
-            return VARYING
-        elif up_count > dir_len / 2:
-            return UP
-        elif down_count > dir_len / 2:
-            return DOWN
-        elif constant_count > dir_len / 2:
-            return CONSTANT
-        else:
-            return VARYING
-
     def toggle_eraser(self):
         """
         Toggles the eraser mode on and off.
@@ -474,12 +414,19 @@ class DrawingApp:
         Parameters:
             event: The event that triggered the painting action.
         """
+        if self.raster is None:
+            # The analysis is still starting up
+            return
+        if self.capture_scheduler.notify_activity():
+            self.schedule_capture(self.capture_scheduler.delay)
         paint_color = self.determine_paint_color()
         current_time = time.time()
         self.calculate_speed(current_time, event)
         self.draw_shape(event, paint_color)
         self.analyze_direction_and_speed(event)
         self.update_position_and_time(event, current_time)
+        if self.stroke_item_count > 4 * self.bake_item_limit:
+            self.bake_strokes()
 
     def determine_paint_color(self):
         """
@@ -491,7 +438,7 @@ class DrawingApp:
     def calculate_speed(self, current_time, event):
         """
         Calculates the drawing speed based on the distance covered over time.
-        Appends the calculated speed to the speeds list for further analysis.
+        Adds the calculated speed to the sliding window and updates speed_measure with the window mean.
         
         Parameters:
             current_time: The current time when the mouse event was triggered.
@@ -501,13 +448,14 @@ class DrawingApp:
             time_diff = current_time - self.last_time
             distance = math.sqrt((event.x - self.last_pos[0])**2 + (event.y - self.last_pos[1])**2)
             if time_diff > 0:
-                speed_measure = distance / time_diff
-                self.speeds.append(speed_measure)
+                self.stroke_features.add_speed(distance / time_diff)
+                self.speed_measure = self.stroke_features.speed_measure
 
     def draw_shape(self, event, paint_color):
         """
         Draws a shape on the canvas based on the selected brush type and color.
         The shape can be an oval, square, or line, determined by the brush_type attribute.
+        Line strokes extend a single polyline item instead of creating an item per motion event.
         
         Parameters:
             event: The mouse event containing the current cursor position.
@@ -516,17 +464,63 @@ class DrawingApp:
         x, y = event.x, event.y
         size = self.brush_thickness.get()
         if self.brush_type.get() == "Oval":
-            self.canvas.create_oval(x-size, y-size, x+size, y+size, fill=paint_color, outline=paint_color)
+            self.canvas.create_oval(x-size, y-size, x+size, y+size, fill=paint_color, outline=paint_color, tags='stroke')
+            self.stroke_item_count += 1
+            self.raster.draw_oval(x, y, size, paint_color)
         elif self.brush_type.get() == "Square":
-            self.canvas.create_rectangle(x-size, y-size, x+size, y+size, fill=paint_color, outline=paint_color)
+            self.canvas.create_rectangle(x-size, y-size, x+size, y+size, fill=paint_color, outline=paint_color, tags='stroke')
+            self.stroke_item_count += 1
+            self.raster.draw_square(x, y, size, paint_color)
         elif self.brush_type.get() == "Line" and self.last_pos:
-            self.canvas.create_line(self.last_pos[0], self.last_pos[1], x, y, fill=paint_color, width=size, capstyle=ROUND, smooth=TRUE, splinesteps=36)
+            self.extend_stroke(x, y, paint_color, size)
+            self.raster.draw_line(self.last_pos[0], self.last_pos[1], x, y, paint_color, size)
+
+    def extend_stroke(self, x, y, paint_color, size):
+        """
+        Extends the current line stroke to (x, y). A new polyline item is started when there is no current stroke,
+        when the color or size changed, or when the current polyline reached max_stroke_points.
+        
+        Parameters:
+            x, y: The new end point of the stroke.
+            paint_color: The color of the stroke.
+            size: The width of the stroke.
+        """
+        style = (paint_color, size)
+        if (self.current_stroke is None or style != self.current_stroke_style
+                or len(self.current_stroke_coords) >= 2 * self.max_stroke_points):
+            self.current_stroke_coords = [self.last_pos[0], self.last_pos[1], x, y]
+            self.current_stroke_style = style
+            self.current_stroke = self.canvas.create_line(*self.current_stroke_coords, fill=paint_color, width=size, capstyle=ROUND, joinstyle=ROUND, smooth=TRUE, splinesteps=36, tags='stroke')
+            self.stroke_item_count += 1
+        else:
+            self.current_stroke_coords.extend((x, y))
+            self.canvas.coords(self.current_stroke, *self.current_stroke_coords)
+
+    def bake_strokes(self):
+        """
+        Replaces all stroke items on the canvas with a single background image rendered from the raster,
+        keeping the number of canvas items and their memory bounded however long the session runs.
+        Runs on the Tk thread, which has to create the PhotoImage and must not draw new strokes in between.
+        """
+        self.rebake_job = None
+        from PIL import Image, ImageTk
+        self.background_photo = ImageTk.PhotoImage(Image.fromarray(self.raster.snapshot()))
+        if self.background_item is None:
+            self.background_item = self.canvas.create_image(0, 0, anchor='nw', image=self.background_photo)
+            self.canvas.tag_lower(self.background_item)
+        else:
+            self.canvas.itemconfigure(self.background_item, image=self.background_photo)
+        self.canvas.delete('stroke')
+        self.current_stroke = None
+        self.current_stroke_coords = []
+        self.stroke_item_count = 0
 
     def analyze_direction_and_speed(self, event):
         """
         Analyzes the drawing direction and speed.
-        Determines the general direction of drawing (up, down, or constant) and calculates the average speed.
-        Updates the trend and speed_measure attributes based on the analysis.
+        Determines the direction of the movement (up, down, or constant) and adds it to the sliding window,
+        which updates the trend in constant time. A trend change is sent right away instead of at the next capture,
+        unless a capture was already brought forward within the minimum capture delay.
         
         Parameters:
             event: The mouse event containing the current cursor position.
@@ -540,12 +534,10 @@ class DrawingApp:
             else:
                 direction = CONSTANT
 
-            self.directions.append(direction)
-            if len(self.directions) > self.direction_speed_analysis_limit:
-                self.trend = self.analyze_trend()
-                self.speed_measure = np.mean(self.speeds)
-                self.directions = []
-                self.speeds = []
+            if self.stroke_features.add_direction(direction):
+                self.trend = self.stroke_features.trend
+                if self.capture_scheduler.request_immediate():
+                    self.schedule_capture(0)
 
     def update_position_and_time(self, event, current_time):
         """
@@ -562,56 +554,119 @@ class DrawingApp:
     def reset_last_pos(self, event):
         """
         Resets the last position of the mouse cursor to None after the mouse button is released.
+        This ends the current stroke, and bakes the finished strokes into the background once there are too many.
         
         Parameters:
             event: The event that triggered the reset.
         """
         self.last_pos = None
+        self.current_stroke = None
+        if self.stroke_item_count > self.bake_item_limit:
+            self.bake_strokes()
 
-    def capture(self):
+    def resize_raster(self, event):
         """
-        Captures the current content of the canvas as an image.
-        Calculates the bounding box of the canvas relative to the root window and uses it to capture the image.
+        Resizes the raster mirror when the canvas is resized, so it always covers the visible canvas.
+        The raster drops the content outside the new size, so once strokes have been baked, the canvas is baked
+        again from the resized raster to show what is analyzed. The bake waits until the resizing settles.
         
-        Returns:
-            An image of the current canvas content.
-        """
-        x = self.root.winfo_rootx() + self.canvas.winfo_x()
-        y = self.root.winfo_rooty() + self.canvas.winfo_y()
-        x1 = x + self.canvas.winfo_width()
-        y1 = y + self.canvas.winfo_height()
-        return ImageGrab.grab(bbox=(x, y, x1, y1))
-
-    def analyze(self, image):
-        """
-        Analyzes the captured image by sending its data along with current drawing parameters to an analysis function.
-        Catches and prints any exceptions that occur during the analysis process.
+        Parameters:
+            event: The configure event carrying the new canvas size.
+        """
+        if self.raster is None or (event.height, event.width) == (self.raster.height, self.raster.width):
+            return
+        self.raster.resize(event.width, event.height)
+        if self.background_item is not None:
+            if self.rebake_job is not None:
+                self.root.after_cancel(self.rebake_job)
+            self.rebake_job = self.root.after(100, self.bake_strokes)
+
+    def analyze(self, frame):
+        """
+        Has the analysis process merge the changed canvas tiles into the color statistics and sends the result
+        along with current drawing parameters. Runs on the analysis worker thread, which only waits for the process.
+        Catches and prints any exceptions that occur during the analysis process, and prints the worker statistics
+        at most every stats_interval seconds. The capture scheduler is told whether the capture was sent, so a
+        failed one is retried. The tiles of a failed update are marked dirty again, and an analysis process that died
+        or hung is restarted and sent every tile, since it starts without statistics.
         
         Parameters:
-            image: The image to be analyzed.
+            frame: The (layout, indices) of the changed tiles, as returned by CanvasRaster.collect_dirty_tile_indices,
+                   and the change signature of the capture.
         """
+        tiles, signature = frame
         try:
-            analyse_send_data(np.array(image), self.trend, self.speed_measure, self.active_color_flag, self.color)
+            try:
+                color_statistics = self.analysis_process.update(*tiles)
+            except (EOFError, OSError):
+                print("Analysis process lost, restarting it")
+                self.analysis_process.restart()
+                self.raster.restore_dirty_tiles(tiles[0])
+                raise
+            except Exception:
+                self.raster.restore_dirty_tiles(*tiles)
+                raise
+            # The process has moved on to this layout, so the blocks of older sizes can go
+            self.raster.release_retired(tiles[0])
+            send_analysis(color_statistics, self.trend, self.speed_measure, self.active_color_flag, self.color)
+            self.capture_scheduler.confirm(signature)
         except Exception as e:
             print(f"Error during analysis: {e}")
+            self.capture_scheduler.fail(signature)
+        now = time.monotonic()
+        if now - self.last_stats_time >= self.stats_interval:
+            self.last_stats_time = now
+            print(self.analysis_worker.format_stats())
+
+    def capture_and_analyze(self, signature):
+        """
+        Collects the canvas tiles changed since the last analysis and hands them to the analysis worker.
+        Only the tile indices are passed on, the analysis process reads the pixels from shared memory.
+        Tiles touched by strokes and eraser strokes are re-histogrammed, all other tiles reuse their previous counts.
+        If the worker has not picked up the previous capture yet, the two are coalesced instead of queued.
+        
+        Parameters:
+            signature: The change signature of the capture, reported back to the capture scheduler.
+        """
+        self.analysis_worker.submit((self.raster.collect_dirty_tile_indices(), signature))
 
-    def capture_and_analyze(self):
+    def change_signature(self):
+        """
+        Summarizes everything the analysis result depends on, so unchanged captures can be detected without
+        looking at the pixels.
+        
+        Returns:
+            tuple: The raster version and the drawing parameters sent along with the color statistics. The color
+                   only matters while the active color is on.
         """
-        Captures the current canvas content and analyzes the captured image.
-        This method combines the functionality of capturing the canvas content and analyzing the captured image.
+        color = self.color if self.active_color_flag else None
+        return (self.raster.version, self.trend, calculate_duration(self.speed_measure), self.active_color_flag, color)
+
+    def schedule_capture(self, delay):
+        """
+        Schedules the next capture after the given delay, replacing any capture that is already pending.
+        
+        Parameters:
+            delay (int): The delay in milliseconds.
         """
-        image = self.capture()
-        self.analyze(image)
+        if self.capture_job is not None:
+            self.root.after_cancel(self.capture_job)
+        self.capture_delay = delay
+        self.capture_job = self.root.after(delay, self.capture_canvas_content)
 
     def capture_canvas_content(self):
         """
         Initiates a continuous process to capture and analyze the canvas content at intervals.
-        This method creates a new thread to capture and analyze the canvas content without blocking the main UI thread.
-        It then schedules itself to be called again after a specified delay, creating a loop that allows for continuous analysis.
+        The analysis runs on a single long-lived worker thread, so at most one analysis is in flight and one
+        capture is waiting, however slow the machine is.
+        Captures are skipped when neither the canvas nor the drawing parameters changed. The delay until the next
+        capture is short while the user is drawing and backs off while the canvas is idle.
         """
-        analysis_thread = threading.Thread(target=self.capture_and_analyze)
-        analysis_thread.start()
-        self.root.after(self.capture_delay, self.capture_canvas_content)
+        self.capture_job = None
+        signature = self.change_signature()
+        if self.capture_scheduler.should_capture(signature):
+            self.capture_and_analyze(signature)
+        self.schedule_capture(self.capture_scheduler.delay)
 
 def main():
     """
@@ -621,6 +676,9 @@ def main():
     root = Tk()
     app = DrawingApp(root)
     root.protocol("WM_DELETE_WINDOW", app.on_close)
+    # Show the window first, then load the analysis
+    root.update()
+    app.start_analysis()
     root.mainloop()
 
 if __name__ == "__main__":
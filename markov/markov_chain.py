@@ -1,57 +1,190 @@
-import random
 import numpy as np
 import ast
 import pickle
+import threading
+from bisect import bisect_right
 from collections import defaultdict, Counter
 
+# States are indexed by a single integer: notes (and the -1 start marker) are shifted to 0..128
+NOTE_OFFSET = 1
+NOTE_RANGE = 129
+
+MOTIVES_PATH = "motifs_df/midi_motives.csv"
+
+def state_key(first, second):
+    # Works on ints and on NumPy arrays of notes alike
+    return (first + NOTE_OFFSET) * NOTE_RANGE + (second + NOTE_OFFSET)
+
 class SecondOrderMarkovModel:
-    def __init__(self, notes=None):
+    def __init__(self, notes=None, seed=None):
         self.transition_counts = defaultdict(Counter)
-        self.transition_probabilities = defaultdict(dict)
+        self._transition_probabilities = defaultdict(dict)
+        # States whose counts changed since their probabilities were last normalized
+        self.stale_states = set()
+        # Per state, the next notes and their cumulative probabilities, built on first use
+        self.rows = {}
+        # Incremented whenever the counts change, generate_batch recompiles its tables when they are older
+        self.counts_version = 0
+        self.compiled_version = -1
+        # Held while the counts change, so a model can learn while another thread generates from it
+        self.lock = threading.Lock()
+        self.rng = np.random.default_rng(seed)
         if notes is not None:
             self.train(notes)
     
     def train(self, sequences_notes):
-        # Populate the transition counts
+        # Training from scratch and learning more sequences are the same: counts are added in place
+        self.update(sequences_notes)
+
+    def update(self, sequences_notes):
+        """
+        Adds sequences to the transition counts. Only the states that occur in them are renormalized, lazily,
+        the next time they are sampled or their probabilities are read.
+
+        Parameters:
+            sequences_notes: Sequences of MIDI notes, as lists or arrays or as their string form in the motif corpus.
+        """
+        updates = []
         for note_seq in sequences_notes:
-            note_seq = np.array(ast.literal_eval(note_seq))
-            note_seq = np.append(-1, note_seq)
+            if isinstance(note_seq, str):
+                note_seq = ast.literal_eval(note_seq)
+            note_seq = [-1] + [int(note) for note in note_seq]
             for i in range(len(note_seq) - 2):
-                state = (note_seq[i], note_seq[i+1])
-                next_note = note_seq[i+2]
-                self.transition_counts[state][next_note] += 1
-        
-        # Convert counts to probabilities
-        self._calculate_probabilities()
-    
+                updates.append(((note_seq[i], note_seq[i+1]), note_seq[i+2], 1))
+        self._add_counts(updates)
+
+    def merge(self, other):
+        """
+        Adds the transition counts of another model to this one.
+
+        Parameters:
+            other (SecondOrderMarkovModel): The model to merge in, it is not changed.
+
+        Returns:
+            SecondOrderMarkovModel: This model.
+        """
+        with other.lock:
+            updates = [((int(state[0]), int(state[1])), int(next_note), count)
+                       for state, next_notes in other.transition_counts.items()
+                       for next_note, count in next_notes.items()]
+        self._add_counts(updates)
+        return self
+
+    def _add_counts(self, updates):
+        with self.lock:
+            for state, next_note, count in updates:
+                self.transition_counts[state][next_note] += count
+                self.stale_states.add(state)
+                self.rows.pop(state, None)
+            if updates:
+                self.counts_version += 1
+
     def _calculate_probabilities(self):
-        for state, next_notes in self.transition_counts.items():
-            total = sum(next_notes.values())
-            for next_note, count in next_notes.items():
-                self.transition_probabilities[state][next_note] = count / total
+        # Normalizes the states whose counts changed
+        with self.lock:
+            for state in self.stale_states:
+                next_notes = self.transition_counts[state]
+                total = sum(next_notes.values())
+                self._transition_probabilities[state] = {next_note: count / total for next_note, count in next_notes.items()}
+            self.stale_states.clear()
+
+    @property
+    def transition_probabilities(self):
+        self._calculate_probabilities()
+        return self._transition_probabilities
+
+    def _row(self, state):
+        # The next notes of a state and their cumulative probabilities, None for an unseen state
+        row = self.rows.get(state)
+        if row is None:
+            with self.lock:
+                next_notes = self.transition_counts.get(state)
+                if not next_notes:
+                    return None
+                cumulative = np.cumsum(list(next_notes.values()), dtype=np.float64)
+                cumulative = (cumulative / cumulative[-1]).tolist()
+                cumulative[-1] = 1.0
+                row = ([int(note) for note in next_notes], cumulative)
+                self.rows[state] = row
+        return row
     
-    def generate_sequence(self, start_notes, length):
+    def compile(self):
+        # Flattens the transition counts into CSR-style arrays for generate_batch: the sorted state keys, the offsets
+        # of every state's row in next_notes, and per row the cumulative probabilities of its next notes.
+        with self.lock:
+            rows = sorted((state_key(int(first), int(second)), list(next_notes.items()))
+                          for (first, second), next_notes in self.transition_counts.items() if next_notes)
+            version = self.counts_version
+        lengths = np.array([len(next_notes) for _, next_notes in rows], dtype=np.int64)
+        self.state_keys = np.array([key for key, _ in rows], dtype=np.int64)
+        self.row_ptr = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        self.next_notes = np.array([int(note) for _, next_notes in rows for note, _ in next_notes], dtype=np.int64)
+        counts = np.array([count for _, next_notes in rows for _, count in next_notes], dtype=np.float64)
+
+        cumulative = np.cumsum(counts)
+        row_starts = self.row_ptr[:-1]
+        before_row = np.repeat(cumulative[row_starts] - counts[row_starts], lengths) if len(rows) else cumulative
+        totals = np.repeat(cumulative[self.row_ptr[1:] - 1], lengths) - before_row if len(rows) else cumulative
+        self.cum_probs = (cumulative - before_row) / totals
+        # The last entry of every row is exactly 1, so a uniform sample always lands in the row
+        self.cum_probs[self.row_ptr[1:] - 1] = 1.0
+        # Offsetting every row by its index makes one sorted array over all rows, searched by the batch sampler
+        self.batch_keys = np.repeat(np.arange(len(rows), dtype=np.float64), lengths) + self.cum_probs
+        self.compiled_version = version
+
+    def generate_sequence(self, start_notes, length, rng=None):
         if len(start_notes) != 2:
             raise ValueError("start_notes must contain exactly two notes")
-        
-        sequence = list(start_notes)
+        rng = rng or self.rng
+
+        sequence = [int(note) for note in start_notes]
+        # Unseen states continue with the second start note
         default_note = sequence[1]
-        print("default note", default_note)
-        
-        for _ in range(length - 2):
-            state = (sequence[-2], sequence[-1])
-            if state in self.transition_probabilities:
-                next_notes = list(self.transition_probabilities[state].keys())
-                probabilities = list(self.transition_probabilities[state].values())
-                next_note = random.choices(next_notes, probabilities)[0]
-                sequence.append(next_note)
-            else:
-                print("Warning, no transition available. Adding default note.")
+        steps = max(0, length - 2)
+        samples = rng.random(steps).tolist()
+        for u in samples:
+            row = self._row((sequence[-2], sequence[-1]))
+            if row is None:
                 sequence.append(default_note)
-                # break  # No transition available, stop the sequence
-        
+                continue
+            next_notes, cumulative = row
+            sequence.append(next_notes[bisect_right(cumulative, u, 0, len(cumulative) - 1)])
+
         return np.array(sequence)
-    
+
+    def generate_batch(self, start_notes, length, count, rng=None):
+        """
+        Generates many sequences at once, one step of all of them per iteration.
+
+        Parameters:
+            start_notes: Two start notes for all sequences, or a (count, 2) array with the start notes of each.
+            length (int): The length of every sequence, including the start notes.
+            count (int): The number of sequences.
+            rng (numpy.random.Generator): The random generator, the model's own if None. Seed it to reproduce a batch.
+
+        Returns:
+            numpy.ndarray: A (count, max(length, 2)) array of notes.
+        """
+        if self.compiled_version != self.counts_version:
+            self.compile()
+        rng = rng or self.rng
+        start_notes = np.broadcast_to(np.asarray(start_notes, dtype=np.int64), (count, 2))
+        sequences = np.empty((count, max(length, 2)), dtype=np.int64)
+        sequences[:, :2] = start_notes
+        if len(self.state_keys) == 0:
+            sequences[:, 2:] = start_notes[:, 1:]
+            return sequences
+
+        last_state = len(self.state_keys) - 1
+        for i in range(2, length):
+            keys = state_key(sequences[:, i - 2], sequences[:, i - 1])
+            rows = np.minimum(np.searchsorted(self.state_keys, keys), last_state)
+            found = self.state_keys[rows] == keys
+            indices = np.searchsorted(self.batch_keys, rows + rng.random(count), side='right')
+            next_notes = self.next_notes[np.minimum(indices, len(self.next_notes) - 1)]
+            sequences[:, i] = np.where(found, next_notes, start_notes[:, 1])
+        return sequences
+
     def save_model(self, filename):
         with open(filename, 'wb') as f:
             pickle.dump({
@@ -62,23 +195,261 @@ class SecondOrderMarkovModel:
     def load_model(self, filename):
         with open(filename, 'rb') as f:
             model_data = pickle.load(f)
+        with self.lock:
             self.transition_counts = model_data['transition_counts']
-            self.transition_probabilities = model_data['transition_probabilities']
+            self._transition_probabilities = model_data['transition_probabilities']
+            self.stale_states = set()
+            self.rows = {}
+            self.counts_version += 1
 
 
-class MarkovManager:
+class ContextNode:
+    # A node of the suffix trie: the context read backwards from the most recent note, with the counts of the
+    # notes that followed it
+    __slots__ = ("children", "counts", "total")
+
     def __init__(self):
+        self.children = {}
+        self.counts = Counter()
+        self.total = 0
+
+class VariableOrderMarkovModel:
+    def __init__(self, notes=None, max_order=3, discount=0.75, seed=None):
+        # Contexts of order 1..max_order are stored in a suffix trie, so finding the longest known context of a
+        # sequence takes at most max_order steps. Probabilities are interpolated with absolute discounting:
+        # every context gives `discount` of each count to the distribution of its one note shorter context,
+        # down to the note frequencies at the root, so unseen contexts back off smoothly.
+        self.max_order = max_order
+        self.discount = discount
+        self.root = ContextNode()
+        self.notes = []
+        self.vocabulary = {}
+        self.rng = np.random.default_rng(seed)
+        # Every distribution is a mixture: with probability `weight` the note frequencies at the root, otherwise
+        # the discounted counts along the context path. The root part is shared by all contexts and rebuilt after
+        # every change, the path part is cached per context and only dropped when a node on its path changes.
+        self.cache = {}
+        self.root_table = None
+        self.lock = threading.Lock()
+        if notes is not None:
+            self.train(notes)
+
+    def train(self, sequences_notes):
+        self.update(sequences_notes)
+
+    def update(self, sequences_notes):
+        """
+        Adds sequences to the counts in place. Only the cached distributions of the contexts that occur in them
+        are recomputed.
+
+        Parameters:
+            sequences_notes: Sequences of MIDI notes, as lists or arrays or as their string form in the motif corpus.
+        """
+        sequences = [ast.literal_eval(note_seq) if isinstance(note_seq, str) else note_seq for note_seq in sequences_notes]
+        changed = set()
+        with self.lock:
+            for note_seq in sequences:
+                note_seq = [-1] + [int(note) for note in note_seq]
+                for i in range(1, len(note_seq)):
+                    note = note_seq[i]
+                    self._add_note(note)
+                    node = self.root
+                    node.counts[note] += 1
+                    node.total += 1
+                    for j in range(i - 1, max(-1, i - 1 - self.max_order), -1):
+                        node = node.children.setdefault(note_seq[j], ContextNode())
+                        node.counts[note] += 1
+                        node.total += 1
+                        changed.add(tuple(note_seq[j:i]))
+            self._invalidate(changed)
+
+    def merge(self, other):
+        """
+        Adds the counts of another model to this one. Contexts longer than this model's max_order are dropped.
+
+        Parameters:
+            other (VariableOrderMarkovModel): The model to merge in, it is not changed.
+
+        Returns:
+            VariableOrderMarkovModel: This model.
+        """
+        with other.lock, self.lock:
+            for note in other.notes:
+                self._add_note(note)
+            changed = set()
+            stack = [(self.root, other.root, ())]
+            while stack:
+                node, other_node, context = stack.pop()
+                node.counts.update(other_node.counts)
+                node.total += other_node.total
+                if context:
+                    changed.add(context)
+                if len(context) < self.max_order:
+                    for note, other_child in other_node.children.items():
+                        stack.append((node.children.setdefault(note, ContextNode()), other_child, (note,) + context))
+            self._invalidate(changed)
+        return self
+
+    def _invalidate(self, changed):
+        # A cached context depends on the nodes of all its suffixes, drop the ones with a changed suffix
+        self.root_table = None
+        stale = [context for context in self.cache
+                 if any(context[-order:] in changed for order in range(1, len(context) + 1))]
+        for context in stale:
+            del self.cache[context]
+
+    def _add_note(self, note):
+        if note not in self.vocabulary:
+            self.vocabulary[note] = len(self.notes)
+            self.notes.append(note)
+
+    def _context_path(self, sequence):
+        # The nodes of the longest known context of the sequence, root first
+        path = [self.root]
+        node = self.root
+        for note in reversed(sequence[-self.max_order:]):
+            node = node.children.get(note)
+            if node is None:
+                break
+            path.append(node)
+        return path
+
+    def distribution(self, sequence):
+        """
+        Returns the interpolated probabilities of the next note after a sequence, in the order of self.notes.
+        """
+        return self._distribution(self._context_path(sequence))
+
+    def _distribution(self, path):
+        probabilities = np.zeros(len(self.notes))
+        for note, count in self.root.counts.items():
+            probabilities[self.vocabulary[note]] = count / self.root.total
+        for node in path[1:]:
+            probabilities *= self.discount * len(node.counts) / node.total
+            for note, count in node.counts.items():
+                probabilities[self.vocabulary[note]] += max(count - self.discount, 0) / node.total
+        return probabilities
+
+    def _backoff(self, path):
+        # The weight of the root frequencies and the remaining probability mass of every note, the same
+        # interpolation as _distribution without the root
+        weight = 1.0
+        mass = {}
+        for node in path[1:]:
+            factor = self.discount * len(node.counts) / node.total
+            weight *= factor
+            mass = {note: m * factor for note, m in mass.items()}
+            for note, count in node.counts.items():
+                mass[note] = mass.get(note, 0.0) + max(count - self.discount, 0) / node.total
+        notes = [note for note, m in mass.items() if m > 0]
+        return (weight if notes else 1.0), notes, np.cumsum([mass[note] for note in notes]).tolist()
+
+    def _path_table(self, sequence):
+        context, table = self._context(sequence)
+        if table is None:
+            # Computed under the lock, so learning on another thread never changes the counts half way
+            with self.lock:
+                context, table = self._context(sequence)
+                if table is None:
+                    table = self._backoff(self._context_path(sequence))
+                    self.cache[context] = table
+        return table
+
+    def _root_cumulative(self):
+        table = self.root_table
+        if table is None:
+            with self.lock:
+                table = self.root_table
+                if table is None:
+                    cumulative = (np.cumsum(list(self.root.counts.values())) / self.root.total).tolist()
+                    cumulative[-1] = 1.0
+                    table = (list(self.root.counts), cumulative)
+                    self.root_table = table
+        return table
+
+    def _sample(self, sequence, u):
+        weight, notes, cumulative = self._path_table(sequence)
+        if u < weight:
+            notes, cumulative = self._root_cumulative()
+            u /= weight
+        else:
+            u -= weight
+        return notes[bisect_right(cumulative, u, 0, len(cumulative) - 1)]
+
+    def _context(self, sequence):
+        # The distribution only depends on the part of the sequence that matched the trie
+        path = self._context_path(sequence)
+        context = tuple(sequence[len(sequence) - len(path) + 1:]) if len(path) > 1 else ()
+        return context, self.cache.get(context)
+
+    def generate_sequence(self, start_notes, length, rng=None):
+        rng = rng or self.rng
+        sequence = [int(note) for note in start_notes]
+        if not self.notes:
+            # Nothing learned, continue with the last start note
+            return np.array(sequence + [sequence[-1]] * max(0, length - len(sequence)))
+        for u in rng.random(max(0, length - len(sequence))).tolist():
+            sequence.append(self._sample(sequence, u))
+        return np.array(sequence)
+
+    def save_model(self, filename):
+        with open(filename, 'wb') as f:
+            pickle.dump({
+                'max_order': self.max_order,
+                'discount': self.discount,
+                'root': self.root,
+                'notes': self.notes,
+            }, f)
+
+    def load_model(self, filename):
+        with open(filename, 'rb') as f:
+            model_data = pickle.load(f)
+        self.max_order = model_data['max_order']
+        self.discount = model_data['discount']
+        self.root = model_data['root']
+        self.notes = model_data['notes']
+        self.vocabulary = {note: index for index, note in enumerate(self.notes)}
+        self.cache = {}
+        self.root_table = None
+        self.lock = threading.Lock()
+
+
+class MarkovManager:
+    def __init__(self, preload=False, max_order=None):
+        # Models are unpickled the first time they are needed, unless preloaded. With max_order, variable-order
+        # models of up to that order are trained from the motif corpus instead.
+        self.max_order = max_order
         self.models_dict = dict()
-        self._load_all_models()
+        self.corpus = None
+        if preload:
+            self._load_all_models()
+
+    def _load_model(self, scale, trend):
+        if self.max_order is not None:
+            if self.corpus is None:
+                from motif_store import MotifStore
+                self.corpus = MotifStore.from_csv(MOTIVES_PATH)
+            ids = self.corpus.index.get((trend, scale), [])
+            m = VariableOrderMarkovModel([self.corpus.motif(i).tolist() for i in ids], max_order=self.max_order)
+        else:
+            m = SecondOrderMarkovModel()
+            m.load_model(f'markov/models/markov-{scale}-{trend}.pkl')
+        self.models_dict[f"{scale}-{trend}"] = m
+        return m
 
     def _load_all_models(self):
         scales = ["maj", "min"]
         trends = [0,1,2,3]
         combinations = [(scale, trend) for scale in scales for trend in trends]
         for scale, trend in combinations:
-            m = SecondOrderMarkovModel()
-            m.load_model(f'markov/models/markov-{scale}-{trend}.pkl')
-            self.models_dict[f"{scale}-{trend}"] = m
+            self._load_model(scale, trend)
 
     def get_model(self, trend, scale):
-        return self.models_dict[f"{scale}-{trend}"]
\ No newline at end of file
+        model = self.models_dict.get(f"{scale}-{trend}")
+        if model is None:
+            model = self._load_model(scale, trend)
+        return model
+
+    def update(self, trend, scale, sequences_notes):
+        # Learns phrases, e.g. the ones a user accepted, into the model of a trend and scale
+        self.get_model(trend, scale).update(sequences_notes)
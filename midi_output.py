@@ -0,0 +1,138 @@
+import mido
+from mido import MetaMessage, MidiFile, MidiTrack
+
+from midi_scheduler import MidiScheduler, VirtualClockScheduler
+
+# Output backends give the generator a harp port, a drone port and the scheduler that plays messages on them
+
+class LivePortBackend:
+    """
+    Plays the harp and drone on MIDI output ports in real time.
+
+    Attributes:
+        harp: The mido output port of the harp.
+        drone: The mido output port of the drone.
+        scheduler (MidiScheduler): The real-time scheduler sending the messages.
+    """
+    def __init__(self, port_name_harp, port_name_drone, scheduler=None):
+        """
+        Opens the output ports.
+
+        Parameters:
+            port_name_harp (str): The name of the harp output port.
+            port_name_drone (str): The name of the drone output port.
+            scheduler (MidiScheduler): The scheduler to use, a new one by default.
+        """
+        self.harp = mido.open_output(port_name_harp)
+        self.drone = mido.open_output(port_name_drone)
+        self.scheduler = scheduler or MidiScheduler()
+
+    def close(self):
+        # Pending note offs are sent before the ports are closed
+        self.scheduler.stop()
+        self.harp.close()
+        self.drone.close()
+
+class MemoryPort:
+    """
+    An output port that keeps every message it is sent in memory, with the scheduler time it was sent at.
+
+    Attributes:
+        name (str): The name of the port.
+        messages (list): The (time, message) pairs in the order they were sent.
+    """
+    def __init__(self, name, clock):
+        self.name = name
+        self.clock = clock
+        self.messages = []
+        self.closed = False
+
+    def send(self, message):
+        self.messages.append((self.clock(), message))
+
+    def close(self):
+        self.closed = True
+
+class NullBackend:
+    """
+    Keeps the harp and drone messages in memory instead of playing them, by default on a virtual clock so the
+    generator runs as fast as it can. Needs no MIDI ports, for testing and load testing.
+
+    Attributes:
+        harp (MemoryPort): The harp messages.
+        drone (MemoryPort): The drone messages.
+        scheduler (MidiScheduler): The scheduler sending the messages.
+    """
+    def __init__(self, scheduler=None):
+        """
+        Initializes empty ports.
+
+        Parameters:
+            scheduler (MidiScheduler): The scheduler to use, a new VirtualClockScheduler by default. Pass a
+                                       MidiScheduler to run in real time.
+        """
+        self.scheduler = scheduler or VirtualClockScheduler()
+        self.start = self.scheduler.now()
+        self.harp = MemoryPort('harp', self.scheduler.now)
+        self.drone = MemoryPort('drone', self.scheduler.now)
+
+    def close(self):
+        self.scheduler.stop()
+        self.harp.close()
+        self.drone.close()
+
+class MidiFileBackend(NullBackend):
+    """
+    Writes the harp and drone into the two tracks of a type 1 MIDI file when closed. On the default virtual clock
+    hours of material are rendered in seconds, with a real-time MidiScheduler a live session is recorded.
+
+    Attributes:
+        path (str): The MIDI file to write.
+        ticks_per_beat (int): The resolution of the file.
+        tempo (int): The tempo of the file in microseconds per beat, only used to convert seconds to ticks.
+    """
+    def __init__(self, path, ticks_per_beat=480, tempo=500000, scheduler=None):
+        """
+        Initializes empty tracks.
+
+        Parameters:
+            path (str): The MIDI file to write.
+            ticks_per_beat (int): The resolution of the file.
+            tempo (int): The tempo of the file in microseconds per beat.
+            scheduler (MidiScheduler): The scheduler to use, a new VirtualClockScheduler by default.
+        """
+        super().__init__(scheduler)
+        self.path = path
+        self.ticks_per_beat = ticks_per_beat
+        self.tempo = tempo
+
+    def _track(self, port):
+        track = MidiTrack()
+        track.append(MetaMessage('track_name', name=port.name, time=0))
+        if port is self.harp:
+            track.append(MetaMessage('set_tempo', tempo=self.tempo, time=0))
+        last_tick = 0
+        # Sessions on a virtual clock can send slightly out of order, a stable sort restores the timeline
+        for time, message in sorted(port.messages, key=lambda item: item[0]):
+            tick = round(mido.second2tick(max(0.0, time - self.start), self.ticks_per_beat, self.tempo))
+            track.append(message.copy(time=tick - last_tick))
+            last_tick = tick
+        track.append(MetaMessage('end_of_track', time=0))
+        return track
+
+    def to_midi_file(self):
+        """
+        Builds the MIDI file from the messages sent so far.
+
+        Returns:
+            mido.MidiFile: A type 1 file with a harp and a drone track.
+        """
+        midi_file = MidiFile(type=1, ticks_per_beat=self.ticks_per_beat)
+        midi_file.tracks.append(self._track(self.harp))
+        midi_file.tracks.append(self._track(self.drone))
+        return midi_file
+
+    def close(self):
+        super().close()
+        self.to_midi_file().save(self.path)
+        print("MIDI_OUTPUT: Written", self.path)
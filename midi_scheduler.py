@@ -0,0 +1,256 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from mido import Message
+
+from voice_manager import VoiceManager
+
+# The dispatch thread sleeps until this close to an event and then spins, sleeping is not precise enough
+SPIN_THRESHOLD = 0.002
+REPORT_MARGIN = 0.01
+
+class MidiScheduler:
+    """
+    Plays timestamped MIDI messages from a priority queue on a dedicated thread, driven by a monotonic clock.
+    Producers schedule events ahead of time (up to `lookahead` seconds), so playback never waits on the asyncio
+    event loop and the event loop is never blocked by playback.
+
+    Attributes:
+        lookahead (float): How far in seconds producers schedule ahead of the playback time.
+        clock (callable): The monotonic clock events are timed against.
+        monitor (TimingMonitor): Records the intended and actual send time of every message, if given.
+        voices (VoiceManager): Tracks the sounding notes of every message sent.
+    """
+    def __init__(self, lookahead=0.1, clock=time.monotonic, monitor=None, report_interval=None, voices=None):
+        """
+        Initializes the queue and starts the dispatch thread.
+
+        Parameters:
+            lookahead (float): How far in seconds producers schedule ahead of the playback time.
+            clock (callable): The monotonic clock events are timed against.
+            monitor (TimingMonitor): Records the intended and actual send time of every message, if given.
+            report_interval (float): Prints the monitor statistics this often in seconds, never if None.
+            voices (VoiceManager): Tracks the sounding notes, a new VoiceManager by default.
+        """
+        self.lookahead = lookahead
+        self.clock = clock
+        self.monitor = monitor
+        self.voices = voices or VoiceManager()
+        self.report_interval = report_interval
+        self.last_report = clock()
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = None
+        self._start()
+
+    def _start(self):
+        self.thread = threading.Thread(target=self._run, name="midi-scheduler", daemon=True)
+        self.thread.start()
+
+    def now(self):
+        return self.clock()
+
+    def schedule(self, when, port, message):
+        """
+        Schedules a message to be sent on a port at the given clock time. Messages at the same time are sent in the
+        order they were scheduled.
+
+        Parameters:
+            when (float): The clock time to send the message at.
+            port: The mido output port.
+            message (mido.Message): The message.
+        """
+        with self.condition:
+            sequence = next(self.sequence)
+            heapq.heappush(self.queue, (when, sequence, port, message))
+            if self.queue[0][1] == sequence:
+                # The new event is the earliest one, wake the dispatch thread to re-plan its sleep
+                self.condition.notify()
+
+    def schedule_note(self, port, note, velocity, start, duration, channel=0):
+        """
+        Schedules a note_on at `start` and the matching note_off `duration` seconds later.
+
+        Parameters:
+            port: The mido output port.
+            note (int): The MIDI note number.
+            velocity (int): The note velocity.
+            start (float): The clock time of the note_on.
+            duration (float): The length of the note in seconds.
+            channel (int): The MIDI channel.
+        """
+        self.schedule(start, port, Message('note_on', note=int(note), velocity=int(velocity), channel=channel))
+        self.schedule(start + duration, port, Message('note_off', note=int(note), velocity=int(velocity), channel=channel))
+
+    async def wait_until(self, when):
+        """
+        Suspends the calling coroutine until the given clock time, without blocking the event loop.
+
+        Parameters:
+            when (float): The clock time to wait for.
+        """
+        delay = when - self.clock()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def wait_idle(self, event, timeout):
+        """
+        Waits while a producer has nothing to play, until an event is set or the timeout passed on the clock.
+
+        Parameters:
+            event (asyncio.Event): Ends the wait early when set.
+            timeout (float): The longest wait in seconds.
+        """
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                when = self.queue[0][0]
+                delay = when - self.clock()
+                if delay > SPIN_THRESHOLD:
+                    self.condition.wait(delay - SPIN_THRESHOLD)
+                    continue
+            while self.clock() < when:
+                pass
+            now = self.clock()
+            due = []
+            with self.condition:
+                while self.queue and self.queue[0][0] <= now:
+                    due.append(heapq.heappop(self.queue))
+            for when, _, port, message in due:
+                self._send(port, message, when)
+            self._report(now)
+
+    def _report(self, now):
+        # Printing takes long enough to delay messages, so only report with no message due in the next REPORT_MARGIN
+        if self.monitor is None or self.report_interval is None or now - self.last_report < self.report_interval:
+            return
+        with self.condition:
+            if self.queue and self.queue[0][0] - now < REPORT_MARGIN:
+                return
+        self.last_report = now
+        print(self.monitor.format_stats())
+
+    def _send(self, port, message, when, record=True):
+        for message in self.voices.filter(port, message):
+            try:
+                port.send(message)
+            except Exception as e:
+                print(f"MIDI_SCHEDULER: Failed to send {message}: {e}")
+                continue
+            if record and self.monitor is not None:
+                self.monitor.record(getattr(port, 'name', repr(port)), message, when, self.clock())
+
+    def cancel(self, channel):
+        """
+        Drops the pending messages of a channel.
+
+        Parameters:
+            channel (int): The MIDI channel.
+        """
+        with self.condition:
+            self.queue = [event for event in self.queue if getattr(event[3], 'channel', None) != channel]
+            heapq.heapify(self.queue)
+
+    def all_notes_off(self, channel=None):
+        """
+        Drops the pending messages and turns off every sounding note, of one channel or of all of them.
+        Used when a stream ends abnormally, so none of its notes is left hanging.
+
+        Parameters:
+            channel (int): The MIDI channel, all channels if None.
+        """
+        if channel is None:
+            with self.condition:
+                self.queue = []
+        else:
+            self.cancel(channel)
+        now = self.now()
+        for port, message in self.voices.release(channel):
+            self.schedule(now, port, message)
+
+    def stop(self, release_voices=True):
+        """
+        Stops the dispatch thread, dropping the pending messages.
+
+        Parameters:
+            release_voices (bool): Turn off every note that is still sounding.
+        """
+        with self.condition:
+            self.running = False
+            self.queue = []
+            self.condition.notify()
+        self.thread.join(1)
+        if release_voices:
+            for port, message in self.voices.release():
+                # Sent early on purpose, so not recorded as timing data
+                self._send(port, message, self.clock(), record=False)
+
+class VirtualClockScheduler(MidiScheduler):
+    """
+    A scheduler on a virtual clock that only advances when a producer waits, for rendering offline as fast as the
+    generator can produce notes. Waiting sends every message that is due on the calling thread, with the clock set
+    to the message's time, and returns right away.
+    """
+    def __init__(self, monitor=None, voices=None):
+        """
+        Initializes the queue with the clock at zero.
+
+        Parameters:
+            monitor (TimingMonitor): Records every message, if given. All latencies are zero on a virtual clock.
+            voices (VoiceManager): Tracks the sounding notes, a new VoiceManager by default.
+        """
+        self.time = 0.0
+        self.latest = 0.0
+        super().__init__(lookahead=0.0, clock=self.now, monitor=monitor, voices=voices)
+
+    def _start(self):
+        # No dispatch thread, waiting sends the due messages
+        pass
+
+    def now(self):
+        return self.time
+
+    def _advance(self, until):
+        self.latest = max(self.latest, until)
+        while self.queue and self.queue[0][0] <= until:
+            when, _, port, message = heapq.heappop(self.queue)
+            self.time = when
+            self._send(port, message, when)
+        self.time = self.latest
+
+    async def wait_until(self, when):
+        self._advance(when)
+        # Let the other sessions and the server run between notes
+        await asyncio.sleep(0)
+
+    async def wait_idle(self, event, timeout):
+        # Silence takes no time to render, the clock moves on by the timeout unless the event is already set
+        if not event.is_set():
+            await self.wait_until(self.time + timeout)
+
+    def stop(self, release_voices=True):
+        """
+        Runs the virtual clock to the end of the scheduled messages. Nothing is ever late on a virtual clock, so
+        the pending messages are all sent.
+
+        Parameters:
+            release_voices (bool): Turn off every note that is still sounding afterwards.
+        """
+        if self.queue:
+            self._advance(max(self.queue)[0])
+        if release_voices:
+            for port, message in self.voices.release():
+                self._send(port, message, self.time, record=False)
@@ -0,0 +1,138 @@
+import csv
+import threading
+from collections import deque
+
+import numpy as np
+
+class TimingMonitor:
+    """
+    Records the intended and actual send time of every MIDI message and keeps rolling latency and jitter
+    statistics per output port. Latency is how late a message was sent, jitter is how much the latency changed
+    from the previous message on the same port.
+
+    Attributes:
+        window (int): The number of most recent messages per port the statistics cover.
+        trace (deque): The most recent (port, type, note, channel, intended, actual) records.
+    """
+    def __init__(self, window=2048, trace_size=100000, bin_width=0.0005, max_latency=0.05):
+        """
+        Initializes empty per-port ring buffers.
+
+        Parameters:
+            window (int): The number of most recent messages per port the statistics cover.
+            trace_size (int): The number of records kept for export.
+            bin_width (float): The width in seconds of the histogram bins.
+            max_latency (float): The upper edge in seconds of the last histogram bin, later messages are counted in it.
+        """
+        self.window = window
+        self.bins = np.arange(0, max_latency + bin_width, bin_width)
+        self.trace = deque(maxlen=trace_size)
+        self.lock = threading.Lock()
+        self.ports = {}
+
+    def _port(self, port_name):
+        if port_name not in self.ports:
+            self.ports[port_name] = {
+                "latencies": np.zeros(self.window),
+                "jitters": np.zeros(self.window),
+                "head": 0,
+                "length": 0,
+                "count": 0,
+                "last_latency": None,
+            }
+        return self.ports[port_name]
+
+    def record(self, port_name, message, intended, actual):
+        """
+        Records a sent message.
+
+        Parameters:
+            port_name (str): The output port the message was sent on.
+            message (mido.Message): The message.
+            intended (float): The clock time the message was scheduled for.
+            actual (float): The clock time the message was sent at.
+        """
+        latency = actual - intended
+        with self.lock:
+            port = self._port(port_name)
+            jitter = abs(latency - port["last_latency"]) if port["last_latency"] is not None else 0.0
+            head = port["head"]
+            port["latencies"][head] = latency
+            port["jitters"][head] = jitter
+            port["head"] = (head + 1) % self.window
+            port["length"] = min(port["length"] + 1, self.window)
+            port["count"] += 1
+            port["last_latency"] = latency
+            self.trace.append((port_name, message.type, getattr(message, 'note', None),
+                               getattr(message, 'channel', None), intended, actual))
+
+    def histogram(self, port_name):
+        """
+        Returns the latency histogram of a port over the rolling window.
+
+        Parameters:
+            port_name (str): The output port.
+
+        Returns:
+            tuple: The counts and the bin edges in seconds, as returned by numpy.histogram.
+        """
+        with self.lock:
+            port = self._port(port_name)
+            latencies = np.clip(port["latencies"][:port["length"]], self.bins[0], self.bins[-1])
+        return np.histogram(latencies, self.bins)
+
+    def stats(self):
+        """
+        Returns the rolling statistics of every port.
+
+        Returns:
+            dict: Per port name, the number of messages sent and the p50, p99 and maximum latency and jitter
+                  in milliseconds over the rolling window.
+        """
+        stats = {}
+        with self.lock:
+            for port_name, port in self.ports.items():
+                length = port["length"]
+                port_stats = {"count": port["count"]}
+                for key, buffer in (("latency", "latencies"), ("jitter", "jitters")):
+                    values = port[buffer][:length] * 1000
+                    p50, p99 = np.percentile(values, [50, 99]) if length else (0.0, 0.0)
+                    port_stats.update({
+                        f"{key}_p50_ms": float(p50),
+                        f"{key}_p99_ms": float(p99),
+                        f"{key}_max_ms": float(values.max()) if length else 0.0,
+                    })
+                stats[port_name] = port_stats
+        return stats
+
+    def format_stats(self):
+        """
+        Formats the statistics of every port as one line each for logging.
+
+        Returns:
+            str: The formatted statistics.
+        """
+        lines = []
+        for port_name, stats in self.stats().items():
+            lines.append(f"MIDI_TIMING: {port_name}: sent={stats['count']} "
+                         f"latency p50={stats['latency_p50_ms']:.2f}ms p99={stats['latency_p99_ms']:.2f}ms "
+                         f"max={stats['latency_max_ms']:.2f}ms "
+                         f"jitter p50={stats['jitter_p50_ms']:.2f}ms p99={stats['jitter_p99_ms']:.2f}ms "
+                         f"max={stats['jitter_max_ms']:.2f}ms")
+        return "\n".join(lines)
+
+    def export_trace(self, path):
+        """
+        Writes the recorded trace to a CSV file.
+
+        Parameters:
+            path (str): The CSV file.
+        """
+        with self.lock:
+            trace = list(self.trace)
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["port", "type", "note", "channel", "intended", "actual", "latency_ms"])
+            for port_name, message_type, note, channel, intended, actual in trace:
+                writer.writerow([port_name, message_type, note, channel, f"{intended:.6f}", f"{actual:.6f}",
+                                 f"{(actual - intended) * 1000:.3f}"])
@@ -0,0 +1,103 @@
+import asyncio
+from collections import deque
+
+class MotifPipeline:
+    """
+    Generates motifs ahead of playback. A producer task keeps up to `depth` motifs for the current MotifGen
+    parameters queued, generating them on a worker thread, so the next phrase is ready when the current one ends.
+    Every motif is tagged with the parameter version it was generated for, and motifs of an older version are
+    discarded, so a parameter change takes effect with the next phrase.
+
+    Attributes:
+        motif_gen (MotifGen): The generator.
+        depth (int): The maximum number of motifs generated ahead.
+        generated (int): The number of motifs generated.
+        discarded (int): The number of motifs discarded because the parameters changed.
+        waited (int): The number of times playback had to wait for a motif.
+    """
+    def __init__(self, motif_gen, depth=2):
+        self.motif_gen = motif_gen
+        self.depth = depth
+        # (version, motif, exception) in generation order
+        self.queue = deque()
+        self.version = motif_gen.version
+        self.space = asyncio.Event()
+        self.available = asyncio.Event()
+        self.task = None
+        self.generated = 0
+        self.discarded = 0
+        self.waited = 0
+
+    def start(self):
+        self.space.set()
+        self.task = asyncio.create_task(self._produce())
+
+    async def _produce(self):
+        while True:
+            if len(self.queue) >= self.depth:
+                self.space.clear()
+                await self.space.wait()
+                continue
+            version = self.motif_gen.version
+            motif, exception = None, None
+            try:
+                motif = await asyncio.to_thread(self.motif_gen.choose_motif)
+            except Exception as e:
+                exception = e
+            self.generated += 1
+            if version != self.motif_gen.version:
+                # The parameters changed while generating
+                self.discarded += 1
+                continue
+            self.queue.append((version, motif, exception))
+            self.available.set()
+
+    def refresh(self):
+        """
+        Discards the queued motifs if the parameters changed since they were generated, so the producer
+        starts generating for the new parameters right away. Called after every parameter update.
+        """
+        if self.motif_gen.version == self.version:
+            return
+        self.version = self.motif_gen.version
+        stale = [item for item in self.queue if item[0] != self.version]
+        self.discarded += len(stale)
+        self.queue = deque(item for item in self.queue if item[0] == self.version)
+        self.space.set()
+
+    async def get(self):
+        """
+        Returns the next motif for the current parameters, waiting only if none has been generated yet.
+
+        Returns:
+            The result of MotifGen.choose_motif.
+
+        Raises:
+            Exception: Whatever choose_motif raised while generating the motif.
+        """
+        self.refresh()
+        waited = False
+        while True:
+            while self.queue:
+                version, motif, exception = self.queue.popleft()
+                self.space.set()
+                if version != self.motif_gen.version:
+                    self.discarded += 1
+                    continue
+                if exception is not None:
+                    raise exception
+                return motif
+            if not waited:
+                waited = True
+                self.waited += 1
+            self.available.clear()
+            await self.available.wait()
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
@@ -0,0 +1,73 @@
+import csv
+import json
+
+import numpy as np
+
+class MotifStore:
+    """
+    The motif corpus parsed once into flat integer arrays. The notes of all motifs are stored back to back in
+    `notes`, motif i spans notes[offsets[i]:offsets[i + 1]], and `index` maps every (direction, scale) to the
+    ids of its motifs, so choosing a motif is a random index into a prebuilt array.
+
+    Attributes:
+        notes (numpy.ndarray): The MIDI notes of all motifs.
+        offsets (numpy.ndarray): The start of every motif in `notes`, followed by the total number of notes.
+        index (dict): (direction, scale) -> numpy.ndarray of motif ids.
+    """
+    def __init__(self, motifs):
+        """
+        Builds the arrays.
+
+        Parameters:
+            motifs (list): (direction, scale, notes) tuples, with the notes as a list of MIDI note numbers.
+        """
+        lengths = np.array([len(notes) for _, _, notes in motifs], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        self.notes = np.fromiter((note for _, _, notes in motifs for note in notes), dtype=np.int64,
+                                 count=int(self.offsets[-1]))
+        self.notes.flags.writeable = False
+        groups = {}
+        for motif_id, (direction, scale, _) in enumerate(motifs):
+            groups.setdefault((direction, scale), []).append(motif_id)
+        self.index = {key: np.array(ids, dtype=np.int64) for key, ids in groups.items()}
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Loads the corpus written by motifs_df/create_motives_df.py.
+
+        Parameters:
+            path (str): The CSV file with direction, scale and midi_notes columns.
+
+        Returns:
+            MotifStore: The store.
+        """
+        with open(path, newline='') as file:
+            motifs = [(int(row["direction"]), row["scale"], json.loads(row["midi_notes"])) for row in csv.DictReader(file)]
+        return cls(motifs)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def count(self, direction, scale):
+        ids = self.index.get((direction, scale))
+        return 0 if ids is None else len(ids)
+
+    def motif(self, motif_id):
+        return self.notes[self.offsets[motif_id]:self.offsets[motif_id + 1]]
+
+    def choose(self, direction, scale):
+        """
+        Picks a random motif for a direction and scale.
+
+        Parameters:
+            direction (int): The trend the motif follows.
+            scale (str): The scale of the motif.
+
+        Returns:
+            numpy.ndarray: A read-only view of the motif's MIDI notes, or None if there is no matching motif.
+        """
+        ids = self.index.get((direction, scale))
+        if ids is None:
+            return None
+        return self.motif(ids[np.random.randint(len(ids))])
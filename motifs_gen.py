@@ -1,7 +1,7 @@
+import os
 import numpy as np
-import pandas as pd
-import ast
 from markov.markov_chain import MarkovManager
+from motif_store import MotifStore
 from utils import sample_initial_note
 
 PITCH_CLASSES = ["c", "d_b", "d", "e_b", "e", "f", "g_b", "g", "a_b", "a", "b_b", "b"]
@@ -10,14 +10,29 @@ MIDI_MULTIPLIER = oktave * 15
 
 midis = [i for i in range(MIDI_MULTIPLIER, MIDI_MULTIPLIER + len(PITCH_CLASSES))]
 translation_pit_2_midi = dict(zip(PITCH_CLASSES, midis))
-midi_motives = pd.read_csv("motifs_df/midi_motives.csv")
+MOTIVES_PATH = "motifs_df/midi_motives.csv"
+_midi_motives = None
+
+def get_midi_motives():
+    # The corpus is loaded on the first motif rather than at import, which keeps startup fast
+    global _midi_motives
+    if _midi_motives is None:
+        _midi_motives = MotifStore.from_csv(MOTIVES_PATH)
+    return _midi_motives
 
 CONSTANT = 3
 OFF = 4
 
+# Set to use variable-order Markov models of up to this order instead of the second-order models
+MARKOV_MAX_ORDER = int(os.environ['CHROMATONE_MARKOV_ORDER']) if os.environ.get('CHROMATONE_MARKOV_ORDER') else None
+# Set to 1 to learn every played Markov motif into the session's models
+MARKOV_LEARN = os.environ.get('CHROMATONE_MARKOV_LEARN') == '1'
+
 class MotifGen:
-    def __init__(self, with_markov=False):
-        self.markov_manager = MarkovManager()
+    def __init__(self, with_markov=False, markov_max_order=MARKOV_MAX_ORDER, learn_played=MARKOV_LEARN):
+        self._markov_manager = None
+        self.markov_max_order = markov_max_order
+        self.learn_played = learn_played
         self.probabilities = None
         self.with_markov: bool = with_markov
         self.scale = None
@@ -25,21 +40,40 @@ class MotifGen:
         self.duration = 0.35
         self.active_color_flag = False
         self.key = None
+        # Incremented whenever a parameter that changes which motifs are chosen is set to a new value
+        self.version = 0
+
+    @property
+    def markov_manager(self):
+        # Only generators that use the Markov models load them, on the first Markov motif
+        if self._markov_manager is None:
+            self._markov_manager = MarkovManager(max_order=self.markov_max_order)
+        return self._markov_manager
+
+    def _set_parameter(self, name, value):
+        if getattr(self, name) != value:
+            setattr(self, name, value)
+            self.version += 1
 
     def set_active_color_flag(self, active_color_flag):
-        self.active_color_flag = active_color_flag
+        self._set_parameter("active_color_flag", active_color_flag)
 
     def set_key(self, key):
-        self.key = key
+        self._set_parameter("key", key)
 
     def set_probabilities(self, probabilities):
+        # Motifs only depend on the most likely pitch class, so only a change of it counts as a new parameter
+        def strongest(p):
+            return int(np.argmax(p)) if p else None
+        if strongest(self.probabilities) != strongest(probabilities):
+            self.version += 1
         self.probabilities = probabilities
 
     def set_trend(self, trend):
-        self.trend = trend
+        self._set_parameter("trend", trend)
 
     def set_scale(self, scale):
-        self.scale = scale
+        self._set_parameter("scale", scale)
 
     def set_duration(self, duration):
         self.duration = duration
@@ -50,6 +84,21 @@ class MotifGen:
     def get_duration(self):
         return self.duration
 
+    def learn(self, notes, trend, scale, key):
+        """
+        Learns a played Markov motif into the model of its trend and scale, so the session leans towards the phrases
+        it has played. Every generator has its own models, the ones on disk are not changed.
+
+        Parameters:
+            notes: The transposed MIDI notes of the motif, as returned by choose_motif.
+            trend (int): The trend the motif was generated for.
+            scale (str): The scale the motif was generated for.
+            key (int): The key note returned by choose_motif with the motif.
+        """
+        # Undo the transposition of choose_motif, the models are trained on untransposed motifs
+        key_ind = key + 24 - translation_pit_2_midi[PITCH_CLASSES[0]]
+        self.markov_manager.update(trend=trend, scale=scale, sequences_notes=[np.asarray(notes) - key_ind])
+
     def choose_motif(self):
         # Check if probabilities have been set
         if self.probabilities:
@@ -73,23 +122,19 @@ class MotifGen:
                 # markov implementation --> Work in progress
                 initial_note = sample_initial_note(direction=int(self.trend), scale=str(self.scale))
                 markov_model = self.markov_manager.get_model(trend=self.trend, scale=self.scale)
-                markov_seq = markov_model.generate_sequence([-1, initial_note], 9)
+                # Drop the -1 start marker, it is not a note
+                markov_seq = markov_model.generate_sequence([-1, initial_note], 9)[1:]
                 return markov_seq + key_ind, self.duration, self.trend, translation_pit_2_midi[key] - 24
 
-            # Filter the midi_motives DataFrame based on the trend and scale
-            df_filtered = midi_motives[(midi_motives["direction"] == self.trend) & (midi_motives["scale"] == self.scale)]
+            # Randomly select one of the motifs for the trend and scale
+            midi_notes = get_midi_motives().choose(self.trend, self.scale)
             
-            # If no matching rows are found, return None
-            if df_filtered.empty:
+            # If no matching motif is found, return None
+            if midi_notes is None:
                 return None
             
-            # Randomly select one row from the filtered DataFrame
-            random_row = df_filtered.sample()
-            # Extract the MIDI notes from the selected row
-            midi_notes = random_row["midi_notes"].iloc[0]
-            
             # Return the transposed MIDI notes, duration, trend, and transposed key index
-            return np.array(ast.literal_eval(midi_notes)) + key_ind, self.duration, self.trend, translation_pit_2_midi[key] - 24
+            return midi_notes + key_ind, self.duration, self.trend, translation_pit_2_midi[key] - 24
         else:
             # If probabilities are not set, print an error message and return None
             print("MOTIF_GEN: Failed to generate note")
@@ -0,0 +1,403 @@
+import json
+import os
+import socket
+import stat
+import struct
+import tempfile
+import threading
+import time
+
+from utils import PITCH_CLASSES
+
+# Transport between the drawing app and the generator: 'tcp', or 'unix' for a Unix domain socket,
+# which avoids the TCP stack and port conflicts between instances and is protected by file permissions
+TRANSPORT = os.environ.get('CHROMATONE_TRANSPORT', 'tcp')
+TCP_HOST = os.environ.get('CHROMATONE_HOST', 'localhost')
+TCP_PORT = int(os.environ.get('CHROMATONE_PORT', 12346))
+SOCKET_PATH = os.environ.get('CHROMATONE_SOCKET_PATH', os.path.join(tempfile.gettempdir(), 'chromatone.sock'))
+
+# Every message is sent as a 4-byte big-endian payload length followed by the payload
+FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 1 << 20
+
+HEARTBEAT_INTERVAL = 1.0
+# The server drops a connection that has been silent for this long
+HEARTBEAT_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+
+def transport_address(transport=None):
+    """
+    Returns the configured transport and its address.
+
+    Parameters:
+        transport (str): 'tcp' or 'unix', TRANSPORT by default.
+
+    Returns:
+        tuple: The transport and either the (host, port) or the socket path.
+    """
+    transport = transport or TRANSPORT
+    if transport == 'tcp':
+        return transport, (TCP_HOST, TCP_PORT)
+    if transport == 'unix':
+        return transport, SOCKET_PATH
+    raise ValueError(f"Unknown transport {transport!r}, expected 'tcp' or 'unix'")
+
+def open_connection(transport, address, timeout=1.0):
+    """
+    Opens a blocking client socket with the given transport.
+
+    Parameters:
+        transport (str): 'tcp' or 'unix'.
+        address: The (host, port) or the socket path.
+        timeout (float): The connection timeout in seconds.
+
+    Returns:
+        socket.socket: The connected socket.
+    """
+    if transport == 'unix':
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+    sock = socket.create_connection(address, timeout=timeout)
+    # Updates are small, send them right away instead of waiting to coalesce packets
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+def _remove_stale_socket(path):
+    """
+    Removes a socket file left behind by a generator that did not shut down cleanly.
+
+    Raises:
+        OSError: If another generator is still listening on the path or the path is not a socket.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(f"{path} exists and is not a socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+    else:
+        raise OSError(f"Another generator is already listening on {path}")
+    finally:
+        probe.close()
+
+async def start_server(client_connected, transport, address):
+    """
+    Starts an asyncio stream server with the given transport.
+    A Unix domain socket is only accessible by the user running the generator.
+
+    Parameters:
+        client_connected (callable): The coroutine function called with (reader, writer) for every client.
+        transport (str): 'tcp' or 'unix'.
+        address: The (host, port) or the socket path.
+
+    Returns:
+        asyncio.Server: The started server.
+    """
+    # Imported here, the drawing app only uses the client side of this module
+    import asyncio
+    if transport == 'unix':
+        _remove_stale_socket(address)
+        # Bound with a restrictive umask, so the socket is never accessible by other users, not even briefly
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            sock.bind(address)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+        return await asyncio.start_unix_server(client_connected, sock=sock)
+    host, port = address
+    return await asyncio.start_server(client_connected, host, port)
+
+def encode_frame(payload):
+    """
+    Prefixes a payload with its length.
+
+    Parameters:
+        payload (bytes): The message payload.
+
+    Returns:
+        bytes: The framed message.
+    """
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+# Binary messages start with the protocol version and the message type. JSON messages start with '{',
+# which is never a valid version, so both can be received on the same connection.
+PROTOCOL_VERSION = 1
+MESSAGE_HEADER = struct.Struct('!BB')
+MSG_UPDATE = 1
+MSG_CLOSE = 2
+MSG_HEARTBEAT = 3
+
+# Update: 12 pitch probabilities, trend, scale, duration, active color flag, key
+UPDATE_BODY = struct.Struct('!12fBBdBB')
+SCALES = ['min', 'maj']
+NONE_INDEX = 255
+
+# 'binary' or 'json', JSON is easier to read in a packet capture
+WIRE_FORMAT = os.environ.get('CHROMATONE_WIRE_FORMAT', 'binary')
+
+def _index_or_none(values, value):
+    return values.index(value) if value is not None else NONE_INDEX
+
+def _value_or_none(values, index):
+    if index == NONE_INDEX:
+        return None
+    if index >= len(values):
+        raise ValueError(f"Malformed update: index {index} out of range")
+    return values[index]
+
+def encode_message(message, wire_format=None):
+    """
+    Encodes a message dictionary for the drawing to generator protocol.
+
+    Parameters:
+        message (dict): An analysis update, {"close": True} or {"heartbeat": True}.
+        wire_format (str): 'binary' or 'json', WIRE_FORMAT by default.
+
+    Returns:
+        bytes: The message payload.
+    """
+    if (wire_format or WIRE_FORMAT) == 'json':
+        return json.dumps(message).encode('utf-8')
+    if message.get("heartbeat"):
+        return MESSAGE_HEADER.pack(PROTOCOL_VERSION, MSG_HEARTBEAT)
+    if message.get("close"):
+        return MESSAGE_HEADER.pack(PROTOCOL_VERSION, MSG_CLOSE)
+    return MESSAGE_HEADER.pack(PROTOCOL_VERSION, MSG_UPDATE) + UPDATE_BODY.pack(
+        *message["pitch_probabilities"],
+        message["trend"],
+        _index_or_none(SCALES, message["scale"]),
+        message["duration"],
+        bool(message["active_color_flag"]),
+        _index_or_none(PITCH_CLASSES, message["key"]),
+    )
+
+def decode_message(payload):
+    """
+    Decodes a binary or JSON message payload.
+
+    Parameters:
+        payload (bytes): The message payload.
+
+    Returns:
+        dict: The message in the same form as encode_message takes it. Message types added by newer clients
+              decode to {"control": type, "body": bytes}.
+
+    Raises:
+        ValueError: If the payload uses an unknown protocol version or is malformed.
+    """
+    if payload[:1] == b'{':
+        return json.loads(payload.decode('utf-8'))
+    if len(payload) < MESSAGE_HEADER.size:
+        raise ValueError(f"Malformed message: {len(payload)} bytes is shorter than the header")
+    version, message_type = MESSAGE_HEADER.unpack_from(payload)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+    if message_type == MSG_HEARTBEAT:
+        return {"heartbeat": True}
+    if message_type == MSG_CLOSE:
+        return {"close": True}
+    if message_type != MSG_UPDATE:
+        return {"control": message_type, "body": payload[MESSAGE_HEADER.size:]}
+    try:
+        values = UPDATE_BODY.unpack_from(payload, MESSAGE_HEADER.size)
+    except struct.error as e:
+        raise ValueError(f"Malformed update: {e}")
+    trend, scale, duration, active_color_flag, key = values[12:]
+    return {
+        "close": False,
+        "pitch_probabilities": list(values[:12]),
+        "scale": _value_or_none(SCALES, scale),
+        "trend": trend,
+        "duration": duration,
+        "active_color_flag": bool(active_color_flag),
+        "key": _value_or_none(PITCH_CLASSES, key),
+    }
+
+def heartbeat_message():
+    return encode_message({"heartbeat": True})
+
+async def read_frame(reader):
+    """
+    Reads the payload of the next length-prefixed frame from an asyncio stream.
+
+    Parameters:
+        reader (asyncio.StreamReader): The stream to read from.
+
+    Returns:
+        bytes: The payload.
+
+    Raises:
+        asyncio.IncompleteReadError: If the stream ends before the frame is complete.
+        ValueError: If the frame is larger than MAX_FRAME_SIZE.
+    """
+    (length,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {length} bytes exceeds the maximum of {MAX_FRAME_SIZE}")
+    return await reader.readexactly(length)
+
+class FrameDecoder:
+    """
+    Splits a byte stream into the payloads of length-prefixed frames, however the stream was chunked.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Adds received bytes and returns the payloads of all frames completed by them.
+
+        Parameters:
+            data (bytes): The received bytes.
+
+        Returns:
+            list: The complete payloads, in order.
+        """
+        self.buffer += data
+        payloads = []
+        while len(self.buffer) >= FRAME_HEADER.size:
+            (length,) = FRAME_HEADER.unpack_from(self.buffer)
+            if length > MAX_FRAME_SIZE:
+                raise ValueError(f"Frame of {length} bytes exceeds the maximum of {MAX_FRAME_SIZE}")
+            end = FRAME_HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            payloads.append(bytes(self.buffer[FRAME_HEADER.size:end]))
+            del self.buffer[:end]
+        return payloads
+
+class PersistentClient:
+    """
+    A long-lived connection to the generator that frames every message, sends a heartbeat while idle
+    and reconnects automatically with an increasing back-off when the connection is lost.
+    The generator starts a fresh session for every connection, so the last message sent with replay=True
+    is sent again first thing on every new connection.
+
+    Attributes:
+        transport (str): 'tcp' or 'unix'.
+        address: The (host, port) or the socket path of the generator.
+        heartbeat_interval (float): The idle time in seconds after which a heartbeat is sent.
+        sock (socket.socket): The connected socket, None while disconnected.
+        replay_frame (bytes): The framed message sent on every new connection, None if there is none.
+    """
+    def __init__(self, transport, address, heartbeat_interval=HEARTBEAT_INTERVAL, min_backoff=0.25, max_backoff=5.0):
+        """
+        Initializes the client and starts the heartbeat thread. The connection is opened on first use.
+
+        Parameters:
+            transport (str): 'tcp' or 'unix'.
+            address: The (host, port) or the socket path of the generator.
+            heartbeat_interval (float): The idle time in seconds after which a heartbeat is sent.
+            min_backoff (float): The first delay in seconds before retrying a failed connection.
+            max_backoff (float): The longest delay in seconds between connection attempts.
+        """
+        self.transport = transport
+        self.address = address
+        self.heartbeat_interval = heartbeat_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.next_attempt = 0.0
+        self.last_send = 0.0
+        self.sock = None
+        self.replay_frame = None
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat, name="heartbeat", daemon=True)
+        self.heartbeat_thread.start()
+
+    def _connect(self):
+        """
+        Opens the connection unless an attempt failed too recently and sends the replayed message on it.
+        Must be called with the lock held.
+        """
+        now = time.monotonic()
+        if now < self.next_attempt:
+            raise ConnectionError(f"Not connected to {self.address}, retrying in {self.next_attempt - now:.2f}s")
+        try:
+            sock = open_connection(self.transport, self.address)
+        except OSError:
+            self.next_attempt = now + self.backoff
+            self.backoff = min(self.max_backoff, self.backoff * 2)
+            raise
+        self.sock = sock
+        self.backoff = self.min_backoff
+        print("CONNECTION: Connected to", self.address)
+        if self.replay_frame is not None:
+            try:
+                sock.sendall(self.replay_frame)
+            except OSError:
+                self._disconnect()
+                raise
+            self.last_send = time.monotonic()
+
+    def _disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def send(self, payload, replay=False):
+        """
+        Sends a message, connecting first if needed. A message that fails on a broken connection is retried once
+        on a fresh connection.
+
+        Parameters:
+            payload (bytes): The message payload.
+            replay (bool): Send this message again on every new connection, until another one replaces it.
+
+        Raises:
+            OSError: If the message could not be sent.
+        """
+        frame = encode_frame(payload)
+        with self.lock:
+            if replay:
+                self.replay_frame = frame
+            for attempt in range(2):
+                if self.sock is None:
+                    self._connect()
+                    if replay:
+                        # Connecting already sent it
+                        return
+                try:
+                    self.sock.sendall(frame)
+                    self.last_send = time.monotonic()
+                    return
+                except OSError:
+                    self._disconnect()
+                    if attempt == 1:
+                        raise
+
+    def _heartbeat(self):
+        while not self.closed.wait(self.heartbeat_interval / 2):
+            if time.monotonic() - self.last_send < self.heartbeat_interval:
+                continue
+            try:
+                self.send(heartbeat_message())
+            except OSError:
+                # Not connected, the next heartbeat or message tries again after the back-off
+                pass
+
+    def close(self):
+        """
+        Stops the heartbeat and closes the connection.
+        """
+        self.closed.set()
+        self.heartbeat_thread.join(self.heartbeat_interval)
+        with self.lock:
+            self._disconnect()
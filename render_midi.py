@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import time
+
+from connect_async import PizzaComm, Session, send_notes
+from midi_output import MidiFileBackend
+from utils import PITCH_CLASSES, UP, DOWN, VARYING, CONSTANT
+
+TRENDS = {'up': UP, 'down': DOWN, 'varying': VARYING, 'constant': CONSTANT}
+
+async def render(output, seconds, key='c', scale='maj', trend=CONSTANT, duration=0.35, sessions=1, with_markov=False,
+                 markov_order=None):
+    """
+    Renders generated motifs into a MIDI file on a virtual clock, as fast as the generator produces them.
+
+    Parameters:
+        output (str): The MIDI file to write.
+        seconds (float): The length of the material to render.
+        key (str): The pitch class of the key.
+        scale (str): The scale, 'maj' or 'min'.
+        trend (int): The drawing trend the motifs follow.
+        duration (float): The note duration in seconds.
+        sessions (int): The number of simultaneous motif streams, each on its own MIDI channel.
+        with_markov (bool): Generate the motifs with the Markov models instead of the motif corpus.
+        markov_order (int): Use variable-order Markov models of up to this order, the default models if None.
+
+    Returns:
+        tuple: The number of harp and drone messages written.
+
+    Raises:
+        ValueError: If there are more sessions than MIDI channels, or if a session generated no notes, e.g. because
+                    there is no motif for the scale and trend. The MIDI file is written anyway.
+    """
+    backend = MidiFileBackend(output)
+    pizza_comm = PizzaComm(backend)
+    probabilities = [1.0 if pitch == key else 0.0 for pitch in PITCH_CLASSES]
+    streams = []
+    for session_id in range(sessions):
+        channel = pizza_comm.scheduler.voices.acquire_channel()
+        if channel is None:
+            raise ValueError(f"At most {session_id} sessions can be rendered, one per MIDI channel")
+        session = Session(session_id, channel, with_markov, None)
+        if markov_order is not None:
+            session.motif_gen.markov_max_order = markov_order
+        session.motif_gen.set_probabilities(probabilities)
+        session.motif_gen.set_scale(scale)
+        session.motif_gen.set_trend(trend)
+        session.motif_gen.set_duration(duration)
+        session.notes_task = asyncio.create_task(send_notes(pizza_comm, session))
+        streams.append(session)
+
+    scheduler = pizza_comm.scheduler
+    while scheduler.now() < seconds and not any(session.notes_task.done() for session in streams):
+        await asyncio.sleep(0)
+    for session in streams:
+        session.closed.set()
+    await asyncio.gather(*(session.notes_task for session in streams))
+    pizza_comm.close()
+    played = {message.channel for _, message in backend.harp.messages if message.type == 'note_on'}
+    silent = [session.session_id for session in streams if session.channel not in played]
+    if silent:
+        raise ValueError(f"Sessions {silent} generated no notes for scale {scale!r} and trend {trend}")
+    return len(backend.harp.messages), len(backend.drone.messages)
+
+def main():
+    parser = argparse.ArgumentParser(description="Render ChromaTone motifs into a MIDI file faster than real time.")
+    parser.add_argument("-o", "--output", required=True, help="output .mid file")
+    parser.add_argument("--minutes", type=float, default=10, help="length of the rendered material")
+    parser.add_argument("--key", choices=PITCH_CLASSES, default='c')
+    parser.add_argument("--scale", choices=['maj', 'min'], default='maj')
+    parser.add_argument("--trend", choices=list(TRENDS), default='constant')
+    parser.add_argument("--duration", type=float, default=0.35, help="note duration in seconds")
+    parser.add_argument("--sessions", type=int, default=1, help="number of simultaneous motif streams")
+    parser.add_argument("--markov", action="store_true", help="generate motifs with the Markov models")
+    parser.add_argument("--markov-order", type=int, default=None, help="use variable-order Markov models up to this order")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the generator output")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            harp, drone = asyncio.run(render(args.output, args.minutes * 60, args.key, args.scale, TRENDS[args.trend],
+                                             args.duration, args.sessions, args.markov, args.markov_order))
+    except ValueError as e:
+        parser.error(str(e))
+    elapsed = time.perf_counter() - start
+    print(f"RENDER: {args.minutes:g} minutes ({harp} harp and {drone} drone messages) written to {args.output} "
+          f"in {elapsed:.1f}s")
+
+if __name__ == "__main__":
+    main()
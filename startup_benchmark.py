@@ -0,0 +1,106 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+# Every measurement runs in a fresh interpreter, so imports and data loading are as cold as at a kiosk restart.
+# time.monotonic is system-wide, so the child reports the moment it got there and the parent subtracts the spawn time.
+
+def probe_first_note(with_markov):
+    """
+    Starts the generator on the null backend with the parameters of a first analysis update and reports when
+    the first note is sent.
+    """
+    import asyncio
+    from connect_async import PizzaComm, Session, send_notes
+    from midi_output import NullBackend
+    from midi_scheduler import MidiScheduler
+
+    async def run():
+        backend = NullBackend(MidiScheduler())
+        pizza_comm = PizzaComm(backend)
+        session = Session(0, backend.scheduler.voices.acquire_channel(), with_markov, None)
+        session.motif_gen.set_probabilities([1.0] + [0.0] * 11)
+        session.motif_gen.set_scale('maj')
+        session.motif_gen.set_trend(0)
+        session.notes_task = asyncio.create_task(send_notes(pizza_comm, session))
+        while not backend.harp.messages and not backend.drone.messages:
+            await asyncio.sleep(0.001)
+        first = min(messages[0][0] for messages in (backend.harp.messages, backend.drone.messages) if messages)
+        session.closed.set()
+        await session.notes_task
+        pizza_comm.close()
+        return first
+
+    return {"first_note": asyncio.run(run())}
+
+def probe_window():
+    """
+    Opens the drawing app and reports when its window is shown and when the analysis is running.
+    """
+    from tkinter import Tk
+    from drawing import DrawingApp
+    root = Tk()
+    app = DrawingApp(root)
+    root.update()
+    window = time.monotonic()
+    app.start_analysis()
+    root.update()
+    ready = time.monotonic()
+    app.analysis_worker.stop(timeout=1)
+    app.analysis_process.close()
+    app.raster.close()
+    root.destroy()
+    return {"window": window, "analysis_ready": ready}
+
+PROBES = {
+    "first-note": lambda: probe_first_note(with_markov=False),
+    "first-note-markov": lambda: probe_first_note(with_markov=True),
+    "window": probe_window,
+}
+
+def measure(probe, repeats):
+    """
+    Runs a probe in fresh interpreters.
+
+    Parameters:
+        probe (str): The name of the probe.
+        repeats (int): The number of runs.
+
+    Returns:
+        dict: Per measured event, the times in milliseconds from spawning the interpreter. Empty if the probe failed.
+    """
+    results = {}
+    for _ in range(repeats):
+        start = time.monotonic()
+        completed = subprocess.run([sys.executable, __file__, "--probe", probe], capture_output=True, text=True)
+        lines = [line for line in completed.stdout.splitlines() if line.startswith("PROBE ")]
+        if completed.returncode != 0 or not lines:
+            print(f"STARTUP: {probe} failed: {completed.stderr.strip().splitlines()[-1:] or completed.returncode}")
+            return {}
+        for line in lines:
+            _, name, value = line.split()
+            results.setdefault(name, []).append((float(value) - start) * 1000)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start of the generator and the drawing app.")
+    parser.add_argument("-n", "--repeats", type=int, default=5, help="runs per probe")
+    parser.add_argument("probes", nargs="*", default=list(PROBES), help=f"probes to run: {', '.join(PROBES)}")
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        # Child process, the generator and the app print a lot, so the results are marked
+        for name, value in PROBES[args.probe]().items():
+            print(f"PROBE {name} {value!r}")
+        return
+
+    for probe in args.probes:
+        for name, times in measure(probe, args.repeats).items():
+            print(f"STARTUP: {probe} time-to-{name.replace('_', '-')}: median={statistics.median(times):.0f}ms "
+                  f"min={min(times):.0f}ms max={max(times):.0f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+from utils import UP, DOWN, VARYING, CONSTANT
+
+def classify_trend(up_count, down_count, constant_count, total):
+    """
+    Classifies the drawing trend from the number of upward, downward and constant movements in a window.
+
+    Parameters:
+        up_count (int): The number of upward movements.
+        down_count (int): The number of downward movements.
+        constant_count (int): The number of horizontal movements.
+        total (int): The number of movements in the window.
+
+    Returns:
+        int: UP, DOWN, CONSTANT or VARYING.
+    """
+    if abs(up_count - down_count) < 10 and constant_count < 10:
+        return VARYING
+    elif up_count > total / 2:
+        return UP
+    elif down_count > total / 2:
+        return DOWN
+    elif constant_count > total / 2:
+        return CONSTANT
+    else:
+        return VARYING
+
+def calculate_duration(speed_measure):
+    """
+    Determines the duration of a note based on the speed of drawing.
+
+    Parameters:
+        speed_measure: The speed of the drawing action, calculated as distance over time.
+
+    Returns:
+        A float representing the duration of the note, with faster speeds resulting in shorter durations.
+    """
+    if speed_measure > 7000:
+        return 0.05
+    elif speed_measure > 5000:
+        return 0.07
+    elif speed_measure > 3000:
+        return 0.1
+    elif speed_measure > 1000:
+        return 0.15
+    elif speed_measure > 500:
+        return 0.25
+    elif speed_measure > 100:
+        return 0.3
+    else:
+        return 0.35
+
+class StrokeFeatureEstimator:
+    """
+    Streaming estimate of the drawing trend and speed over the last `window` motion events.
+    Directions and speeds are kept in fixed-size ring buffers with running counts and a running sum,
+    so every event is processed in constant time and the trend follows the stroke continuously
+    instead of being recomputed once per window.
+
+    Attributes:
+        window (int): The number of motion events the estimate covers.
+        trend (int): The current trend, only updated once the direction window is full.
+        speed_measure (float): The mean speed over the speed window.
+    """
+    def __init__(self, window=100, initial_trend=CONSTANT):
+        """
+        Initializes empty ring buffers.
+
+        Parameters:
+            window (int): The number of motion events the estimate covers.
+            initial_trend (int): The trend reported until the direction window has filled up.
+        """
+        self.window = window
+        self.trend = initial_trend
+        self.speed_measure = 0
+
+        self.directions = [None] * window
+        self.direction_head = 0
+        self.direction_len = 0
+        self.direction_counts = {UP: 0, DOWN: 0, CONSTANT: 0}
+
+        self.speeds = [0.0] * window
+        self.speed_head = 0
+        self.speed_len = 0
+        self.speed_sum = 0.0
+
+    def add_direction(self, direction):
+        """
+        Adds a movement direction, evicting the oldest one once the window is full, and updates the trend.
+
+        Parameters:
+            direction (int): UP, DOWN or CONSTANT.
+
+        Returns:
+            bool: True if the trend changed.
+        """
+        if self.direction_len == self.window:
+            self.direction_counts[self.directions[self.direction_head]] -= 1
+        else:
+            self.direction_len += 1
+        self.directions[self.direction_head] = direction
+        self.direction_counts[direction] += 1
+        self.direction_head = (self.direction_head + 1) % self.window
+
+        if self.direction_len < self.window:
+            return False
+        trend = classify_trend(self.direction_counts[UP], self.direction_counts[DOWN],
+                               self.direction_counts[CONSTANT], self.direction_len)
+        changed = trend != self.trend
+        self.trend = trend
+        return changed
+
+    def add_speed(self, speed):
+        """
+        Adds a speed sample, evicting the oldest one once the window is full, and updates the mean speed.
+
+        Parameters:
+            speed (float): The drawing speed in pixels per second.
+        """
+        if self.speed_len == self.window:
+            self.speed_sum -= self.speeds[self.speed_head]
+        else:
+            self.speed_len += 1
+        self.speeds[self.speed_head] = speed
+        self.speed_sum += speed
+        self.speed_head = (self.speed_head + 1) % self.window
+        if self.speed_head == 0:
+            # Resynchronize once per window so floating point errors of the running sum cannot accumulate
+            self.speed_sum = sum(self.speeds[:self.speed_len])
+        self.speed_measure = self.speed_sum / self.speed_len
@@ -0,0 +1,125 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from analysis_process import AnalysisProcess
+from canvas_raster import CanvasRaster
+from color_stats import get_color_statistics
+
+@pytest.fixture
+def raster():
+    raster = CanvasRaster(200, 150, tile_size=64, shared=True)
+    yield raster
+    raster.close()
+
+@pytest.fixture
+def process():
+    process = AnalysisProcess(64)
+    yield process
+    process.close()
+
+def assert_matches(result, raster):
+    expected = get_color_statistics(raster.snapshot())
+    assert result[0] == pytest.approx(expected[0])
+    assert result[1] == expected[1]
+
+def test_process_reads_the_shared_raster(raster, process):
+    raster.draw_oval(50, 50, 20, '#ff0000')
+    raster.draw_square(150, 100, 10, '#0000ff')
+    assert_matches(process.update(*raster.collect_dirty_tile_indices()), raster)
+    raster.draw_line(0, 140, 199, 140, '#00ff00', 5)
+    assert_matches(process.update(*raster.collect_dirty_tile_indices()), raster)
+
+def test_resize_keeps_the_block_of_a_request_in_flight(raster, process):
+    raster.draw_oval(50, 50, 20, '#ff0000')
+    frame = raster.collect_dirty_tile_indices()
+    raster.resize(300, 100)
+    raster.resize(120, 120)
+    # The block of the 300x100 raster was never named by a request, so it is released right away
+    assert [shm.name for shm in raster.retired] == [frame[0][0]]
+    # The request still names the first block
+    process.update(*frame)
+    raster.release_retired(frame[0])
+    assert len(raster.retired) == 1
+    frame = raster.collect_dirty_tile_indices()
+    assert_matches(process.update(*frame), raster)
+    raster.release_retired(frame[0])
+    assert raster.retired == []
+
+def test_resizes_while_analyzing(raster, process):
+    # Resizes race with the analysis the way the Tk thread races with the analysis worker
+    errors = []
+    stop = threading.Event()
+    def analyze():
+        while not stop.is_set():
+            frame = raster.collect_dirty_tile_indices()
+            try:
+                process.update(*frame)
+            except Exception as e:
+                errors.append(e)
+            raster.release_retired(frame[0])
+    worker = threading.Thread(target=analyze)
+    worker.start()
+    for size in range(50):
+        raster.resize(100 + size % 7 * 20, 100 + size % 5 * 20)
+        raster.draw_oval(size * 2, size, 10, '#ffff00')
+    stop.set()
+    worker.join(10)
+    assert errors == []
+    frame = raster.collect_dirty_tile_indices()
+    assert_matches(process.update(*frame), raster)
+
+def test_dead_process_is_restarted_with_all_tiles(raster, process):
+    raster.draw_oval(50, 50, 20, '#ff0000')
+    process.update(*raster.collect_dirty_tile_indices())
+    process.process.kill()
+    process.process.join()
+    raster.draw_square(150, 100, 10, '#0000ff')
+    frame = raster.collect_dirty_tile_indices()
+    with pytest.raises((EOFError, OSError)):
+        process.update(*frame)
+    process.restart()
+    # The new process has no statistics, a partial update would miss the red circle
+    raster.restore_dirty_tiles(frame[0])
+    assert_matches(process.update(*raster.collect_dirty_tile_indices()), raster)
+
+def test_hung_process_times_out_and_does_not_block_close(raster):
+    process = AnalysisProcess(64, timeout=0.5)
+    process.update(*raster.collect_dirty_tile_indices())
+    os.kill(process.process.pid, signal.SIGSTOP)
+    with pytest.raises(TimeoutError):
+        process.update(*raster.collect_dirty_tile_indices())
+    errors = []
+    def update():
+        try:
+            process.update(*raster.collect_dirty_tile_indices())
+        except Exception as e:
+            errors.append(e)
+    process.timeout = 60
+    waiting = threading.Thread(target=update)
+    waiting.start()
+    time.sleep(0.1)
+    start = time.monotonic()
+    process.close(timeout=0.5)
+    waiting.join(5)
+    assert time.monotonic() - start < 5
+    assert not process.process.is_alive()
+    assert not waiting.is_alive() and len(errors) == 1
+    # Closed processes are not restarted
+    process.restart()
+    assert not process.process.is_alive()
+
+def test_failed_tiles_are_collected_again(raster):
+    raster.collect_dirty_tile_indices()
+    raster.draw_oval(10, 10, 2, '#ffffff')
+    frame = raster.collect_dirty_tile_indices()
+    raster.draw_oval(100, 100, 2, '#ffffff')
+    raster.restore_dirty_tiles(*frame)
+    assert raster.collect_dirty_tile_indices()[1] == {(0, 0), (1, 1)}
+    # After a resize every tile is dirty anyway, tiles of the old size are not restored
+    raster.resize(50, 50)
+    raster.restore_dirty_tiles(*frame)
+    assert raster.collect_dirty_tile_indices()[1] == {(0, 0)}
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from analysis_worker import LatestWinsWorker
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+def blocked_worker(merge=None):
+    # The worker processes the first frame and then waits until released, so later frames pile up in the mailbox
+    started, release = threading.Event(), threading.Event()
+    frames = []
+    def process(frame):
+        frames.append(frame)
+        started.set()
+        release.wait(5)
+    return LatestWinsWorker(process, merge=merge), started, release, frames
+
+def test_latest_frame_wins():
+    worker, started, release, frames = blocked_worker()
+    worker.submit(1)
+    assert started.wait(5)
+    for frame in (2, 3, 4):
+        worker.submit(frame)
+    release.set()
+    wait_for(lambda: worker.stats()["processed"] == 2)
+    worker.stop(timeout=5)
+    assert frames == [1, 4]
+    stats = worker.stats()
+    assert stats["dropped"] == 2
+    assert stats["coalesced"] == 0
+
+def test_merged_frames_count_as_dropped():
+    worker, started, release, frames = blocked_worker(merge=lambda older, newer: older | newer)
+    worker.submit({1})
+    assert started.wait(5)
+    for frame in ({2}, {3}, {4}):
+        worker.submit(frame)
+    release.set()
+    wait_for(lambda: worker.stats()["processed"] == 2)
+    worker.stop(timeout=5)
+    assert frames == [{1}, {2, 3, 4}]
+    stats = worker.stats()
+    assert stats["coalesced"] == 2
+    assert stats["dropped"] == 2
+    assert stats["processed"] + stats["dropped"] == stats["submitted"]
+
+def test_exceptions_do_not_stop_the_worker():
+    def process(frame):
+        if frame == 1:
+            raise RuntimeError("bad frame")
+    worker = LatestWinsWorker(process)
+    worker.submit(1)
+    wait_for(lambda: worker.stats()["processed"] == 1)
+    worker.submit(2)
+    wait_for(lambda: worker.stats()["processed"] == 2)
+    worker.stop(timeout=5)
+    assert "processed=2/2" in worker.format_stats()
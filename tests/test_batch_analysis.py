@@ -0,0 +1,82 @@
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+import batch_analysis
+from batch_analysis import analyze_image, load_completed, run
+
+def write_image(path, image):
+    assert cv2.imwrite(str(path), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    return str(path)
+
+def strict_loads(line):
+    def reject(constant):
+        raise ValueError(f"{constant} is not valid JSON")
+    return json.loads(line, parse_constant=reject)
+
+def test_colored_image(tmp_path):
+    image = np.zeros((40, 40, 3), dtype=np.uint8)
+    image[:, :20] = (255, 0, 0)
+    result = analyze_image(write_image(tmp_path / "red.png", image))
+    assert result["key"] == 'a'
+    assert sum(result["pitch_probabilities"]) == pytest.approx(1)
+    assert result["width"] == 40
+
+def test_black_image_has_no_key(tmp_path):
+    result = analyze_image(write_image(tmp_path / "black.png", np.zeros((30, 30, 3), dtype=np.uint8)))
+    assert result["pitch_probabilities"] is None
+    assert result["key"] is None
+    assert result["scale"] == 'min'
+    assert strict_loads(json.dumps(result)) == result
+
+def test_unreadable_image(tmp_path):
+    path = tmp_path / "broken.png"
+    path.write_bytes(b"not an image")
+    assert analyze_image(str(path)) == {"path": str(path), "error": "unreadable image"}
+
+def test_failed_images_are_not_completed(tmp_path):
+    output = tmp_path / "results.jsonl"
+    output.write_text('{"path": "a.png", "key": "c"}\n{"path": "b.png", "error": "unreadable image"}\n{"path": "c.p')
+    assert load_completed(str(output)) == {"a.png"}
+
+def test_resumed_run_retries_failed_images(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    path = images / "late.png"
+    path.write_bytes(b"still being copied")
+    write_image(images / "black.png", np.zeros((10, 10, 3), dtype=np.uint8))
+    output = str(tmp_path / "results.jsonl")
+    assert run([str(images)], output, workers=1) == (2, 0)
+    write_image(path, np.full((10, 10, 3), 255, dtype=np.uint8))
+    assert run([str(images)], output, workers=1) == (1, 1)
+    with open(output) as file:
+        records = [strict_loads(line) for line in file]
+    assert [record.get("key") for record in records if record["path"] == str(path)] == [None, 'c']
+
+def test_missing_parquet_engine_fails_before_analyzing(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_analysis.importlib.util, "find_spec", lambda name: None)
+    with pytest.raises(ImportError):
+        run([str(tmp_path)], str(tmp_path / "results.parquet"))
+    assert not (tmp_path / "results.parquet.partial.jsonl").exists()
+
+def test_parquet_output_is_resumed(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pandas as pd
+    images = tmp_path / "images"
+    images.mkdir()
+    path = images / "late.png"
+    path.write_bytes(b"still being copied")
+    write_image(images / "white.png", np.full((10, 10, 3), 255, dtype=np.uint8))
+    write_image(images / "black.png", np.zeros((10, 10, 3), dtype=np.uint8))
+    output = str(tmp_path / "results.parquet")
+    assert run([str(images)], output, workers=1) == (3, 0)
+    write_image(path, np.full((10, 10, 3), 255, dtype=np.uint8))
+    assert run([str(images)], output, workers=1) == (1, 2)
+    assert not (tmp_path / "results.parquet.partial.jsonl").exists()
+    df = pd.read_parquet(output).set_index("path")
+    assert len(df) == 3
+    assert df.loc[str(path), "key"] == 'c'
+    assert df.loc[str(images / "white.png"), "p_c"] == pytest.approx(1)
+    assert pd.isna(df.loc[str(images / "black.png"), "p_c"])
@@ -0,0 +1,54 @@
+import numpy as np
+
+from canvas_raster import CanvasRaster, hex_to_rgb, merge_tile_frames
+
+def test_hex_to_rgb():
+    assert hex_to_rgb('#ff8000') == (255, 128, 0)
+
+def test_new_raster_is_black():
+    raster = CanvasRaster(64, 48)
+    assert raster.image.shape == (48, 64, 3)
+    assert not raster.image.any()
+
+def test_shapes_are_drawn_in_their_color():
+    raster = CanvasRaster(100, 100)
+    raster.draw_line(10, 10, 90, 10, '#ff0000', 3)
+    raster.draw_oval(50, 50, 5, '#00ff00')
+    raster.draw_square(20, 80, 4, '#0000ff')
+    assert tuple(raster.image[10, 50]) == (255, 0, 0)
+    assert tuple(raster.image[50, 50]) == (0, 255, 0)
+    assert tuple(raster.image[80, 20]) == (0, 0, 255)
+    assert not raster.image[30, 80].any()
+
+def test_snapshot_is_a_copy():
+    raster = CanvasRaster(20, 20)
+    snapshot = raster.snapshot()
+    raster.draw_oval(10, 10, 3, '#ffffff')
+    assert not snapshot.any()
+    assert raster.image.any()
+
+def test_resize_keeps_the_overlap():
+    raster = CanvasRaster(40, 40)
+    raster.draw_square(10, 10, 3, '#ffffff')
+    raster.resize(20, 60)
+    assert raster.image.shape == (60, 20, 3)
+    assert tuple(raster.image[10, 10]) == (255, 255, 255)
+    assert not raster.image[40:].any()
+
+def test_strokes_mark_only_the_tiles_they_touch():
+    raster = CanvasRaster(256, 256, tile_size=64)
+    raster.collect_dirty_tiles()
+    raster.draw_oval(100, 20, 4, '#ffffff')
+    shape, tiles = raster.collect_dirty_tiles()
+    assert shape == (256, 256)
+    assert set(tiles) == {(0, 1)}
+    assert raster.collect_dirty_tiles()[1] == {}
+
+def test_merged_tile_frames_keep_older_tiles():
+    raster = CanvasRaster(128, 128, tile_size=64)
+    raster.collect_dirty_tiles()
+    raster.draw_oval(10, 10, 2, '#ffffff')
+    older = raster.collect_dirty_tiles()
+    raster.draw_oval(100, 100, 2, '#ffffff')
+    newer = raster.collect_dirty_tiles()
+    assert set(merge_tile_frames(older, newer)[1]) == {(0, 0), (1, 1)}
@@ -0,0 +1,49 @@
+from capture_scheduler import AdaptiveCaptureScheduler
+
+def test_unchanged_captures_are_skipped_and_back_off():
+    scheduler = AdaptiveCaptureScheduler(min_delay=100, max_delay=400)
+    assert scheduler.should_capture(1)
+    scheduler.confirm(1)
+    delays = []
+    for _ in range(4):
+        assert not scheduler.should_capture(1)
+        delays.append(scheduler.delay)
+    assert delays == [200, 400, 400, 400]
+    assert scheduler.skipped == 4
+
+def test_activity_resets_the_delay():
+    scheduler = AdaptiveCaptureScheduler(min_delay=100, max_delay=400)
+    scheduler.delay = 400
+    assert scheduler.notify_activity()
+    assert scheduler.delay == 100
+    assert not scheduler.notify_activity()
+
+def test_capture_in_flight_is_not_repeated():
+    scheduler = AdaptiveCaptureScheduler()
+    assert scheduler.should_capture(1)
+    assert not scheduler.should_capture(1)
+    assert scheduler.should_capture(2)
+    scheduler.confirm(1)
+    assert scheduler.pending_signature == 2
+
+def test_failed_capture_is_retried():
+    scheduler = AdaptiveCaptureScheduler(min_delay=100, max_delay=400)
+    assert scheduler.should_capture(1)
+    scheduler.fail(1)
+    assert scheduler.delay == 200
+    assert scheduler.should_capture(1)
+    scheduler.confirm(1)
+    assert not scheduler.should_capture(1)
+
+def test_immediate_captures_are_rate_limited(monkeypatch):
+    now = [10.0]
+    monkeypatch.setattr("capture_scheduler.time.monotonic", lambda: now[0])
+    scheduler = AdaptiveCaptureScheduler(min_delay=200)
+    assert scheduler.request_immediate()
+    now[0] += 0.05
+    assert not scheduler.request_immediate()
+    now[0] += 0.1
+    assert not scheduler.request_immediate()
+    # Refused requests do not extend the wait
+    now[0] += 0.06
+    assert scheduler.request_immediate()
@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+import pytest
+
+from canvas_raster import CanvasRaster
+from color_stats import (COLOR_BINS, SampledColorStatistics, TiledColorStatistics, color_histogram,
+                         estimate_sampling_error, get_color_statistics, histogram_to_color_counts,
+                         measure_sampling_error)
+from utils import PITCH_CLASSES, color_notes, color_ranges
+
+def mask_color_counts(hsv_image):
+    # The per-color mask computation the lookup table replaced
+    hue, saturation, value = cv2.split(hsv_image)
+    black_mask = value < 25
+    white_mask = (value > 204) & (saturation < 25) & ~black_mask
+    counts = {'white': int(np.sum(white_mask))}
+    for color, ranges in color_ranges.items():
+        if isinstance(ranges, tuple):
+            ranges = [ranges]
+        mask = np.zeros_like(hue, dtype=bool)
+        for lower_bound, upper_bound in ranges:
+            mask |= (hue >= lower_bound) & (hue <= upper_bound)
+        counts[color] = int(np.sum(mask & ~black_mask & ~white_mask))
+    return counts
+
+@pytest.fixture
+def image():
+    rng = np.random.default_rng(1)
+    return rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+
+def test_histogram_matches_color_masks(image):
+    hsv_image = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+    counts, value_sum = color_histogram(hsv_image)
+    assert {color: int(count) for color, count in histogram_to_color_counts(counts).items()} == mask_color_counts(hsv_image)
+    assert counts.sum() == image.shape[0] * image.shape[1]
+    assert value_sum == hsv_image[..., 2].sum()
+
+def test_every_hue_has_one_bin():
+    hsv_image = np.zeros((1, 181, 3), dtype=np.uint8)
+    hsv_image[0, :, 0] = np.arange(181)
+    hsv_image[0, :, 1:] = 255
+    counts, _ = color_histogram(hsv_image)
+    assert counts[:len(color_ranges)].sum() == 181
+
+def test_pitch_probabilities(image):
+    probabilities, scale = get_color_statistics(image)
+    counts = mask_color_counts(cv2.cvtColor(image, cv2.COLOR_RGB2HSV))
+    total = sum(counts.values())
+    assert probabilities == pytest.approx([counts[color_notes[pitch]] / total for pitch in PITCH_CLASSES])
+    assert sum(probabilities) == pytest.approx(1)
+    assert scale in ('maj', 'min')
+
+def test_scale_follows_brightness():
+    dark = np.zeros((10, 10, 3), dtype=np.uint8)
+    dark[0, :] = (255, 0, 0)
+    bright = np.full((10, 10, 3), 255, dtype=np.uint8)
+    assert get_color_statistics(dark)[1] == 'min'
+    assert get_color_statistics(bright)[1] == 'maj'
+    assert get_color_statistics(bright)[0][PITCH_CLASSES.index('c')] == 1
+    assert COLOR_BINS[-1] == 'white'
+
+def test_tiled_statistics_match_the_full_image():
+    raster = CanvasRaster(300, 200, tile_size=64)
+    statistics = TiledColorStatistics(64)
+    rng = np.random.default_rng(2)
+    for _ in range(5):
+        for _ in range(20):
+            x, y = rng.integers(0, 300), rng.integers(0, 200)
+            color = '#%02x%02x%02x' % tuple(rng.integers(0, 256, 3))
+            raster.draw_oval(x, y, rng.integers(1, 15), color)
+        tiled = statistics.update(*raster.collect_dirty_tiles())
+        full = get_color_statistics(raster.snapshot())
+        assert tiled[0] == pytest.approx(full[0])
+        assert tiled[1] == full[1]
+
+def test_tiled_statistics_follow_a_resize():
+    raster = CanvasRaster(128, 128, tile_size=64)
+    statistics = TiledColorStatistics(64)
+    raster.draw_square(30, 30, 10, '#ff0000')
+    statistics.update(*raster.collect_dirty_tiles())
+    raster.resize(64, 64)
+    raster.draw_square(50, 50, 5, '#0000ff')
+    assert statistics.update(*raster.collect_dirty_tiles())[0] == pytest.approx(get_color_statistics(raster.snapshot())[0])
+
+def test_full_stride_has_no_error(image):
+    assert estimate_sampling_error([0.5, 0.5], 100, 1) == 0
+    assert measure_sampling_error(image, 1) == 0
+
+def test_strided_error_stays_within_the_estimate():
+    # Large blobs of color, so the sampled pixels are representative
+    rng = np.random.default_rng(5)
+    raster = CanvasRaster(800, 600)
+    for _ in range(200):
+        color = '#%02x%02x%02x' % tuple(rng.integers(0, 256, 3))
+        raster.draw_oval(rng.integers(0, 800), rng.integers(0, 600), rng.integers(10, 60), color)
+    image = raster.snapshot()
+    probabilities, _ = get_color_statistics(image, stride=4)
+    colored = int(np.count_nonzero(cv2.cvtColor(image[::4, ::4].copy(), cv2.COLOR_RGB2HSV)[..., 2] >= 25))
+    assert measure_sampling_error(image, 4) <= estimate_sampling_error(probabilities, colored, 4)
+
+def test_sampler_chooses_a_stride_within_the_error_bound():
+    sampler = SampledColorStatistics(target_latency=1e-6, max_error=0.05)
+    image = np.full((1000, 1000, 3), 200, dtype=np.uint8)
+    probabilities, scale, error = sampler.analyze(image)
+    assert sampler.stride > 1
+    assert error <= 0.05
+    assert sum(probabilities) == pytest.approx(1)
+    # A generous latency target analyzes every pixel
+    assert SampledColorStatistics(target_latency=10).choose_stride((100, 100)) == 1
@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from conftest import ROOT
+from connect_async import PizzaComm, Session, TCPComm, send_notes
+from midi_output import NullBackend
+from motifs_gen import MotifGen
+from protocol import encode_frame, encode_message
+
+UPDATE = {
+    "close": False,
+    "pitch_probabilities": [1.0] + [0.0] * 11,
+    "scale": 'maj',
+    "trend": 0,
+    "duration": 0.1,
+    "active_color_flag": False,
+    "key": None,
+}
+
+@pytest.fixture(autouse=True)
+def repository_root(monkeypatch):
+    # The generator reads the motif corpus relative to the repository
+    monkeypatch.chdir(ROOT)
+
+async def start_server(backend):
+    tcp_comm = TCPComm('tcp', ('127.0.0.1', 0), PizzaComm(backend), with_markov=False)
+    await tcp_comm.start()
+    return tcp_comm, tcp_comm.server.sockets[0].getsockname()[:2]
+
+async def wait_for(predicate, timeout=10):
+    async def poll():
+        while not predicate():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+
+def channels(port):
+    return {message.channel for _, message in port.messages if hasattr(message, 'channel')}
+
+def test_sessions_play_on_their_own_channels():
+    async def run():
+        backend = NullBackend()
+        tcp_comm, address = await start_server(backend)
+        serving = asyncio.create_task(tcp_comm.serve_until_shutdown())
+        writers = []
+        for _ in range(2):
+            _, writer = await asyncio.open_connection(*address)
+            writer.write(encode_frame(encode_message(UPDATE)))
+            writers.append(writer)
+        await wait_for(lambda: len(channels(backend.harp)) == 2)
+        for writer in writers:
+            writer.write(encode_frame(encode_message({"close": True})))
+            await writer.drain()
+        # The generator shuts down once the last station closed
+        await asyncio.wait_for(serving, 10)
+        for writer in writers:
+            writer.close()
+        return backend
+    backend = asyncio.run(run())
+    assert channels(backend.harp) == {0, 1}
+    assert backend.scheduler.voices.voice_count() == 0
+
+def test_invalid_message_only_closes_its_session():
+    async def run():
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        backend = NullBackend()
+        tcp_comm, address = await start_server(backend)
+        reader, writer = await asyncio.open_connection(*address)
+        writer.write(encode_frame(b'\x01'))
+        # The server closes the connection of the invalid message
+        assert await asyncio.wait_for(reader.read(), 10) == b''
+        writer.close()
+        await wait_for(lambda: not tcp_comm.sessions)
+        _, writer = await asyncio.open_connection(*address)
+        writer.write(encode_frame(encode_message(UPDATE)))
+        await wait_for(lambda: backend.harp.messages)
+        tcp_comm.shutdown()
+        await asyncio.wait_for(tcp_comm.serve_until_shutdown(), 10)
+        writer.close()
+        return errors
+    # The session ends cleanly instead of with an unhandled exception
+    assert asyncio.run(run()) == []
+
+def test_played_markov_motifs_are_learned():
+    learned = []
+    class LearningMotifGen(MotifGen):
+        def learn(self, notes, trend, scale, key):
+            learned.append((list(notes), trend, scale))
+            super().learn(notes, trend, scale, key)
+    motif_gen = LearningMotifGen(with_markov=True, learn_played=True)
+    motif_gen.set_probabilities(UPDATE["pitch_probabilities"])
+    motif_gen.set_scale('maj')
+    motif_gen.set_trend(0)
+    async def run():
+        backend = NullBackend()
+        pizza_comm = PizzaComm(backend)
+        session = Session(0, 0, True, None, motif_gen)
+        session.notes_task = asyncio.create_task(send_notes(pizza_comm, session))
+        await wait_for(lambda: len(learned) >= 2)
+        session.closed.set()
+        await asyncio.wait_for(session.notes_task, 10)
+        return backend
+    backend = asyncio.run(run())
+    played = [message.note for _, message in backend.harp.messages if message.type == 'note_on']
+    assert [note for notes, _, _ in learned for note in notes] == played[:sum(len(notes) for notes, _, _ in learned)]
+    assert {(trend, scale) for _, trend, scale in learned} == {(0, 'maj')}
+
+def test_failed_generation_does_not_end_the_output():
+    class FlakyMotifGen(MotifGen):
+        failures = 2
+        def choose_motif(self):
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError("bad generation")
+            return super().choose_motif()
+    motif_gen = FlakyMotifGen()
+    motif_gen.set_probabilities(UPDATE["pitch_probabilities"])
+    motif_gen.set_scale('maj')
+    motif_gen.set_trend(0)
+    async def run():
+        backend = NullBackend()
+        session = Session(0, 0, False, None, motif_gen)
+        session.notes_task = asyncio.create_task(send_notes(PizzaComm(backend), session))
+        await wait_for(lambda: backend.harp.messages or session.notes_task.done())
+        assert not session.notes_task.done()
+        session.closed.set()
+        await asyncio.wait_for(session.notes_task, 10)
+    asyncio.run(run())
+    assert motif_gen.failures == 0
@@ -0,0 +1,54 @@
+import json
+import os
+
+import numpy as np
+
+from conftest import ROOT
+from utils import InitialNoteIndex, sample_initial_note
+
+def write_notes(path, entries):
+    with open(path, 'w') as file:
+        json.dump([{"direction": direction, "scale": scale, "initial_note": notes} for direction, scale, notes in entries], file)
+
+def test_sampling_is_weighted_by_count(tmp_path):
+    path = tmp_path / "initial_notes.json"
+    write_notes(path, [(0, 'maj', [60, 60, 60, 67]), (1, 'maj', [55])])
+    index = InitialNoteIndex(str(path))
+    np.random.seed(0)
+    sampled = index.sample(0, 'maj', size=20000)
+    assert set(sampled.tolist()) == {60, 67}
+    assert abs(np.mean(sampled == 60) - 0.75) < 0.02
+    assert index.sample(1, 'maj') == 55
+    assert isinstance(index.sample(1, 'maj'), int)
+
+def test_missing_distribution(tmp_path):
+    path = tmp_path / "initial_notes.json"
+    write_notes(path, [(0, 'maj', [60]), (1, 'min', [])])
+    index = InitialNoteIndex(str(path))
+    assert index.sample(2, 'maj') is None
+    assert index.sample(1, 'min') is None
+
+def test_reloads_when_the_file_changes(tmp_path):
+    path = tmp_path / "initial_notes.json"
+    write_notes(path, [(0, 'maj', [60])])
+    index = InitialNoteIndex(str(path), check_interval=0)
+    assert index.sample(0, 'maj') == 60
+    write_notes(path, [(0, 'maj', [62])])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert index.sample(0, 'maj') == 62
+
+def test_reload_check_is_throttled(tmp_path):
+    path = tmp_path / "initial_notes.json"
+    write_notes(path, [(0, 'maj', [60])])
+    index = InitialNoteIndex(str(path), check_interval=3600)
+    assert index.sample(0, 'maj') == 60
+    os.remove(path)
+    # The file is not looked at again within the check interval
+    assert index.sample(0, 'maj') == 60
+
+def test_sample_initial_note_is_quiet(monkeypatch, capsys):
+    monkeypatch.chdir(ROOT)
+    for _ in range(10):
+        sample_initial_note(0, 'maj')
+    assert capsys.readouterr().out == ""
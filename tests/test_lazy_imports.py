@@ -0,0 +1,27 @@
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+def loaded_after(statement, modules):
+    # A fresh interpreter, so the modules other tests imported do not count
+    code = f"import sys\n{statement}\nprint(' '.join(m for m in {modules!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+def test_drawing_app_imports_without_heavy_modules():
+    pytest.importorskip("tkinter")
+    assert loaded_after("import drawing", ["numpy", "cv2", "PIL", "colorutils", "asyncio"]) == []
+
+def test_generator_loads_its_data_on_first_use():
+    statement = "import motifs_gen\nmotif_gen = motifs_gen.MotifGen(with_markov=True)\n" \
+                "assert motifs_gen._midi_motives is None and motif_gen._markov_manager is None"
+    assert loaded_after(statement, ["pandas"]) == []
+
+def test_markov_models_are_unpickled_on_first_use():
+    statement = "from markov.markov_chain import MarkovManager\nmanager = MarkovManager()\n" \
+                "assert manager.models_dict == {}\nmanager.get_model(trend=0, scale='maj')\n" \
+                "assert list(manager.models_dict) == ['maj-0']"
+    assert loaded_after(statement, []) == []
@@ -0,0 +1,204 @@
+import threading
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from conftest import ROOT
+from markov.markov_chain import SecondOrderMarkovModel, VariableOrderMarkovModel, state_key
+from motifs_gen import MotifGen
+
+SEQUENCES = [[60, 62, 64, 62, 60], [60, 62, 67, 65, 64], "[60, 64, 62, 60]", [60, 62, 64, 65]]
+
+@pytest.fixture
+def model():
+    return SecondOrderMarkovModel(SEQUENCES, seed=0)
+
+def test_probabilities_are_normalized_counts(model):
+    assert model.transition_probabilities[(-1, 60)] == {62: 0.75, 64: 0.25}
+    assert model.transition_probabilities[(60, 62)] == {64: 2 / 3, 67: 1 / 3}
+    for next_notes in model.transition_probabilities.values():
+        assert sum(next_notes.values()) == pytest.approx(1)
+
+def test_compiled_tables_match_the_probabilities(model):
+    model.compile()
+    probabilities = model.transition_probabilities
+    assert len(model.state_keys) == len(probabilities)
+    for row, key in enumerate(model.state_keys):
+        state = next(state for state in probabilities if state_key(*state) == key)
+        start, end = model.row_ptr[row], model.row_ptr[row + 1]
+        row_probabilities = np.diff(np.concatenate(([0.0], model.cum_probs[start:end])))
+        assert dict(zip(model.next_notes[start:end].tolist(), row_probabilities)) == pytest.approx(probabilities[state])
+        assert model.cum_probs[end - 1] == 1.0
+
+def test_generate_batch_is_reproducible_with_a_seed(model):
+    first = model.generate_batch([-1, 60], 6, 50, rng=np.random.default_rng(7))
+    second = model.generate_batch([-1, 60], 6, 50, rng=np.random.default_rng(7))
+    assert first.shape == (50, 6)
+    assert np.array_equal(first, second)
+
+def test_generate_batch_follows_the_transition_probabilities(model):
+    sequences = model.generate_batch([-1, 60], 4, 20000, rng=np.random.default_rng(1))
+    assert Counter(sequences[:, 2].tolist()).keys() == {62, 64}
+    assert np.mean(sequences[:, 2] == 62) == pytest.approx(0.75, abs=0.02)
+    after_60_62 = sequences[sequences[:, 2] == 62, 3]
+    assert np.mean(after_60_62 == 64) == pytest.approx(2 / 3, abs=0.02)
+
+def test_generate_sequence_follows_the_transition_probabilities(model):
+    rng = np.random.default_rng(2)
+    nexts = Counter(model.generate_sequence([60, 62], 3, rng=rng)[2] for _ in range(20000))
+    assert nexts.keys() == {64, 67}
+    assert nexts[64] / 20000 == pytest.approx(2 / 3, abs=0.02)
+
+def test_unseen_states_repeat_the_last_start_note(model):
+    assert model.generate_sequence([10, 11], 4).tolist() == [10, 11, 11, 11]
+    assert model.generate_batch([10, 11], 4, 2).tolist() == [[10, 11, 11, 11]] * 2
+    assert SecondOrderMarkovModel().generate_batch([-1, 60], 3, 1).tolist() == [[-1, 60, 60]]
+
+@pytest.fixture
+def variable_model():
+    return VariableOrderMarkovModel(SEQUENCES, max_order=3, seed=0)
+
+def test_variable_order_distributions_sum_to_one(variable_model):
+    for sequence in ([-1], [-1, 60], [60, 62], [60, 62, 64], [62, 64, 62, 60], [99], []):
+        distribution = variable_model.distribution(sequence)
+        assert distribution.sum() == pytest.approx(1)
+        assert (distribution >= 0).all()
+
+def test_variable_order_prefers_the_longest_context(variable_model):
+    probabilities = dict(zip(variable_model.notes, variable_model.distribution([-1, 60, 62])))
+    # After -1 60 62 the corpus continued with 64 twice and 67 once
+    assert probabilities[64] > probabilities[67] > probabilities[65]
+
+def test_variable_order_backs_off_on_unseen_contexts(variable_model):
+    # 99 is not in the trie, so the longest context is the empty one: the note frequencies
+    frequencies = variable_model.distribution([])
+    assert variable_model.distribution([99]) == pytest.approx(frequencies)
+    # An unseen longer context backs off to the known suffix
+    assert variable_model.distribution([99, 60, 62]) == pytest.approx(variable_model.distribution([60, 62]))
+    root = variable_model.root
+    assert frequencies == pytest.approx([root.counts[note] / root.total for note in variable_model.notes])
+
+def test_variable_order_samples_the_distribution(variable_model):
+    rng = np.random.default_rng(3)
+    nexts = Counter(variable_model.generate_sequence([-1, 60, 62], 4, rng=rng)[3] for _ in range(20000))
+    for note, probability in zip(variable_model.notes, variable_model.distribution([-1, 60, 62])):
+        assert nexts[note] / 20000 == pytest.approx(probability, abs=0.02)
+
+def test_variable_order_without_counts_repeats_the_last_note():
+    assert VariableOrderMarkovModel().generate_sequence([-1, 60], 4).tolist() == [-1, 60, 60, 60]
+
+def test_variable_order_save_and_load(variable_model, tmp_path):
+    path = str(tmp_path / "model.pkl")
+    variable_model.save_model(path)
+    loaded = VariableOrderMarkovModel()
+    loaded.load_model(path)
+    assert (loaded.max_order, loaded.discount, loaded.notes) == (3, 0.75, variable_model.notes)
+    for sequence in ([-1, 60], [60, 62, 64], [99]):
+        assert loaded.distribution(sequence) == pytest.approx(variable_model.distribution(sequence))
+    rng = np.random.default_rng(4)
+    expected = variable_model.generate_sequence([-1, 60], 8, rng=np.random.default_rng(4))
+    assert np.array_equal(loaded.generate_sequence([-1, 60], 8, rng=rng), expected)
+
+def test_generate_batch_recompiles_after_learning(model):
+    model.generate_batch([-1, 60], 3, 1)
+    model.update([[50, 51, 52]])
+    assert model.generate_batch([50, 51], 3, 5).tolist() == [[50, 51, 52]] * 5
+
+def assert_same_second_order(model, expected):
+    assert dict(model.transition_counts) == dict(expected.transition_counts)
+    probabilities = model.transition_probabilities
+    assert probabilities.keys() == expected.transition_probabilities.keys()
+    for state, next_notes in expected.transition_probabilities.items():
+        assert probabilities[state] == pytest.approx(next_notes)
+
+def test_update_equals_training_on_all_sequences():
+    model = SecondOrderMarkovModel(SEQUENCES[:2])
+    model.transition_probabilities
+    model.update(SEQUENCES[2:])
+    assert_same_second_order(model, SecondOrderMarkovModel(SEQUENCES))
+
+def test_merge_equals_training_on_both_corpora():
+    model = SecondOrderMarkovModel(SEQUENCES[:1])
+    other = SecondOrderMarkovModel(SEQUENCES[1:])
+    assert model.merge(other) is model
+    assert_same_second_order(model, SecondOrderMarkovModel(SEQUENCES))
+    assert_same_second_order(other, SecondOrderMarkovModel(SEQUENCES[1:]))
+
+def test_update_renormalizes_only_the_changed_states(model):
+    model.transition_probabilities
+    row = model._row((-1, 60))
+    model.update([[70, 71]])
+    assert model.stale_states == {(-1, 70)}
+    assert model._row((-1, 60)) is row
+    assert model.transition_probabilities[(-1, 70)] == {71: 1.0}
+    assert model.stale_states == set()
+
+def test_variable_order_update_equals_training_on_all_sequences():
+    model = VariableOrderMarkovModel(SEQUENCES[:2], max_order=2)
+    model.generate_sequence([-1, 60], 6)
+    model.update(SEQUENCES[2:])
+    expected = VariableOrderMarkovModel(SEQUENCES, max_order=2)
+    for sequence in ([-1], [-1, 60], [60, 62], [64, 62], [99]):
+        assert dict(zip(model.notes, model.distribution(sequence))) == \
+            pytest.approx(dict(zip(expected.notes, expected.distribution(sequence))))
+
+def test_variable_order_merge_equals_training_on_both_corpora():
+    model = VariableOrderMarkovModel(SEQUENCES[:1], max_order=2)
+    model.merge(VariableOrderMarkovModel(SEQUENCES[1:], max_order=3))
+    expected = VariableOrderMarkovModel(SEQUENCES, max_order=2)
+    for sequence in ([-1, 60], [60, 62, 64], [67, 65]):
+        assert dict(zip(model.notes, model.distribution(sequence))) == \
+            pytest.approx(dict(zip(expected.notes, expected.distribution(sequence))))
+
+def test_variable_order_update_keeps_unaffected_contexts(variable_model):
+    rng = np.random.default_rng(5)
+    for start in ([-1, 60, 62], [64, 62], [62, 64], [67, 65]):
+        variable_model.generate_sequence(start, len(start) + 1, rng=rng)
+    assert {(-1, 60, 62), (64, 62), (62, 64), (67, 65)} <= variable_model.cache.keys()
+    kept = variable_model.cache[(62, 64)], variable_model.cache[(67, 65)]
+    variable_model.update([[60, 62, 71]])
+    # 62 follows the contexts 60 and -1 60, and 71 the contexts 62, 60 62 and -1 60 62
+    assert (-1, 60, 62) not in variable_model.cache and (64, 62) not in variable_model.cache
+    assert variable_model.cache[(62, 64)] is kept[0] and variable_model.cache[(67, 65)] is kept[1]
+    assert variable_model.root_table is None
+    nexts = Counter(variable_model.generate_sequence([67, 65], 3, rng=rng)[2] for _ in range(20000))
+    for note, probability in zip(variable_model.notes, variable_model.distribution([67, 65])):
+        assert nexts[note] / 20000 == pytest.approx(probability, abs=0.02)
+
+@pytest.mark.parametrize("model_class", [SecondOrderMarkovModel, VariableOrderMarkovModel])
+def test_learning_while_generating(model_class):
+    model = model_class(SEQUENCES, seed=0)
+    errors = []
+    def generate():
+        try:
+            for _ in range(300):
+                assert len(model.generate_sequence([-1, 60], 8)) == 8
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=generate) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for i in range(300):
+        model.update([[60 + i % 12, 62, 64 + i % 5]])
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    expected = model_class(SEQUENCES + [[60 + i % 12, 62, 64 + i % 5] for i in range(300)])
+    if model_class is SecondOrderMarkovModel:
+        assert_same_second_order(model, expected)
+    else:
+        assert model.distribution([60, 62]) == pytest.approx(expected.distribution([60, 62]))
+
+def test_played_markov_motifs_are_learned(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    motif_gen = MotifGen(with_markov=True, markov_max_order=2)
+    motif_gen.set_probabilities([0.0, 0.0, 1.0] + [0.0] * 9)
+    motif_gen.set_scale('maj')
+    motif_gen.set_trend(0)
+    notes, _, trend, key = motif_gen.choose_motif()
+    model = motif_gen.markov_manager.get_model(trend=0, scale='maj')
+    before = model.root.counts.copy()
+    motif_gen.learn(notes, trend, 'maj', key)
+    # The motif was transposed up two semitones to d, it is learned in c
+    assert model.root.counts - before == Counter((np.asarray(notes) - 2).tolist())
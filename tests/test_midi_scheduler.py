@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import pytest
+from mido import Message
+
+from midi_output import MemoryPort
+from midi_scheduler import MidiScheduler
+
+def note(number, channel=0):
+    return Message('note_on', note=number, velocity=100, channel=channel)
+
+@pytest.fixture
+def scheduler():
+    scheduler = MidiScheduler()
+    yield scheduler
+    scheduler.stop(release_voices=False)
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+def test_messages_are_sent_in_time_order(scheduler):
+    port = MemoryPort('port', scheduler.now)
+    start = scheduler.now() + 0.05
+    # Scheduled out of order, with two messages at the same time
+    for offset, number in ((0.03, 3), (0.0, 1), (0.01, 2), (0.01, 4)):
+        scheduler.schedule(start + offset, port, note(number))
+    wait_for(lambda: len(port.messages) == 4)
+    assert [message.note for _, message in port.messages] == [1, 2, 4, 3]
+    for (sent, message), intended in zip(port.messages, (0.0, 0.01, 0.01, 0.03)):
+        assert start + intended <= sent < start + intended + 0.05
+
+def test_earlier_event_wakes_the_dispatch_thread(scheduler):
+    port = MemoryPort('port', scheduler.now)
+    now = scheduler.now()
+    scheduler.schedule(now + 10, port, note(1))
+    scheduler.schedule(now + 0.01, port, note(2))
+    wait_for(lambda: port.messages)
+    assert port.messages[0][0] - now < 0.1
+
+def test_cancel_drops_only_the_channel(scheduler):
+    port = MemoryPort('port', scheduler.now)
+    when = scheduler.now() + 0.05
+    scheduler.schedule(when, port, note(1, channel=0))
+    scheduler.schedule(when, port, note(2, channel=1))
+    scheduler.cancel(0)
+    wait_for(lambda: port.messages)
+    time.sleep(0.02)
+    assert [message.channel for _, message in port.messages] == [1]
+
+def test_all_notes_off_releases_sounding_notes(scheduler):
+    port = MemoryPort('port', scheduler.now)
+    scheduler.schedule_note(port, 60, 100, scheduler.now(), 10, channel=2)
+    wait_for(lambda: port.messages)
+    scheduler.all_notes_off(2)
+    wait_for(lambda: len(port.messages) == 3)
+    assert [message.type for _, message in port.messages] == ['note_on', 'note_off', 'control_change']
+    assert scheduler.voices.voice_count() == 0
+    time.sleep(0.02)
+    assert len(port.messages) == 3
+
+def test_wait_until_does_not_block_the_event_loop(scheduler):
+    async def run():
+        ticks = 0
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+        ticker = asyncio.create_task(tick())
+        await scheduler.wait_until(scheduler.now() + 0.1)
+        ticker.cancel()
+        return ticks
+    assert asyncio.run(run()) > 5
+
+def test_stop_releases_notes_and_drops_pending_messages():
+    scheduler = MidiScheduler()
+    port = MemoryPort('port', scheduler.now)
+    scheduler.schedule_note(port, 60, 100, scheduler.now(), 10)
+    wait_for(lambda: port.messages)
+    scheduler.stop()
+    assert [message.type for _, message in port.messages] == ['note_on', 'note_off', 'control_change']
+    assert not scheduler.thread.is_alive()
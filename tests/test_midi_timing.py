@@ -0,0 +1,52 @@
+import csv
+
+import pytest
+from mido import Message
+
+from midi_timing import TimingMonitor
+
+NOTE = Message('note_on', note=60, velocity=100, channel=3)
+
+def test_latency_and_jitter_statistics():
+    monitor = TimingMonitor()
+    for i, latency in enumerate((0.001, 0.003, 0.002, 0.002)):
+        monitor.record('harp', NOTE, i, i + latency)
+    stats = monitor.stats()['harp']
+    assert stats['count'] == 4
+    assert stats['latency_max_ms'] == pytest.approx(3)
+    assert stats['latency_p50_ms'] == pytest.approx(2)
+    # Jitters are 0, 2, 1 and 0 ms
+    assert stats['jitter_max_ms'] == pytest.approx(2)
+    assert stats['jitter_p50_ms'] == pytest.approx(0.5)
+    assert monitor.format_stats().startswith('MIDI_TIMING: harp: sent=4 ')
+
+def test_statistics_cover_the_rolling_window():
+    monitor = TimingMonitor(window=10)
+    for i in range(10):
+        monitor.record('drone', NOTE, i, i + 0.05)
+    for i in range(10):
+        monitor.record('drone', NOTE, i, i + 0.001)
+    stats = monitor.stats()['drone']
+    assert stats['count'] == 20
+    assert stats['latency_max_ms'] == pytest.approx(1)
+
+def test_histogram_clips_late_messages_into_the_last_bin():
+    monitor = TimingMonitor(bin_width=0.001, max_latency=0.01)
+    for latency in (0.0005, 0.0015, 1.0):
+        monitor.record('harp', NOTE, 0, latency)
+    counts, edges = monitor.histogram('harp')
+    assert counts.sum() == 3
+    assert counts[0] == 1 and counts[1] == 1 and counts[-1] == 1
+    assert edges[-1] == pytest.approx(0.01)
+
+def test_trace_export(tmp_path):
+    monitor = TimingMonitor()
+    monitor.record('harp', NOTE, 1.0, 1.002)
+    monitor.record('drone', Message('control_change', control=123, value=0), 2.0, 2.0)
+    path = tmp_path / 'trace.csv'
+    monitor.export_trace(str(path))
+    with open(path, newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert [row['port'] for row in rows] == ['harp', 'drone']
+    assert rows[0]['note'] == '60' and rows[0]['channel'] == '3'
+    assert float(rows[0]['latency_ms']) == pytest.approx(2)
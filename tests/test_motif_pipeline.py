@@ -0,0 +1,98 @@
+import asyncio
+import threading
+
+import pytest
+
+from motif_pipeline import MotifPipeline
+
+class FakeMotifGen:
+    """Returns (version, call number) as the motif, optionally blocking until released."""
+    def __init__(self):
+        self.version = 0
+        self.calls = 0
+        self.error = None
+        self.gate = None
+
+    def choose_motif(self):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.version, self.calls
+
+async def settle(pipeline, generated):
+    for _ in range(500):
+        if pipeline.generated >= generated:
+            await asyncio.sleep(0.01)
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("the producer did not generate in time")
+
+def test_generates_ahead_up_to_the_depth():
+    async def scenario():
+        motif_gen = FakeMotifGen()
+        pipeline = MotifPipeline(motif_gen, depth=3)
+        pipeline.start()
+        await settle(pipeline, 3)
+        assert len(pipeline.queue) == 3
+        assert motif_gen.calls == 3
+        assert await pipeline.get() == (0, 1)
+        await settle(pipeline, 4)
+        assert len(pipeline.queue) == 3
+        assert pipeline.waited == 0
+        await pipeline.close()
+    asyncio.run(scenario())
+
+def test_parameter_change_discards_queued_motifs():
+    async def scenario():
+        motif_gen = FakeMotifGen()
+        pipeline = MotifPipeline(motif_gen, depth=2)
+        pipeline.start()
+        await settle(pipeline, 2)
+        motif_gen.version = 1
+        pipeline.refresh()
+        assert pipeline.discarded == 2
+        version, _ = await pipeline.get()
+        assert version == 1
+        await pipeline.close()
+    asyncio.run(scenario())
+
+def test_motif_generated_during_a_parameter_change_is_discarded():
+    async def scenario():
+        motif_gen = FakeMotifGen()
+        motif_gen.gate = threading.Event()
+        pipeline = MotifPipeline(motif_gen, depth=1)
+        pipeline.start()
+        await asyncio.sleep(0.05)
+        motif_gen.version = 1
+        motif_gen.gate.set()
+        assert (await pipeline.get())[0] == 1
+        assert pipeline.discarded >= 1
+        await pipeline.close()
+    asyncio.run(scenario())
+
+def test_generation_errors_reach_the_caller():
+    async def scenario():
+        motif_gen = FakeMotifGen()
+        motif_gen.error = RuntimeError("no model")
+        pipeline = MotifPipeline(motif_gen, depth=1)
+        pipeline.start()
+        with pytest.raises(RuntimeError, match="no model"):
+            await asyncio.wait_for(pipeline.get(), 5)
+        motif_gen.error = None
+        assert await asyncio.wait_for(pipeline.get(), 5) is not None
+        await pipeline.close()
+    asyncio.run(scenario())
+
+def test_close_stops_the_producer():
+    async def scenario():
+        motif_gen = FakeMotifGen()
+        pipeline = MotifPipeline(motif_gen, depth=1)
+        pipeline.start()
+        await settle(pipeline, 1)
+        task = pipeline.task
+        await pipeline.close()
+        assert task.done() and pipeline.task is None
+        await pipeline.close()
+    asyncio.run(scenario())
@@ -0,0 +1,44 @@
+import csv
+import os
+import json
+
+import pytest
+
+from conftest import ROOT
+from motif_store import MotifStore
+
+MOTIVES_PATH = os.path.join(ROOT, "motifs_df", "midi_motives.csv")
+
+def test_from_csv_matches_the_csv():
+    with open(MOTIVES_PATH, newline='') as file:
+        rows = list(csv.DictReader(file))
+    store = MotifStore.from_csv(MOTIVES_PATH)
+    assert len(store) == len(rows)
+    for motif_id, row in enumerate(rows):
+        assert store.motif(motif_id).tolist() == json.loads(row["midi_notes"])
+    for direction, scale in {(int(row["direction"]), row["scale"]) for row in rows}:
+        assert store.count(direction, scale) == sum(int(row["direction"]) == direction and row["scale"] == scale
+                                                    for row in rows)
+
+def test_choose_returns_a_motif_of_the_group():
+    store = MotifStore([(0, 'maj', [60, 62]), (1, 'maj', [64, 62, 60]), (0, 'maj', [67]), (0, 'min', [57, 60])])
+    chosen = {tuple(store.choose(0, 'maj').tolist()) for _ in range(200)}
+    assert chosen == {(60, 62), (67,)}
+    assert store.choose(1, 'maj').tolist() == [64, 62, 60]
+
+def test_missing_group():
+    store = MotifStore([(0, 'maj', [60, 62])])
+    assert store.choose(1, 'min') is None
+    assert store.count(1, 'min') == 0
+    assert store.count(0, 'maj') == 1
+
+def test_motifs_are_read_only():
+    store = MotifStore([(0, 'maj', [60, 62])])
+    with pytest.raises(ValueError):
+        store.choose(0, 'maj')[0] = 0
+
+def test_empty_motifs_keep_the_offsets_aligned():
+    store = MotifStore([(0, 'maj', [60]), (0, 'min', []), (1, 'maj', [62, 64])])
+    assert len(store) == 3
+    assert store.motif(1).tolist() == []
+    assert store.motif(2).tolist() == [62, 64]
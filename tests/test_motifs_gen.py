@@ -0,0 +1,30 @@
+import pytest
+
+from conftest import ROOT
+from motifs_gen import MotifGen
+from utils import UP
+
+@pytest.fixture(autouse=True)
+def repository_root(monkeypatch):
+    monkeypatch.chdir(ROOT)
+
+def markov_motif_gen(key_index):
+    motif_gen = MotifGen(with_markov=True)
+    motif_gen.set_probabilities([1.0 if index == key_index else 0.0 for index in range(12)])
+    motif_gen.set_scale('maj')
+    motif_gen.set_trend(UP)
+    return motif_gen
+
+def test_markov_motifs_start_with_the_initial_note(monkeypatch):
+    monkeypatch.setattr("motifs_gen.sample_initial_note", lambda direction, scale: 60)
+    for key_index in (0, 2):
+        notes, _, _, _ = markov_motif_gen(key_index).choose_motif()
+        # The -1 start marker is not played, transposed to c it is not even a valid MIDI note
+        assert len(notes) == 8
+        assert notes[0] == 60 + key_index
+
+def test_markov_motifs_are_valid_midi_notes():
+    motif_gen = markov_motif_gen(0)
+    for _ in range(50):
+        notes, _, _, _ = motif_gen.choose_motif()
+        assert all(0 <= note <= 127 for note in notes)
@@ -0,0 +1,249 @@
+import asyncio
+import os
+import socket
+import stat
+import threading
+
+import pytest
+
+from protocol import (FrameDecoder, MAX_FRAME_SIZE, PersistentClient, decode_message, encode_frame, encode_message,
+                      read_frame, start_server, transport_address)
+
+def test_frames_survive_any_chunking():
+    payloads = [b'', b'a', b'hello' * 100, bytes(range(256))]
+    stream = b''.join(encode_frame(payload) for payload in payloads)
+    for chunk_size in (1, 3, 7, len(stream)):
+        decoder = FrameDecoder()
+        received = []
+        for start in range(0, len(stream), chunk_size):
+            received += decoder.feed(stream[start:start + chunk_size])
+        assert received == payloads
+        assert decoder.buffer == b''
+
+def test_oversized_frames_are_rejected():
+    with pytest.raises(ValueError):
+        FrameDecoder().feed(encode_frame(b'x' * (MAX_FRAME_SIZE + 1)))
+
+def test_read_frame():
+    async def read(data):
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return [await read_frame(reader), await read_frame(reader)]
+    assert asyncio.run(read(encode_frame(b'one') + encode_frame(b'two'))) == [b'one', b'two']
+    with pytest.raises(asyncio.IncompleteReadError):
+        asyncio.run(read(encode_frame(b'one') + encode_frame(b'two')[:5]))
+
+class FrameServer:
+    # A TCP server collecting the payloads it receives, for testing the client side
+    def __init__(self):
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.address = self.listener.getsockname()
+        self.payloads = []
+        self.connections = []
+        self.received = threading.Condition()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections.append(connection)
+            threading.Thread(target=self._read, args=(connection,), daemon=True).start()
+
+    def _read(self, connection):
+        decoder = FrameDecoder()
+        while True:
+            try:
+                data = connection.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            with self.received:
+                self.payloads += decoder.feed(data)
+                self.received.notify_all()
+
+    def wait_for(self, predicate):
+        with self.received:
+            assert self.received.wait_for(lambda: predicate(self.payloads), timeout=5)
+
+    def drop_connections(self):
+        for connection in self.connections:
+            connection.shutdown(socket.SHUT_RDWR)
+            connection.close()
+        self.connections = []
+
+    def close(self):
+        self.drop_connections()
+        self.listener.close()
+
+@pytest.fixture
+def server():
+    server = FrameServer()
+    yield server
+    server.close()
+
+def test_client_keeps_one_connection(server):
+    client = PersistentClient('tcp', server.address, heartbeat_interval=10)
+    for i in range(5):
+        client.send(b'message %d' % i)
+    server.wait_for(lambda payloads: len(payloads) == 5)
+    client.close()
+    assert server.payloads == [b'message %d' % i for i in range(5)]
+    assert len(server.connections) == 1
+
+def test_client_reconnects_after_the_connection_is_lost(server):
+    client = PersistentClient('tcp', server.address, heartbeat_interval=10)
+    client.send(b'before')
+    server.wait_for(lambda payloads: payloads == [b'before'])
+    server.drop_connections()
+    # The first send may still succeed into the dead socket's buffer, a later one notices and reconnects
+    for _ in range(20):
+        client.send(b'after')
+        if b'after' in server.payloads:
+            break
+    server.wait_for(lambda payloads: b'after' in payloads)
+    client.close()
+
+def test_client_replays_the_last_update_after_reconnecting(server):
+    client = PersistentClient('tcp', server.address, heartbeat_interval=0.05)
+    client.send(b'old state', replay=True)
+    client.send(b'state', replay=True)
+    client.send(b'close')
+    server.wait_for(lambda payloads: b'close' in payloads)
+    server.drop_connections()
+    # The heartbeat reconnects, and the new connection starts with the last replayed message
+    server.wait_for(lambda payloads: payloads.count(b'state') == 2)
+    client.close()
+    assert server.payloads.count(b'old state') == 1
+    assert server.payloads.count(b'close') == 1
+
+def test_replayed_message_is_not_sent_twice_on_connecting(server):
+    client = PersistentClient('tcp', server.address, heartbeat_interval=10)
+    client.send(b'state', replay=True)
+    client.send(b'next')
+    server.wait_for(lambda payloads: b'next' in payloads)
+    client.close()
+    assert server.payloads == [b'state', b'next']
+
+def test_client_sends_heartbeats_while_idle(server):
+    client = PersistentClient('tcp', server.address, heartbeat_interval=0.05)
+    client.send(b'update')
+    server.wait_for(lambda payloads: len(payloads) >= 3)
+    client.close()
+
+def test_client_backs_off_without_a_server():
+    listener = socket.create_server(('127.0.0.1', 0))
+    address = listener.getsockname()
+    listener.close()
+    client = PersistentClient('tcp', address, heartbeat_interval=10)
+    with pytest.raises(OSError):
+        client.send(b'lost')
+    # Retrying right away fails fast without trying to connect
+    with pytest.raises(ConnectionError, match="retrying"):
+        client.send(b'lost')
+    client.close()
+
+UPDATE = {
+    "close": False,
+    "pitch_probabilities": [0.5, 0.25, 0.125] + [0.125 / 9] * 9,
+    "scale": 'min',
+    "trend": 2,
+    "duration": 0.15,
+    "active_color_flag": True,
+    "key": 'g_b',
+}
+
+@pytest.mark.parametrize("wire_format", ['binary', 'json'])
+def test_messages_round_trip(wire_format):
+    decoded = decode_message(encode_message(UPDATE, wire_format))
+    # Binary probabilities are single precision
+    assert decoded["pitch_probabilities"] == pytest.approx(UPDATE["pitch_probabilities"], rel=1e-6)
+    assert {**decoded, "pitch_probabilities": None} == {**UPDATE, "pitch_probabilities": None}
+    for message in ({"close": True}, {"heartbeat": True}):
+        assert decode_message(encode_message(message, wire_format)) == message
+
+def test_missing_scale_and_key_round_trip():
+    message = {**UPDATE, "scale": None, "key": None, "active_color_flag": False}
+    decoded = decode_message(encode_message(message, 'binary'))
+    assert (decoded["scale"], decoded["key"], decoded["active_color_flag"]) == (None, None, False)
+
+def test_binary_update_is_compact():
+    assert len(encode_message(UPDATE, 'binary')) < len(encode_message(UPDATE, 'json')) / 4
+
+def test_unknown_message_types_are_passed_on():
+    assert decode_message(bytes([1, 200]) + b'body') == {"control": 200, "body": b'body'}
+
+@pytest.mark.parametrize("payload", [
+    b'',
+    b'\x01',
+    bytes([9, 1]),
+    encode_message(UPDATE, 'binary')[:-3],
+    encode_message(UPDATE, 'binary')[:-1] + bytes([200]),
+    b'{"close": tru',
+], ids=["empty", "short header", "unknown version", "short update", "bad key", "broken json"])
+def test_malformed_messages_raise_value_error(payload):
+    with pytest.raises(ValueError):
+        decode_message(payload)
+
+def test_transport_address():
+    assert transport_address('tcp')[0] == 'tcp'
+    assert transport_address('unix')[0] == 'unix'
+    with pytest.raises(ValueError):
+        transport_address('udp')
+
+def test_unix_socket_round_trip(tmp_path):
+    path = str(tmp_path / "generator.sock")
+    async def run():
+        received = []
+        async def client_connected(reader, writer):
+            received.append(decode_message(await read_frame(reader)))
+            writer.close()
+        server = await start_server(client_connected, 'unix', path)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        client = PersistentClient('unix', path, heartbeat_interval=10)
+        await asyncio.to_thread(client.send, encode_message({"close": True}))
+        while not received:
+            await asyncio.sleep(0.01)
+        client.close()
+        server.close()
+        await server.wait_closed()
+        return received
+    assert asyncio.run(run()) == [{"close": True}]
+
+def test_stale_socket_is_replaced(tmp_path):
+    path = str(tmp_path / "generator.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    async def run():
+        server = await start_server(lambda reader, writer: None, 'unix', path)
+        # A second generator on the same path is refused while the first one listens
+        with pytest.raises(OSError, match="already listening"):
+            await start_server(lambda reader, writer: None, 'unix', path)
+        server.close()
+        await server.wait_closed()
+    asyncio.run(run())
+
+def test_unix_socket_is_created_private(tmp_path, monkeypatch):
+    path = str(tmp_path / "private.sock")
+    modes = []
+    real_bind = socket.socket.bind
+    def bind(sock, address):
+        real_bind(sock, address)
+        # The mode right after binding, before anything could change it
+        modes.append(stat.S_IMODE(os.stat(address).st_mode))
+    monkeypatch.setattr(socket.socket, "bind", bind)
+    async def start():
+        server = await start_server(lambda reader, writer: None, 'unix', path)
+        server.close()
+        await server.wait_closed()
+    umask = os.umask(0o022)
+    try:
+        asyncio.run(start())
+    finally:
+        assert os.umask(umask) == 0o022
+    assert modes == [0o600]
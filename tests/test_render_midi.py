@@ -0,0 +1,55 @@
+import asyncio
+
+import mido
+import pytest
+
+from conftest import ROOT
+from midi_output import NullBackend
+from midi_scheduler import MidiScheduler, VirtualClockScheduler
+from motifs_gen import MotifGen
+from render_midi import render
+from utils import UP
+
+@pytest.fixture(autouse=True)
+def repository_root(monkeypatch):
+    monkeypatch.chdir(ROOT)
+
+def test_render_writes_balanced_notes(tmp_path):
+    path = str(tmp_path / "render.mid")
+    harp, drone = asyncio.run(asyncio.wait_for(render(path, 60, key='d', trend=UP, sessions=2), 30))
+    assert harp > 0 and drone > 0
+    midi = mido.MidiFile(path)
+    assert len(midi.tracks) == 2
+    for track in midi.tracks:
+        sounding = {}
+        for message in track:
+            if message.type == 'note_on' and message.velocity > 0:
+                sounding[(message.channel, message.note)] = sounding.get((message.channel, message.note), 0) + 1
+            elif message.type == 'note_off':
+                sounding[(message.channel, message.note)] -= 1
+        assert not any(sounding.values())
+    assert 55 < midi.length < 70
+
+def test_render_stops_when_no_motif_is_generated(tmp_path, monkeypatch):
+    monkeypatch.setattr(MotifGen, "choose_motif", lambda self: None)
+    with pytest.raises(ValueError, match="generated no notes"):
+        asyncio.run(asyncio.wait_for(render(str(tmp_path / "silent.mid"), 60), 30))
+
+def test_virtual_clock_scheduler_shares_the_base_setup():
+    scheduler = VirtualClockScheduler()
+    base = MidiScheduler()
+    base.stop()
+    assert set(vars(base)) <= set(vars(scheduler))
+    assert scheduler.thread is None
+    assert scheduler.now() == 0
+
+def test_virtual_clock_advances_through_silence():
+    backend = NullBackend()
+    scheduler = backend.scheduler
+    async def run():
+        await scheduler.wait_idle(asyncio.Event(), 2)
+        closed = asyncio.Event()
+        closed.set()
+        await scheduler.wait_idle(closed, 2)
+    asyncio.run(run())
+    assert scheduler.now() == 2
@@ -0,0 +1,45 @@
+import random
+
+import pytest
+
+from stroke_features import StrokeFeatureEstimator, calculate_duration, classify_trend
+from utils import UP, DOWN, VARYING, CONSTANT
+
+def window_trend(directions):
+    return classify_trend(directions.count(UP), directions.count(DOWN), directions.count(CONSTANT), len(directions))
+
+def test_trend_matches_the_last_window():
+    rng = random.Random(3)
+    estimator = StrokeFeatureEstimator(window=20)
+    history = []
+    for _ in range(500):
+        direction = rng.choice([UP, UP, UP, DOWN, CONSTANT])
+        before = estimator.trend
+        changed = estimator.add_direction(direction)
+        history.append(direction)
+        if len(history) >= 20:
+            assert estimator.trend == window_trend(history[-20:])
+        else:
+            assert estimator.trend == CONSTANT
+        assert changed == (estimator.trend != before)
+
+def test_speed_is_the_mean_of_the_last_window():
+    rng = random.Random(4)
+    estimator = StrokeFeatureEstimator(window=10)
+    speeds = []
+    for _ in range(55):
+        speed = rng.uniform(0, 8000)
+        estimator.add_speed(speed)
+        speeds.append(speed)
+        assert estimator.speed_measure == pytest.approx(sum(speeds[-10:]) / len(speeds[-10:]))
+
+def test_trend_classification():
+    assert classify_trend(100, 0, 0, 100) == UP
+    assert classify_trend(0, 100, 0, 100) == DOWN
+    assert classify_trend(10, 10, 80, 100) == CONSTANT
+    assert classify_trend(50, 45, 5, 100) == VARYING
+
+def test_faster_strokes_give_shorter_notes():
+    durations = [calculate_duration(speed) for speed in (0, 200, 800, 2000, 4000, 6000, 9000)]
+    assert durations == sorted(durations, reverse=True)
+    assert durations[0] == 0.35 and durations[-1] == 0.05
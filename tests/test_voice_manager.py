@@ -0,0 +1,64 @@
+from mido import Message
+
+from voice_manager import ALL_NOTES_OFF, VoiceManager
+
+def on(note, channel=0):
+    return Message('note_on', note=note, velocity=100, channel=channel)
+
+def off(note, channel=0):
+    return Message('note_off', note=note, velocity=0, channel=channel)
+
+def test_channels_are_handed_out_once():
+    voices = VoiceManager(channels=range(2))
+    assert [voices.acquire_channel(), voices.acquire_channel(), voices.acquire_channel()] == [0, 1, None]
+    voices.release_channel(1)
+    voices.release_channel(1)
+    assert voices.free_channels == [1]
+
+def test_doubled_note_sounds_until_its_last_note_off():
+    voices = VoiceManager()
+    assert voices.filter('harp', on(60)) == [on(60)]
+    assert voices.filter('harp', on(60)) == [on(60)]
+    assert voices.filter('harp', off(60)) == []
+    assert voices.filter('harp', off(60)) == [off(60)]
+    assert voices.voice_count() == 0
+
+def test_oldest_voice_is_stolen():
+    voices = VoiceManager(max_voices=2)
+    voices.filter('harp', on(60))
+    voices.filter('harp', on(62))
+    assert voices.filter('harp', on(64)) == [off(60), on(64)]
+    assert voices.stolen == 1
+    # The note_off of the stolen note passes through without creating a voice
+    assert voices.filter('harp', off(60)) == [off(60)]
+    assert voices.voice_count() == 2
+
+def test_notes_are_tracked_per_port_and_channel():
+    voices = VoiceManager(max_voices=1)
+    voices.filter('harp', on(60, channel=0))
+    voices.filter('harp', on(60, channel=1))
+    voices.filter('drone', on(60, channel=0))
+    assert voices.stolen == 0
+    assert voices.voice_count() == 3
+
+def test_release_turns_off_a_channel():
+    voices = VoiceManager()
+    voices.filter('harp', on(60, channel=0))
+    voices.filter('harp', on(62, channel=1))
+    voices.filter('drone', on(40, channel=1))
+    released = voices.release(1)
+    assert sorted((port, message.type, getattr(message, 'note', None)) for port, message in released) == [
+        ('drone', 'control_change', None), ('drone', 'note_off', 40),
+        ('harp', 'control_change', None), ('harp', 'note_off', 62)]
+    assert all(message.control == ALL_NOTES_OFF for _, message in released if message.type == 'control_change')
+    assert voices.voice_count() == 1
+    assert [message.note for _, message in voices.release() if message.type == 'note_off'] == [60]
+
+def test_other_messages_pass_through():
+    voices = VoiceManager()
+    message = Message('control_change', control=7, value=100)
+    assert voices.filter('harp', message) == [message]
+    # A note_on with velocity 0 is a note_off
+    voices.filter('harp', on(60))
+    assert voices.filter('harp', Message('note_on', note=60, velocity=0)) == [Message('note_on', note=60, velocity=0)]
+    assert voices.voice_count() == 0
@@ -1,6 +1,6 @@
-import pandas as pd
 import json
-import random
+import os
+import time
 
 UP = 0
 DOWN = 1
@@ -79,15 +79,60 @@ def get_initial_notes(data, direction, scale):
             return entry['initial_note']
     return None
 
-def sample_initial_note(direction:int, scale:str):
-    """Load data, find initial notes for given direction and scale, and randomly sample one note."""
-    data = load_data('motifs_df/initial_notes.json')
-    initial_notes = get_initial_notes(data, direction, scale)
+class InitialNoteIndex:
+    """
+    The initial-note distributions of the Markov models, loaded once and indexed by (direction, scale).
+    Every distribution is stored as its distinct notes and their cumulative counts, so sampling is a binary
+    search over integer weights. The file is reloaded when it changes, checked at most every `check_interval` seconds.
+    """
+    def __init__(self, filepath, check_interval=1.0):
+        self.filepath = filepath
+        self.check_interval = check_interval
+        self.mtime = None
+        self.next_check = 0.0
+        self.index = {}
 
-    if initial_notes:
-        sampled_note = random.choice(initial_notes)
-        print(f"Randomly sampled note: {sampled_note}")
-        return int(sampled_note)
-    else:
+    def load(self):
+        """Parse the file into (notes, cumulative counts) integer arrays per (direction, scale)."""
+        # NumPy is imported here, utils is also imported by the drawing app before its window appears
+        import numpy as np
+        mtime = os.stat(self.filepath).st_mtime_ns
+        index = {}
+        for entry in load_data(self.filepath):
+            notes, counts = np.unique(np.array(entry['initial_note'], dtype=np.int64), return_counts=True)
+            if len(notes):
+                index[(entry['direction'], entry['scale'])] = (notes, np.cumsum(counts))
+        self.index = index
+        self.mtime = mtime
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        self.next_check = now + self.check_interval
+        if self.mtime is None or os.stat(self.filepath).st_mtime_ns != self.mtime:
+            self.load()
+
+    def sample(self, direction, scale, size=None):
+        """
+        Sample initial notes for a direction and scale, weighted by how often they start a motif.
+        Returns one note, or an array of `size` notes, or None if there is no distribution for the direction and scale.
+        """
+        self._refresh()
+        distribution = self.index.get((direction, scale))
+        if distribution is None:
+            return None
+        import numpy as np
+        notes, cumulative = distribution
+        picks = np.random.randint(cumulative[-1], size=size)
+        sampled = notes[np.searchsorted(cumulative, picks, side='right')]
+        return int(sampled) if size is None else sampled
+
+initial_note_index = InitialNoteIndex('motifs_df/initial_notes.json')
+
+def sample_initial_note(direction:int, scale:str):
+    """Randomly sample an initial note for the given direction and scale."""
+    sampled_note = initial_note_index.sample(direction, scale)
+    if sampled_note is None:
         print(f"No initial notes found for direction {direction} and scale {scale}")
-        return None
\ No newline at end of file
+    return sampled_note
@@ -0,0 +1,111 @@
+import threading
+from collections import OrderedDict
+
+from mido import Message
+
+MIDI_CHANNELS = 16
+# MIDI controller that turns off every note on a channel
+ALL_NOTES_OFF = 123
+
+class VoiceManager:
+    """
+    Tracks every sounding note per output port and channel and hands out channels to motif streams.
+    Every message the scheduler sends passes through filter(), which keeps the note counts up to date, steals the
+    oldest voice when a channel reaches max_voices and keeps a note that was started twice sounding until both
+    note_offs arrived. release() turns off whatever is still sounding, so no note is left hanging.
+
+    Attributes:
+        max_voices (int): The maximum number of notes sounding at once per port and channel.
+        free_channels (list): The channels not assigned to a stream.
+        stolen (int): The number of notes turned off early to stay within max_voices.
+    """
+    def __init__(self, channels=range(MIDI_CHANNELS), max_voices=16):
+        """
+        Initializes the channel pool with no notes sounding.
+
+        Parameters:
+            channels (iterable): The channels that can be assigned to streams.
+            max_voices (int): The maximum number of notes sounding at once per port and channel.
+        """
+        self.max_voices = max_voices
+        self.free_channels = list(channels)
+        self.lock = threading.Lock()
+        # (port, channel) -> note -> number of note_ons not yet matched by a note_off, oldest note first
+        self.sounding = {}
+        self.stolen = 0
+
+    def acquire_channel(self):
+        """
+        Assigns a free channel to a stream.
+
+        Returns:
+            int: The channel, or None if every channel is in use.
+        """
+        with self.lock:
+            return self.free_channels.pop(0) if self.free_channels else None
+
+    def release_channel(self, channel):
+        with self.lock:
+            if channel not in self.free_channels:
+                self.free_channels.append(channel)
+
+    def filter(self, port, message):
+        """
+        Updates the sounding notes with a message that is about to be sent.
+
+        Parameters:
+            port: The output port the message is sent on.
+            message (mido.Message): The message.
+
+        Returns:
+            list: The messages to send in its place, in order. Empty if a note_off has to be held back because the
+                  note was started again, preceded by a note_off for the oldest note if a voice had to be stolen.
+        """
+        if message.type not in ('note_on', 'note_off'):
+            return [message]
+        with self.lock:
+            key = (port, message.channel)
+            if message.type == 'note_on' and message.velocity > 0:
+                notes = self.sounding.setdefault(key, OrderedDict())
+                messages = []
+                if message.note in notes:
+                    notes[message.note] += 1
+                else:
+                    if len(notes) >= self.max_voices:
+                        oldest, _ = notes.popitem(last=False)
+                        messages.append(Message('note_off', note=oldest, velocity=0, channel=message.channel))
+                        self.stolen += 1
+                    notes[message.note] = 1
+                messages.append(message)
+                return messages
+            notes = self.sounding.get(key, {})
+            count = notes.get(message.note, 0)
+            if count > 1:
+                notes[message.note] = count - 1
+                return []
+            notes.pop(message.note, None)
+            return [message]
+
+    def release(self, channel=None):
+        """
+        Forgets the sounding notes and returns the messages that turn them off.
+
+        Parameters:
+            channel (int): Only release the notes on this channel, all channels if None.
+
+        Returns:
+            list: (port, message) pairs, a note_off for every sounding note followed by an all notes off
+                  controller for every released channel.
+        """
+        with self.lock:
+            keys = [key for key in self.sounding if channel is None or key[1] == channel]
+            messages = []
+            for port, key_channel in keys:
+                for note in self.sounding.pop((port, key_channel)):
+                    messages.append((port, Message('note_off', note=note, velocity=0, channel=key_channel)))
+                messages.append((port, Message('control_change', control=ALL_NOTES_OFF, value=0, channel=key_channel)))
+            return messages
+
+    def voice_count(self):
+        with self.lock:
+            return sum(len(notes) for notes in self.sounding.values())